@@ -0,0 +1,137 @@
+# benchmarks/benchmark_extract.py
+
+"""
+This script benchmarks extraction end to end against the local mock Spotify API (mock_spotify_server.py).
+
+It runs the real fetch_tracks_from_playlists_by_year of spotify_extract.py (or of spotify_extract_async.py
+with --async) with its rate limiter and caches, starting from an empty cache, and reports API calls per second,
+tracks per second, and the total wall time. With --warm, a first run fills the caches and the second run is measured.
+
+Usage:
+- python benchmarks/benchmark_extract.py [--years 10] [--playlists-per-year 5] [--tracks-per-playlist 200]
+  [--latency 0.02] [--page-size 100] [--throttle-rate 0.0] [--rate 10] [--artists] [--async] [--warm] [--fixture raw.json]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# the extractor's Spotify client needs credentials; the mock server accepts any
+os.environ.setdefault("client_id", "benchmark")
+os.environ.setdefault("client_secret", "benchmark")
+
+import spotify_extract
+import spotify_extract_async
+from mock_spotify_server import MockSpotifyServer, recorded_playlists, synthetic_playlists
+
+
+def use_mock_server(server, cache_dir):
+    """
+    Point the extractor (sync and async) at the mock server and at a separate local cache.
+
+    :param server: running MockSpotifyServer.
+    :param cache_dir: directory for the cache database of the benchmark run.
+    """
+    # the mock token must not end up in the token cache of real runs
+    spotify_extract.TOKEN_CACHE_PATH = os.path.join(cache_dir, "spotify_token.json")
+    client = spotify_extract.get_client()
+    client.prefix = server.url + "/v1/"
+    client.auth_manager.OAUTH_TOKEN_URL = server.url + "/api/token"
+    spotify_extract_async.API_BASE_URL = server.url + "/v1"
+
+    # the caches connect lazily, so they can still be moved before the first lookup
+    for cache in extractor_caches():
+        cache.close()
+        cache.path = os.path.join(cache_dir, "spotify_cache.db")
+
+
+def extractor_caches():
+    """
+    :return: the local caches of the extractor.
+    """
+    caches = [spotify_extract.audio_features_cache, spotify_extract.artists_cache, spotify_extract.playlist_index,
+              spotify_extract.search_cache]
+    if spotify_extract.http_cache is not None:
+        caches.append(spotify_extract.http_cache.cache)
+    return caches
+
+
+def set_rate(rate):
+    """
+    :param rate: requests per second the shared rate limiter starts at and may recover to.
+    """
+    limiter = spotify_extract.rate_limiter
+    limiter.rate = limiter.burst = limiter.tokens = float(rate)
+    limiter.max_rate = max(limiter.max_rate, float(rate))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark extraction against the mock Spotify API.")
+    parser.add_argument("--year-start", type=int, default=1910)
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--playlists-per-year", type=int, default=5)
+    parser.add_argument("--tracks-per-playlist", type=int, default=200)
+    parser.add_argument("--fixture", help="recorded raw extract to serve instead of synthetic playlists")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every request")
+    parser.add_argument("--page-size", type=int, default=100, help="maximum playlist items per page")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1)
+    parser.add_argument("--rate", type=float, help="requests per second of the rate limiter (default: RATE_LIMIT)")
+    parser.add_argument("--artists", action="store_true", help="enrich artists as well")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="benchmark spotify_extract_async.py")
+    parser.add_argument("--warm", action="store_true", help="measure a second run, with the caches of a first one")
+    args = parser.parse_args()
+
+    year_range = range(args.year_start, args.year_start + args.years)
+    if args.fixture:
+        playlists = recorded_playlists(args.fixture)
+        year_range = range(min(playlists), max(playlists) + 1)
+    else:
+        playlists = synthetic_playlists(year_range, args.playlists_per_year, args.tracks_per_playlist)
+
+    if args.rate:
+        set_rate(args.rate)
+    spotify_extract.ENRICH_ARTISTS = spotify_extract_async.ENRICH_ARTISTS = args.artists
+
+    server = MockSpotifyServer(playlists, latency=args.latency, page_size=args.page_size,
+                               throttle_rate=args.throttle_rate, retry_after=args.retry_after)
+
+    with server, tempfile.TemporaryDirectory() as cache_dir:
+        use_mock_server(server, cache_dir)
+
+        for run in range(2 if args.warm else 1):
+            server.requests.clear()
+            server.bytes_sent = 0
+            start = time.perf_counter()
+            if args.use_async:
+                tracks = asyncio.run(spotify_extract_async.fetch_tracks_from_playlists_by_year(year_range))
+            else:
+                tracks = spotify_extract.fetch_tracks_from_playlists_by_year(year_range)
+            wall_time = time.perf_counter() - start
+
+        for cache in extractor_caches():
+            cache.close()
+
+    requests = dict(server.requests)
+    calls = sum(count for endpoint, count in requests.items() if endpoint not in ("token", "throttled", "not_modified"))
+    entries = sum(len(tracks) for year in playlists.values() for tracks in year.values())
+
+    print(f"extractor:       {'spotify_extract_async' if args.use_async else 'spotify_extract'}")
+    print(f"playlists:       {sum(len(year) for year in playlists.values())} over {len(year_range)} years, "
+          f"{entries} playlist entries")
+    print(f"API calls:       {calls} ({requests})")
+    print(f"bytes received:  {server.bytes_sent:,}")
+    print(f"unique tracks:   {len(tracks)}")
+    print(f"wall time:       {wall_time:.2f} s")
+    print(f"calls/s:         {calls / wall_time:,.1f}")
+    print(f"tracks/s:        {len(tracks) / wall_time:,.1f}")
+    print(f"rate limiter:    {spotify_extract.rate_limiter.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# benchmarks/benchmark_flatten.py
+
+"""
+This script benchmarks the flattening step of spotify_transform.py.
+
+It compares the original per-track loop (flatten_track + pd.DataFrame) with the vectorized
+flatten_tracks on synthetic raw tracks, reports rows per second for both, and checks that
+both produce exactly the same CSV output.
+
+Usage:
+- python benchmarks/benchmark_flatten.py [number_of_tracks]
+"""
+
+import os
+import random
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from spotify_transform import flatten_track, flatten_tracks
+
+# number of synthetic tracks used when none is given on the command line
+DEFAULT_TRACKS = 200_000
+
+# number of timed runs per implementation; the best run is reported
+RUNS = 3
+
+
+def make_tracks(n, seed=42):
+    """
+    Create synthetic raw tracks shaped like the output of spotify_extract.py,
+    including the edge cases the transform has to handle (missing features, empty dates, empty artist names).
+
+    :param n: number of tracks.
+    :param seed: random seed.
+    :return: list of tracks.
+    """
+    rng = random.Random(seed)
+    tracks = []
+
+    for i in range(n):
+        has_features = rng.random() > 0.05
+        release_date = rng.choice(["", None, f"{rng.randint(1900, 2024)}",
+                                   f"{rng.randint(1900, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"])
+        artist_names = [f"Artist {rng.randint(0, 5000)}" for _ in range(rng.randint(1, 3))]
+        if rng.random() < 0.02:
+            artist_names.append("")
+
+        tracks.append({
+            "id": f"track{i}",
+            "name": f"Song {i}",
+            "popularity": rng.randint(0, 100),
+            "duration_ms": rng.randint(60_000, 600_000),
+            "explicit": rng.random() < 0.2,
+            "album": {"name": f"Album {rng.randint(0, 20000)}", "release_date": release_date, "album_type": "album"},
+            "artist_names": artist_names,
+            "audio_features": {
+                "id": f"track{i}",
+                "danceability": rng.random(),
+                "energy": rng.random(),
+                "key": rng.randint(0, 11),
+                "loudness": -rng.random() * 30,
+                "mode": rng.randint(0, 1),
+                "speechiness": rng.random(),
+                "acousticness": rng.random(),
+                "instrumentalness": rng.random(),
+                "liveness": rng.random(),
+                "valence": rng.random(),
+                "tempo": rng.random() * 200,
+                "time_signature": rng.choice([3, 4, 5]),
+            } if has_features else {},
+        })
+
+    return tracks
+
+
+def flatten_loop(tracks):
+    """The original implementation: one dict per track, then a DataFrame."""
+    return pd.DataFrame([flatten_track(track) for track in tracks])
+
+
+def best_time(func, tracks):
+    """
+    :return: tuple of (best wall time in seconds, result of the last run).
+    """
+    best = float("inf")
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        result = func(tracks)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_TRACKS
+    print(f"Generating {n} synthetic tracks")
+    tracks = make_tracks(n)
+
+    loop_time, loop_df = best_time(flatten_loop, tracks)
+    vectorized_time, vectorized_df = best_time(flatten_tracks, tracks)
+
+    identical = loop_df.to_csv(index=False) == vectorized_df.to_csv(index=False)
+
+    print(f"loop:       {loop_time:.3f} s, {n / loop_time:,.0f} rows/s")
+    print(f"vectorized: {vectorized_time:.3f} s, {n / vectorized_time:,.0f} rows/s")
+    print(f"speedup:    {loop_time / vectorized_time:.2f}x")
+    print(f"identical CSV output: {identical}")
+
+    if not identical:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# benchmarks/benchmark_memory.py
+
+"""
+This script benchmarks the memory an extraction run needs to hold its tracks.
+
+It parses synthetic API responses (mock_spotify_server.py) the way the extractor does, keeps the tracks
+once as the enriched dicts the extractor used to hold and once as the TrackRecords of spotify_records.py,
+reports the bytes per track of both (measured with tracemalloc), and checks that both give exactly
+the same transformed CSV output.
+
+Usage:
+- python benchmarks/benchmark_memory.py [number_of_tracks]
+"""
+
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mock_spotify_server import NO_FEATURES_SUFFIX, synthetic_track
+from spotify_extract import TRACK_FIELDS, merge_audio_features, trim_object
+from spotify_registry import TrackRegistry
+from spotify_transform import flatten_tracks
+
+# number of synthetic tracks used when none is given on the command line
+DEFAULT_TRACKS = 100_000
+
+
+def synthetic_features(track_id):
+    """
+    :param track_id: Spotify track ID.
+    :return: audio features object shaped like the Spotify API's, or None for tracks without features.
+    """
+    if track_id.endswith(NO_FEATURES_SUFFIX):
+        return None
+    n = sum(map(ord, track_id))
+    return {
+        "danceability": n % 100 / 100, "energy": n % 89 / 89, "key": n % 12, "loudness": -(n % 30) / 2 - 0.5,
+        "mode": n % 2, "speechiness": n % 13 / 100, "acousticness": n % 71 / 71, "instrumentalness": n % 7 / 100,
+        "liveness": n % 37 / 100, "valence": n % 61 / 61, "tempo": 60 + n % 120 + 0.25,
+        "type": "audio_features", "id": track_id, "uri": f"spotify:track:{track_id}",
+        "track_href": f"https://api.spotify.com/v1/tracks/{track_id}",
+        "analysis_url": f"https://api.spotify.com/v1/audio-analysis/{track_id}",
+        "duration_ms": 150_000 + n, "time_signature": 3 + n % 2,
+    }
+
+
+def make_responses(n):
+    """
+    :param n: number of tracks.
+    :return: list of (track JSON, audio features JSON) tuples, as received from the API.
+    """
+    return [(json.dumps(synthetic_track(i)), json.dumps(synthetic_features(f"track{i:06d}"))) for i in range(n)]
+
+
+def hold_dicts(responses):
+    """The previous extractor: trimmed track dicts, enriched in place."""
+    tracks = []
+    for i, (track_json, features_json) in enumerate(responses):
+        track = trim_object(json.loads(track_json), TRACK_FIELDS)
+        track["audio_features"] = json.loads(features_json) or {}
+        track["artist_names"] = [artist['name'] for artist in track['artists']]
+        track["playlist_ids"] = [f"playlist{i % 500:03d}"]
+        track["years"] = [1950 + i % 70]
+        tracks.append(track)
+    return tracks
+
+
+def hold_records(responses):
+    """The current extractor: TrackRecords created by the registry and enriched by merge_audio_features."""
+    registry = TrackRegistry()
+    for i, (track_json, features_json) in enumerate(responses):
+        record = registry.add(trim_object(json.loads(track_json), TRACK_FIELDS), f"playlist{i % 500:03d}",
+                              1950 + i % 70)
+        merge_audio_features([record], {record.id: json.loads(features_json)})
+    return registry.records()
+
+
+def retained_bytes(func, responses):
+    """
+    :return: tuple of (bytes still allocated after the call, result of the call).
+    """
+    gc.collect()
+    tracemalloc.start()
+    result = func(responses)
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current, result
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_TRACKS
+    print(f"Generating {n} synthetic API responses")
+    responses = make_responses(n)
+
+    dicts_bytes, dicts = retained_bytes(hold_dicts, responses)
+    records_bytes, records = retained_bytes(hold_records, responses)
+
+    identical = (flatten_tracks(dicts).to_csv(index=False)
+                 == flatten_tracks([record.to_dict() for record in records]).to_csv(index=False))
+
+    print(f"dicts:   {dicts_bytes / n:,.0f} bytes per track, {dicts_bytes / 2 ** 20:,.1f} MiB")
+    print(f"records: {records_bytes / n:,.0f} bytes per track, {records_bytes / 2 ** 20:,.1f} MiB")
+    print(f"saving:  {1 - records_bytes / dicts_bytes:.0%}")
+    print(f"identical CSV output: {identical}")
+
+    if not identical:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
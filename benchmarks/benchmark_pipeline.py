@@ -0,0 +1,107 @@
+# benchmarks/benchmark_pipeline.py
+
+"""
+This script benchmarks the streaming pipeline (spotify_pipeline.py) against running the three stages one after
+another through their files (spotify_extract.py with NDJSON output, spotify_transform.py, spotify_merge.py).
+
+Both start from empty caches and extract from the local mock Spotify API (mock_spotify_server.py), so the time
+the staged run spends transforming and merging after extraction shows up as the difference in wall time.
+
+Usage:
+- python benchmarks/benchmark_pipeline.py [--years 10] [--playlists-per-year 5] [--tracks-per-playlist 200]
+  [--latency 0.02] [--rate 50] [--format csv]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from benchmark_extract import extractor_caches, set_rate, use_mock_server
+from mock_spotify_server import MockSpotifyServer, synthetic_playlists
+
+import spotify_extract
+import spotify_merge
+import spotify_pipeline
+import spotify_transform
+
+
+def run_staged(year_range, work_dir, format):
+    """
+    :return: path of the merged dataset, after running extract, transform, and merge one after another.
+    """
+    raw_file = spotify_extract.run(year_range[0], year_range[-1], format="ndjson",
+                                   output_dir=os.path.join(work_dir, "raw"))
+    spotify_transform.run(input_file=raw_file, output_dir=os.path.join(work_dir, "transformed"), format=format)
+    spotify_merge.INPUT_FORMAT = spotify_merge.OUTPUT_FORMAT = format
+    return spotify_merge.run(input_dir=os.path.join(work_dir, "transformed"), output_dir=os.path.join(work_dir, "merged"))
+
+
+def run_pipeline(year_range, work_dir, format):
+    """
+    :return: path of the merged dataset written by the streaming pipeline.
+    """
+    return spotify_pipeline.run(year_range[0], year_range[-1], output_dir=os.path.join(work_dir, "merged"),
+                                format=format, keep_raw=False)
+
+
+def read_dataset(path):
+    """
+    :return: DataFrame of a merged dataset (CSV file, Parquet file, or directory of Parquet parts).
+    """
+    return pd.read_csv(path) if path.endswith(".csv") else pd.read_parquet(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the streaming pipeline against the staged scripts.")
+    parser.add_argument("--year-start", type=int, default=1910)
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--playlists-per-year", type=int, default=5)
+    parser.add_argument("--tracks-per-playlist", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every request")
+    parser.add_argument("--rate", type=float, default=50, help="requests per second of the rate limiter")
+    parser.add_argument("--format", default="csv", choices=("csv", "parquet"))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    year_range = range(args.year_start, args.year_start + args.years)
+    playlists = synthetic_playlists(year_range, args.playlists_per_year, args.tracks_per_playlist)
+    set_rate(args.rate)
+
+    results = {}
+    with MockSpotifyServer(playlists, latency=args.latency) as server, tempfile.TemporaryDirectory() as temp_dir:
+        for name, func in (("staged", run_staged), ("pipeline", run_pipeline)):
+            # every run starts with empty caches, so both make the same API calls
+            work_dir = os.path.join(temp_dir, name)
+            use_mock_server(server, work_dir)
+            start = time.perf_counter()
+            output_file = func(year_range, work_dir, args.format)
+            wall_time = time.perf_counter() - start
+            results[name] = (wall_time, read_dataset(output_file))
+            for cache in extractor_caches():
+                cache.close()
+
+    for name, (wall_time, df) in results.items():
+        print(f"{name + ':':<10}{wall_time:.2f} s, {len(df)} rows")
+    print(f"speedup:  {results['staged'][0] / results['pipeline'][0]:.2f}x")
+
+    # columns with missing audio features are floats in the batch transform but nullable integers when streamed
+    try:
+        pd.testing.assert_frame_equal(results["staged"][1], results["pipeline"][1], check_dtype=False)
+        identical = True
+    except AssertionError:
+        identical = False
+    print(f"same rows: {identical}")
+
+    if not identical:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
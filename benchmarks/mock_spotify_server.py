@@ -0,0 +1,428 @@
+# benchmarks/mock_spotify_server.py
+
+"""
+This file provides a local stand-in for the parts of the Spotify Web API used by spotify_extract.py,
+so extraction can be measured and regression-tested without credentials or network access.
+
+Endpoints:
+- POST /api/token (client credentials token)
+- GET /v1/search (playlist search; the year is read from the query, paged with offset/limit)
+- GET /v1/playlists/{id}/tracks and /v1/playlists/{id}/items (paged with offset/limit and "next" links)
+- GET /v1/audio-features?ids=... and /v1/artists?ids=...
+
+Features:
+- Synthetic fixtures (playlists per year, tracks per playlist, overlapping track pool),
+  or fixtures rebuilt from a recorded raw extract that has "playlist_ids" and "years" per track.
+- Configurable latency per request, maximum page size, and share of requests answered with 429 + Retry-After.
+- Honors the "fields" projection of playlist pages.
+- Sends an ETag with every response and answers a matching If-None-Match with 304 Not Modified.
+- Counts the requests per endpoint and the response bytes sent.
+
+Usage:
+- python benchmarks/mock_spotify_server.py [--port 8765] [--latency 0.05] [--page-size 100] [--throttle-rate 0.05]
+- Point the extractor at it with use_mock_server() in benchmark_extract.py.
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+# track IDs ending with this character have no audio features, like some real tracks
+NO_FEATURES_SUFFIX = "7"
+
+# real track and album objects list every market they are available in, which is most of their size
+MARKETS = [a + b for a in "ABCDEFGHIJKLMNOPQRSTUVWXYZ" for b in "ABCDEFG"][:180]
+
+
+def synthetic_track(i):
+    """
+    :param i: track number.
+    :return: track object shaped like the Spotify API's.
+    """
+    track_id = f"track{i:06d}"
+    album_id = f"album{i % 1500:04d}"
+    artists = [
+        {"id": f"artist{i % 997:04d}", "name": f"Artist {i % 997}"},
+        {"id": f"artist{i % 89:04d}", "name": f"Band, {i % 89}"},
+    ][:1 + i % 2]
+    for artist in artists:
+        artist.update(type="artist", uri=f"spotify:artist:{artist['id']}",
+                      href=f"https://api.spotify.com/v1/artists/{artist['id']}",
+                      external_urls={"spotify": f"https://open.spotify.com/artist/{artist['id']}"})
+
+    return {
+        "id": track_id,
+        "name": f"Song {i}",
+        "popularity": i % 100,
+        "duration_ms": 150_000 + (i * 7919) % 150_000,
+        "explicit": i % 3 == 0,
+        "artists": artists,
+        "album": {
+            "id": album_id,
+            "name": f"Album {i % 1500}",
+            "release_date": f"{1950 + i % 70}-0{1 + i % 9}-15",
+            "release_date_precision": "day",
+            "album_type": "single" if i % 4 == 0 else "album",
+            "total_tracks": 12,
+            "available_markets": MARKETS,
+            "artists": artists,
+            "images": [{"url": f"https://i.scdn.co/image/{album_id}{size}", "height": size, "width": size}
+                       for size in (640, 300, 64)],
+            "uri": f"spotify:album:{album_id}",
+            "href": f"https://api.spotify.com/v1/albums/{album_id}",
+            "external_urls": {"spotify": f"https://open.spotify.com/album/{album_id}"},
+            "type": "album",
+        },
+        "available_markets": MARKETS,
+        "disc_number": 1,
+        "track_number": 1 + i % 12,
+        "is_local": False,
+        "preview_url": None,
+        "external_ids": {"isrc": f"USRC1{i:07d}"},
+        "uri": f"spotify:track:{track_id}",
+        "href": f"https://api.spotify.com/v1/tracks/{track_id}",
+        "external_urls": {"spotify": f"https://open.spotify.com/track/{track_id}"},
+        "type": "track",
+    }
+
+
+def synthetic_playlists(years, playlists_per_year=5, tracks_per_playlist=200, track_pool=None, seed=1):
+    """
+    Create synthetic playlists for a range of years. Tracks are drawn from a shared pool,
+    so the same track appears in several playlists and years, as hits do in real playlists.
+
+    :param years: iterable of years.
+    :param playlists_per_year: number of playlists per year.
+    :param tracks_per_playlist: number of tracks per playlist.
+    :param track_pool: number of distinct tracks (default: half of all playlist entries).
+    :param seed: random seed.
+    :return: dict of years to dicts of playlist IDs to lists of tracks.
+    """
+    years = list(years)
+    rng = random.Random(seed)
+    track_pool = track_pool or max(1, len(years) * playlists_per_year * tracks_per_playlist // 2)
+    tracks = {}
+
+    playlists = {}
+    for year in years:
+        playlists[year] = {}
+        for p in range(playlists_per_year):
+            numbers = [rng.randrange(track_pool) for _ in range(tracks_per_playlist)]
+            playlists[year][f"pl{year}x{p:03d}"] = [tracks.setdefault(n, synthetic_track(n)) for n in numbers]
+    return playlists
+
+
+def parse_fields(fields):
+    """
+    Parse the "fields" parameter of the Spotify API into a whitelist.
+
+    :param fields: projection string, e.g. "items(track(id,artists(id,name))),next".
+    :return: dict of field names to None (keep the field) or to a dict selecting nested fields.
+    """
+    whitelist = {}
+    stack = [whitelist]
+    name = ""
+    for char in fields + ",":
+        if char == "(":
+            stack[-1][name] = {}
+            stack.append(stack[-1][name])
+            name = ""
+        elif char in ",)":
+            if name:
+                stack[-1][name] = None
+            name = ""
+            if char == ")":
+                stack.pop()
+        else:
+            name += char
+    return whitelist
+
+
+def project(obj, whitelist):
+    """
+    :param obj: JSON object, list, or value.
+    :param whitelist: parsed "fields" parameter, or None to keep everything.
+    :return: the object reduced to the whitelisted fields.
+    """
+    if whitelist is None:
+        return obj
+    if isinstance(obj, list):
+        return [project(item, whitelist) for item in obj]
+    if not isinstance(obj, dict):
+        return obj
+    return {name: project(obj[name], nested) for name, nested in whitelist.items() if name in obj}
+
+
+def recorded_playlists(raw_file):
+    """
+    Rebuild playlists from a recorded raw extract (JSON written by spotify_extract.py).
+    The recorded audio features are served with the tracks.
+
+    :param raw_file: path of the raw extract; its tracks need "playlist_ids" and "years".
+    :return: dict of years to dicts of playlist IDs to lists of tracks.
+    """
+    with open(raw_file, 'r', encoding='utf-8') as f:
+        recorded = json.load(f)
+
+    tracks_by_playlist = {}
+    years_by_playlist = {}
+    for track in recorded:
+        served = {key: value for key, value in track.items()
+                  if key not in ("audio_features", "artist_names", "playlist_ids", "years")}
+        served["_audio_features"] = track.get("audio_features") or None
+        for playlist_id in track["playlist_ids"]:
+            tracks_by_playlist.setdefault(playlist_id, []).append(served)
+            # a playlist belongs to the one year that all of its tracks were found in
+            years_by_playlist.setdefault(playlist_id, set(track["years"])).intersection_update(track["years"])
+
+    playlists = {}
+    for playlist_id, tracks in tracks_by_playlist.items():
+        playlists.setdefault(min(years_by_playlist[playlist_id]), {})[playlist_id] = tracks
+    return playlists
+
+
+class MockSpotifyServer:
+    """
+    Local HTTP server answering like the Spotify Web API, running in a background thread.
+
+    :param playlists: dict of years to dicts of playlist IDs to lists of tracks.
+    :param host: host to bind to.
+    :param port: port to bind to (0: any free port).
+    :param latency: seconds added to every request.
+    :param page_size: maximum number of playlist items per page.
+    :param throttle_rate: share of requests (0 to 1) answered with 429.
+    :param retry_after: value of the Retry-After header of 429 responses, in seconds.
+    :param seed: random seed of the injected 429s.
+    """
+
+    def __init__(self, playlists, host="127.0.0.1", port=0, latency=0.0, page_size=100,
+                 throttle_rate=0.0, retry_after=1, seed=1):
+        self.playlists = playlists
+        self.latency = latency
+        self.page_size = page_size
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.requests = Counter()
+        self.bytes_sent = 0
+
+        self._tracks_by_playlist = {pid: tracks for year in playlists.values() for pid, tracks in year.items()}
+        self._recorded_features = {
+            track["id"]: track["_audio_features"]
+            for tracks in self._tracks_by_playlist.values() for track in tracks if "_audio_features" in track
+        }
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        """Base URL of the server, e.g. http://127.0.0.1:8765"""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Start serving in a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """Serve in the calling thread until interrupted."""
+        self._server.serve_forever()
+
+    def stop(self):
+        """Stop serving and release the port."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _throttled(self, endpoint):
+        with self._lock:
+            self.requests[endpoint] += 1
+            if self._random.random() < self.throttle_rate:
+                self.requests["throttled"] += 1
+                return True
+        return False
+
+    def search(self, query):
+        match = re.search(r"\d{4}", query.get("q", [""])[0])
+        offset = int(query.get("offset", [0])[0])
+        limit = int(query.get("limit", [10])[0])
+        year = int(match.group()) if match else None
+        playlist_ids = list(self.playlists.get(year, {}))
+        items = [
+            {"id": playlist_id, "name": f"Top Hits of {year}", "snapshot_id": "snapshot1"}
+            for playlist_id in playlist_ids[offset:offset + limit]
+        ]
+        next_url = None
+        if offset + limit < len(playlist_ids):
+            next_url = f"{self.url}/v1/search?" + urlencode(
+                {"q": query.get("q", [""])[0], "type": "playlist", "offset": offset + limit, "limit": limit})
+        return {"playlists": {"items": items, "total": len(playlist_ids), "limit": limit, "offset": offset,
+                              "next": next_url}}
+
+    def playlist_page(self, playlist_id, query, path):
+        tracks = self._tracks_by_playlist.get(playlist_id)
+        if tracks is None:
+            return None
+
+        offset = int(query.get("offset", [0])[0])
+        limit = min(int(query.get("limit", [100])[0]), self.page_size)
+        fields = query.get("fields", [None])[0]
+        next_url = None
+        if offset + limit < len(tracks):
+            # like the real API, the next page keeps the projection of the request
+            next_url = f"{self.url}{path}?" + urlencode(
+                {"offset": offset + limit, "limit": limit, **({"fields": fields} if fields else {})})
+
+        items = [{"track": {key: value for key, value in track.items() if not key.startswith("_")},
+                  "added_at": "2024-01-01T00:00:00Z", "is_local": False}
+                 for track in tracks[offset:offset + limit]]
+        page = {"href": f"{self.url}{path}", "items": items, "total": len(tracks), "offset": offset,
+                "limit": limit, "next": next_url, "previous": None}
+        return project(page, parse_fields(fields) if fields else None)
+
+    def audio_features(self, ids):
+        features = []
+        for track_id in ids:
+            if track_id in self._recorded_features:
+                features.append(self._recorded_features[track_id])
+                continue
+            if track_id.endswith(NO_FEATURES_SUFFIX):
+                features.append(None)
+                continue
+            n = sum(map(ord, track_id))
+            features.append({
+                "id": track_id, "danceability": n % 100 / 100, "energy": n % 89 / 89, "key": n % 12,
+                "loudness": -(n % 30) / 2, "mode": n % 2, "speechiness": n % 13 / 100, "acousticness": n % 71 / 71,
+                "instrumentalness": n % 7 / 100, "liveness": n % 37 / 100, "valence": n % 61 / 61,
+                "tempo": 60 + n % 120, "time_signature": 3 + n % 2,
+            })
+        return {"audio_features": features}
+
+    def artists(self, ids):
+        return {"artists": [
+            {"id": artist_id, "name": artist_id, "genres": ["pop"] if sum(map(ord, artist_id)) % 2 else ["rock"],
+             "popularity": sum(map(ord, artist_id)) % 100, "followers": {"total": 1000}}
+            for artist_id in ids
+        ]}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, body, status=200, headers=None):
+                data = json.dumps(body).encode()
+                if status == 200:
+                    etag = '"' + hashlib.sha1(data).hexdigest() + '"'
+                    if self.headers.get("If-None-Match") == etag:
+                        with server._lock:
+                            server.requests["not_modified"] += 1
+                        self.send_response(304)
+                        self.send_header("ETag", etag)
+                        self.end_headers()
+                        return
+                    headers = dict(headers or {}, ETag=etag)
+
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+                with server._lock:
+                    server.bytes_sent += len(data)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                server.requests["token"] += 1
+                self.send_json({"access_token": "mock-token", "token_type": "bearer", "expires_in": 3600})
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                playlist_match = re.match(r"/v1/playlists/(\w+)/(tracks|items)$", url.path)
+
+                if url.path == "/v1/search":
+                    endpoint = "search"
+                elif playlist_match:
+                    endpoint = "playlist_tracks"
+                elif url.path.rstrip("/") == "/v1/audio-features":
+                    endpoint = "audio_features"
+                elif url.path.rstrip("/") == "/v1/artists":
+                    endpoint = "artists"
+                else:
+                    return self.send_json({"error": {"status": 404, "message": "Not found"}}, 404)
+
+                if server.latency:
+                    time.sleep(server.latency)
+
+                if server._throttled(endpoint):
+                    return self.send_json({"error": {"status": 429, "message": "API rate limit exceeded"}}, 429,
+                                          {"Retry-After": str(server.retry_after)})
+
+                if endpoint == "search":
+                    body = server.search(query)
+                elif endpoint == "playlist_tracks":
+                    body = server.playlist_page(playlist_match.group(1), query, url.path)
+                elif endpoint == "audio_features":
+                    body = server.audio_features(query["ids"][0].split(","))
+                else:
+                    body = server.artists(query["ids"][0].split(","))
+
+                if body is None:
+                    return self.send_json({"error": {"status": 404, "message": "Not found"}}, 404)
+                self.send_json(body)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the Spotify Web API.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fixture", help="recorded raw extract to serve instead of synthetic playlists")
+    parser.add_argument("--year-start", type=int, default=1910)
+    parser.add_argument("--year-end", type=int, default=1919)
+    parser.add_argument("--playlists-per-year", type=int, default=5)
+    parser.add_argument("--tracks-per-playlist", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1)
+    args = parser.parse_args()
+
+    if args.fixture:
+        playlists = recorded_playlists(args.fixture)
+    else:
+        playlists = synthetic_playlists(range(args.year_start, args.year_end + 1),
+                                        args.playlists_per_year, args.tracks_per_playlist)
+
+    server = MockSpotifyServer(playlists, port=args.port, latency=args.latency, page_size=args.page_size,
+                               throttle_rate=args.throttle_rate, retry_after=args.retry_after)
+    print(f"Serving the mock Spotify API at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# spotify_cache.py
+
+"""
+This file provides a persistent key-value cache backed by SQLite.
+
+Features:
+- Stores JSON-serializable values (including None for "known to be missing") per key.
+- Expires entries after a time-to-live and evicts the oldest entries above a size limit.
+- Counts cache hits and misses so runs can report how many API calls were avoided.
+- Safe to share between threads; the database is opened lazily on first use.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# SQLite limits the number of parameters per statement, so lookups are chunked
+QUERY_CHUNK_SIZE = 500
+
+
+class SQLiteCache:
+    """
+    Persistent key-value cache stored in one table of a SQLite database.
+
+    :param path: path of the SQLite database file.
+    :param table: name of the table holding this cache's entries.
+    :param ttl: time-to-live of an entry in seconds (None: entries never expire).
+    :param max_entries: maximum number of entries kept by evict() (None: unlimited).
+    """
+
+    def __init__(self, path, table="cache", ttl=None, max_entries=None):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "key TEXT PRIMARY KEY, value TEXT, stored_at REAL NOT NULL)"
+            )
+            self._connection.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_stored_at ON {self.table} (stored_at)"
+            )
+        return self._connection
+
+    def get_many(self, keys):
+        """
+        Look up several keys at once.
+
+        :param keys: iterable of keys.
+        :return: dict of the keys that were found (and not expired) to their values.
+        """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        oldest = time.time() - self.ttl if self.ttl else 0
+
+        with self._lock:
+            connection = self._connect()
+            for i in range(0, len(keys), QUERY_CHUNK_SIZE):
+                chunk = keys[i:i + QUERY_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows = connection.execute(
+                    f"SELECT key, value FROM {self.table} WHERE key IN ({placeholders}) AND stored_at >= ?",
+                    chunk + [oldest],
+                )
+                for key, value in rows:
+                    found[key] = json.loads(value)
+
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+
+        return found
+
+    def get(self, key, default=None):
+        """
+        Look up a single key.
+
+        :param key: key to look up.
+        :param default: value returned when the key is missing or expired.
+        :return: cached value or default.
+        """
+        return self.get_many([key]).get(key, default)
+
+    def set_many(self, items):
+        """
+        Store several entries at once, replacing existing ones.
+
+        :param items: dict of keys to JSON-serializable values.
+        """
+        now = time.time()
+        rows = [(key, json.dumps(value, ensure_ascii=False), now) for key, value in items.items()]
+
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value, stored_at) VALUES (?, ?, ?)", rows
+                )
+
+    def set(self, key, value):
+        """
+        Store a single entry.
+
+        :param key: key to store.
+        :param value: JSON-serializable value.
+        """
+        self.set_many({key: value})
+
+    def evict(self):
+        """
+        Remove expired entries and, if max_entries is set, the oldest entries above the limit.
+
+        :return: number of removed entries.
+        """
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                removed = 0
+                if self.ttl:
+                    removed += connection.execute(
+                        f"DELETE FROM {self.table} WHERE stored_at < ?", (time.time() - self.ttl,)
+                    ).rowcount
+                if self.max_entries is not None:
+                    removed += connection.execute(
+                        f"DELETE FROM {self.table} WHERE key IN ("
+                        f"SELECT key FROM {self.table} ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                        (self.max_entries,),
+                    ).rowcount
+        return removed
+
+    def stats(self):
+        """
+        :return: dict with the number of hits and misses since the cache was created.
+        """
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,92 @@
+# spotify_checkpoint.py
+
+"""
+This file provides on-disk checkpoints for resumable extraction runs.
+
+Features:
+- Saves the raw tracks of every completed playlist as soon as it has been fetched.
+- Saves the enriched tracks of every completed year, together with its playlist IDs and track memberships.
+- Lets a restarted run skip completed years and playlists instead of fetching them again.
+- Writes files atomically, so a crash never leaves a half-written checkpoint behind.
+
+Layout:
+- {directory}/playlists/{playlist_id}.json
+- {directory}/years/{year}.json
+"""
+
+import json
+import os
+import shutil
+
+from spotify_records import to_json
+
+
+class Checkpoint:
+    """
+    Checkpoint store of one extraction run.
+
+    :param directory: directory holding the checkpoint files of the run.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.playlist_dir = os.path.join(directory, "playlists")
+        self.year_dir = os.path.join(directory, "years")
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, default=to_json)
+        os.replace(tmp_path, path)
+
+    def _read(self, path):
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def load_playlist(self, playlist_id):
+        """
+        :param playlist_id: Spotify playlist ID.
+        :return: list of raw tracks of the playlist, or None if it has not been completed.
+        """
+        return self._read(os.path.join(self.playlist_dir, f"{playlist_id}.json"))
+
+    def save_playlist(self, playlist_id, tracks):
+        """
+        Mark a playlist as completed.
+
+        :param playlist_id: Spotify playlist ID.
+        :param tracks: list of raw tracks of the playlist.
+        """
+        self._write(os.path.join(self.playlist_dir, f"{playlist_id}.json"), tracks)
+
+    def load_year(self, year):
+        """
+        :param year: year of the search.
+        :return: dict with "playlist_ids", "tracks", and "memberships", or None if the year has not been completed.
+        """
+        return self._read(os.path.join(self.year_dir, f"{year}.json"))
+
+    def save_year(self, year, playlist_ids, tracks, memberships=None):
+        """
+        Mark a year as completed. The playlist checkpoints of the year are no longer needed
+        and are removed.
+
+        :param year: year of the search.
+        :param playlist_ids: IDs of the playlists extracted for the year.
+        :param tracks: list of enriched tracks first seen in the year.
+        :param memberships: dict of track IDs to the IDs of the year's playlists that contained them.
+        """
+        self._write(os.path.join(self.year_dir, f"{year}.json"),
+                    {"playlist_ids": playlist_ids, "tracks": tracks, "memberships": memberships or {}})
+
+        for playlist_id in playlist_ids:
+            path = os.path.join(self.playlist_dir, f"{playlist_id}.json")
+            if os.path.exists(path):
+                os.remove(path)
+
+    def clear(self):
+        """Remove all checkpoint files of the run, e.g. once its output has been saved."""
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -4,240 +4,979 @@
 This file aims to fetch datasets from Spotify using the Spotify API and Spotipy library.
 
 Features:
-- Dynamically searches playlists by year.
+- Discovers the playlists of every year up front with several search queries, paged, run concurrently,
+  cached locally, and deduplicated across queries and years.
 - Extracts tracks, audio features, and related artist names.
-- Saves the data in JSON format.
+- Requests and keeps only the track fields the pipeline uses, which keeps payloads and raw files small.
+- Optionally enriches the artists of the tracks with their genres and popularity.
+- Keeps one record per track across the whole run, listing the playlists and years that contained it.
+- Saves the data in JSON format, or streams it as (optionally compressed) NDJSON.
+- Optionally writes one compressed NDJSON partition per year (see spotify_partitions.py), replacing
+  the partitions of the years the run covers.
+- Revalidates repeated GET requests with ETag/Last-Modified, so unchanged responses are not downloaded again,
+  over a pooled keep-alive session sized for concurrent page fetching.
+- Creates the Spotify client on first use and caches its access token in a file shared by all runs,
+  so importing the module (e.g. from a pipeline, with run()) needs no credentials.
+- Records per-endpoint request metrics and stage timings in a run report (see spotify_metrics.py).
 
 Output:
-- JSON files containing track metadata, audio features, and artist names.
+- JSON or NDJSON files containing track metadata, audio features, and artist names.
+- Or, with OUTPUT_FORMAT = "partitioned", ./raw_data/year=YYYY/part-*.ndjson.zst and ./raw_data/_partitions.json.
 """
 
 import json
 import os
 from dotenv import load_dotenv
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
+import requests
+from urllib3.util.retry import Retry
 from datetime import datetime
+import threading
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from spotify_cache import SQLiteCache
+from spotify_checkpoint import Checkpoint
+from spotify_http_cache import ConditionalCacheAdapter, HTTPCache
+from spotify_io import COMPRESSION_EXTENSIONS, NDJSONWriter
+from spotify_metrics import endpoint_name, metrics, write_run_report
+from spotify_partitions import PartitionWriter
+from spotify_rate_limiter import RateLimiter
+from spotify_records import to_json
+from spotify_registry import TrackRegistry
 
 # choose the range of the years that you want to fetch data
 YEAR_START = 1910
 YEAR_END = 1919
 
 # choose the limit of playlists per year that you want to fetch
+# (search results per page per query; the API returns at most 50)
 PLAYLIST_LIMIT = 50
 
-# Setup logging
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+# search queries used to discover the playlists of a year; each is run for every year,
+# e.g. add "Best of {year}" or "{year} hits" to find more playlists
+QUERY_TEMPLATES = ["Top Hits of {year}"]
 
-# Load environment variables for Spotify API credentials
-load_dotenv()
-client_id = os.environ.get('client_id')
-client_secret = os.environ.get('client_secret')
+# pages of search results requested per query and year (offset-paged, PLAYLIST_LIMIT results each)
+SEARCH_PAGES = 1
 
-# Authenticate with Spotify API
-client_credentials_manager = SpotifyClientCredentials(client_id=client_id, client_secret=client_secret)
-sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
+# number of searches sent at the same time during discovery
+SEARCH_CONCURRENCY = 4
 
+# search result pages are cached locally, so repeated runs do not search again until they expire
+SEARCH_TTL = 24 * 3600
+SEARCH_MAX_ENTRIES = 100_000
 
-def fetch_playlists_by_year(year, limit=PLAYLIST_LIMIT, query_template="{year}"):
+# send the searches again even when their pages are cached, as conditional requests of the HTTP cache (HTTP_CACHE),
+# so the snapshot_ids used to detect changed playlists are current; unchanged pages come back as 304 Not Modified.
+# With False (or without the HTTP cache), cached pages are served for up to SEARCH_TTL, so a playlist changed in
+# that time keeps its previous tracks until the page expires.
+SEARCH_REVALIDATE = True
+
+# initial number of Spotify API requests per second (adapted at runtime)
+RATE_LIMIT = 10
+
+# local cache of audio features, which practically never change for a track ID
+CACHE_PATH = "./cache/spotify_cache.db"
+AUDIO_FEATURES_TTL = 180 * 24 * 3600
+AUDIO_FEATURES_MAX_ENTRIES = 1_000_000
+
+# the only track fields used downstream (spotify_transform.py); nested dicts select fields of nested objects.
+# Playlist pages are requested with the matching "fields" projection and tracks are trimmed to it.
+TRACK_FIELDS = {
+    "id": None,
+    "name": None,
+    "popularity": None,
+    "duration_ms": None,
+    "explicit": None,
+    "artists": {"id": None, "name": None},
+    "album": {"name": None, "release_date": None, "album_type": None},
+}
+
+# playlist items per page (the API allows up to 100)
+PAGE_SIZE = 100
+
+# maximum number of pages of one playlist fetched at the same time after the first page (1: one after another)
+PARALLEL_PAGES = 8
+
+# IDs per request to the audio features and several-artists endpoints (the API allows up to 100 and 50)
+AUDIO_FEATURES_BATCH_SIZE = 100
+ARTISTS_BATCH_SIZE = 50
+
+# fetch the genres and popularity of every artist (cached, as they change slowly)
+ENRICH_ARTISTS = False
+ARTISTS_TTL = 30 * 24 * 3600
+ARTISTS_MAX_ENTRIES = 500_000
+
+# playlists whose snapshot_id is unchanged since the last run are not downloaded again
+PLAYLIST_INDEX_MAX_ENTRIES = 100_000
+
+# keep responses with an ETag or Last-Modified header and revalidate them with conditional requests;
+# entries older than the TTL are requested in full again
+HTTP_CACHE = True
+HTTP_CACHE_TTL = 7 * 24 * 3600
+HTTP_CACHE_MAX_ENTRIES = 50_000
+
+# keep-alive connections kept per host; at least PARALLEL_PAGES so concurrent page fetches reuse connections
+CONNECTION_POOL_SIZE = 16
+
+# completed playlists and years are checkpointed here, so an interrupted run can resume
+CHECKPOINT_DIR = "./checkpoints"
+
+# output format: "json" (one indented document), "ndjson" (streamed, one track per line),
+# or "partitioned" (streamed, one NDJSON partition per year)
+OUTPUT_FORMAT = "json"
+
+# compression of NDJSON output: None, "gzip" or "zstd"
+OUTPUT_COMPRESSION = None
+
+# compression of partitioned output (zstd needs pip install zstandard)
+PARTITION_COMPRESSION = "zstd"
+
+# directory of the raw output
+OUTPUT_DIR = "./raw_data"
+
+# access tokens are cached in this file and reused by later runs and other processes until they expire
+TOKEN_CACHE_PATH = "./cache/spotify_token.json"
+
+
+def build_session(http_cache=None, pool_size=CONNECTION_POOL_SIZE):
+    """
+    Build the HTTP session used by the Spotify client.
+    Server errors are still retried by urllib3, but 429 responses are handed back untouched
+    so that the rate limiter can read Retry-After and adapt the request rate.
+
+    :param http_cache: optional HTTPCache; GET requests are then sent as conditional requests.
+    :param pool_size: number of keep-alive connections kept per host.
+    :return: requests session.
+    """
+    session = requests.Session()
+    retry = Retry(
+        total=3,
+        connect=None,
+        read=False,
+        allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+        status=3,
+        backoff_factor=0.3,
+        status_forcelist=(500, 502, 503, 504),
+        respect_retry_after_header=False)
+
+    adapter = ConditionalCacheAdapter(http_cache, pool_connections=2, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.hooks['response'].append(record_response)
+    return session
+
+
+def record_response(response, *args, **kwargs):
+    """Response hook of the HTTP session that records every Spotify API request in the metrics."""
+    # a response served from the HTTP cache was a bodiless 304 on the wire
+    if getattr(response, "revalidated", False):
+        metrics.observe_request(endpoint_name(response.url), response.elapsed.total_seconds(), 304, 0)
+    else:
+        metrics.observe_request(endpoint_name(response.url), response.elapsed.total_seconds(),
+                                response.status_code, len(response.content))
+
+
+def fields_projection(fields):
+    """
+    Build the value of the Spotify API's "fields" parameter from a field whitelist.
+
+    :param fields: dict of field names to None (keep the field) or to a dict selecting nested fields.
+    :return: projection string, e.g. "id,artists(id,name)".
+    """
+    return ",".join(name if nested is None else f"{name}({fields_projection(nested)})"
+                    for name, nested in fields.items())
+
+
+def trim_object(obj, fields):
+    """
+    Keep only the whitelisted fields of an API object (or of every object of a list).
+
+    :param obj: dict, list of dicts, or None.
+    :param fields: dict of field names to None or to a dict selecting nested fields.
+    :return: trimmed copy of the object.
+    """
+    if isinstance(obj, list):
+        return [trim_object(item, fields) for item in obj]
+    if not isinstance(obj, dict):
+        return obj
+    return {name: obj[name] if nested is None else trim_object(obj[name], nested)
+            for name, nested in fields.items() if name in obj}
+
+
+# "fields" parameter of playlist page requests; total and limit give the offsets of all pages
+PLAYLIST_ITEM_FIELDS = f"items(track({fields_projection(TRACK_FIELDS)})),next,total,limit"
+
+
+# validators and bodies of cacheable API responses, revalidated by both extractors
+http_cache = HTTPCache(SQLiteCache(CACHE_PATH, table="http", ttl=HTTP_CACHE_TTL,
+                                   max_entries=HTTP_CACHE_MAX_ENTRIES)) if HTTP_CACHE else None
+
+# the Spotify client is created by get_client() on first use, so importing this module needs no credentials
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Return the Spotify client, creating it on the first call.
+    Credentials are read from the environment (or a .env file) only then, and the access token is
+    shared with other processes through TOKEN_CACHE_PATH instead of being requested by every run.
+
+    :return: spotipy.Spotify client; its auth_manager provides the access token.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            # spotipy (and the cache backends it imports) is only loaded when a client is needed
+            import spotipy
+            from spotipy.cache_handler import CacheFileHandler
+            from spotipy.oauth2 import SpotifyClientCredentials
+
+            # Load environment variables for Spotify API credentials
+            load_dotenv()
+            os.makedirs(os.path.dirname(TOKEN_CACHE_PATH) or ".", exist_ok=True)
+            auth_manager = SpotifyClientCredentials(client_id=os.environ.get('client_id'),
+                                                    client_secret=os.environ.get('client_secret'),
+                                                    cache_handler=CacheFileHandler(cache_path=TOKEN_CACHE_PATH))
+            _client = spotipy.Spotify(auth_manager=auth_manager, requests_session=build_session(http_cache))
+        return _client
+
+
+# every Spotify API call goes through this limiter
+rate_limiter = RateLimiter(rate=RATE_LIMIT, metrics=metrics)
+
+# audio features are looked up here before any request is sent
+audio_features_cache = SQLiteCache(CACHE_PATH, table="audio_features",
+                                   ttl=AUDIO_FEATURES_TTL, max_entries=AUDIO_FEATURES_MAX_ENTRIES)
+
+# artist details are looked up here before any request is sent
+artists_cache = SQLiteCache(CACHE_PATH, table="artists", ttl=ARTISTS_TTL, max_entries=ARTISTS_MAX_ENTRIES)
+
+# pages of search results, keyed by query, page size, and offset
+search_cache = SQLiteCache(CACHE_PATH, table="searches", ttl=SEARCH_TTL, max_entries=SEARCH_MAX_ENTRIES)
+
+# index of playlist ID -> {"snapshot_id": ..., "tracks": [...]} from previous runs
+playlist_index = SQLiteCache(CACHE_PATH, table="playlists", max_entries=PLAYLIST_INDEX_MAX_ENTRIES)
+
+
+def search_page_summary(results):
+    """
+    Reduce a page of playlist search results to what discovery needs.
+
+    :param results: search response of the Spotify API.
+    :return: dict with the "items" of the page (dicts with the "id", "name", and "snapshot_id" of each playlist)
+        and whether there is a "next" page, or None if the response has no playlists.
+    """
+    if not results or 'playlists' not in results or 'items' not in results['playlists']:
+        return None
+
+    # search results may contain null entries for removed playlists
+    return {
+        "items": [{"id": playlist['id'], "name": playlist['name'], "snapshot_id": playlist.get('snapshot_id')}
+                  for playlist in results['playlists']['items'] if playlist],
+        "next": bool(results['playlists'].get('next')),
+    }
+
+
+def search_cache_key(query, limit, offset):
+    """
+    :return: key of a page of search results in the search cache.
+    """
+    return json.dumps([query, limit, offset])
+
+
+class PlaylistSearch:
+    """
+    Search rules shared by the sync and async extractors, for the playlists containing a year in their title.
+    Result pages are stored in the search cache and served from it unless SEARCH_REVALIDATE is set;
+    the caller only sends the requests.
+
+    Iterating yields the offset of every page that has to be requested (with the query and limit of
+    the search); the response must be passed to receive() before the next iteration. playlists()
+    then returns the playlists found.
+
+    :param year: the year to search for in playlist titles.
+    :param limit: number of search results per page.
+    :param query_template: template for formatting the query string.
+    :param pages: maximum number of result pages to go through.
+    """
+
+    def __init__(self, year, limit=PLAYLIST_LIMIT, query_template="{year}", pages=SEARCH_PAGES):
+        self.year = year
+        self.limit = limit
+        self.query = query_template.format(year=year)
+        self.pages = pages
+        self.items = []
+        self._results = None
+
+    def __iter__(self):
+        logging.info(f"Searching for playlists with year: {self.year}")
+
+        # revalidated pages are requested again, so their snapshot_ids are never older than the response
+        revalidate = SEARCH_REVALIDATE and http_cache is not None
+        for offset in range(0, self.pages * self.limit, self.limit):
+            key = search_cache_key(self.query, self.limit, offset)
+            page = None if revalidate else search_cache.get(key)
+            if page is None:
+                self._results = None
+                yield offset
+                page = search_page_summary(self._results)
+
+                # log the response to understand why it might be None
+                if page is None:
+                    logging.warning(f"No playlists found for year {self.year}. API response: {self._results}")
+                    break
+                search_cache.set(key, page)
+
+            self.items.extend(page['items'])
+            if not page['next']:
+                break
+
+    def receive(self, results):
+        """
+        :param results: search response of the Spotify API for the offset yielded last.
+        """
+        self._results = results
+
+    def playlists(self):
+        """
+        :return: list of dicts with the "id", "name", and "snapshot_id" of each playlist found.
+        """
+        # filter playlists to include only those where the title contains the year
+        playlists = [playlist for playlist in self.items if str(self.year) in playlist['name']]
+
+        logging.info(f"Found {len(playlists)} playlists for year {self.year}")
+        return playlists
+
+
+def search_playlists_by_year(year, limit=PLAYLIST_LIMIT, query_template="{year}", pages=SEARCH_PAGES):
     """
     Search for playlists containing a specific year in their title.
+    Result pages are served from the search cache when possible.
 
     :param year: the year to search for in playlist titles.
-    :param limit: maximum number of playlists to return.
+    :param limit: number of search results per page.
     :param query_template: template for formatting the query string.
-    :return: list of playlist IDs.
+    :param pages: maximum number of result pages to go through.
+    :return: list of dicts with the "id", "name", and "snapshot_id" of each playlist.
     """
-    logging.info(f"Searching for playlists with year: {year}")
-    query = query_template.format(year=year)
-    results = sp.search(q=query, type='playlist', limit=limit)
+    search = PlaylistSearch(year, limit, query_template, pages)
+    for offset in search:
+        with metrics.stage("extract.search"):
+            search.receive(rate_limiter.call(get_client().search, q=search.query, type='playlist',
+                                             limit=search.limit, offset=offset))
+    return search.playlists()
 
-    # log the response to understand why it might be None
-    if not results or 'playlists' not in results or 'items' not in results['playlists']:
-        logging.warning(f"No playlists found for year {year}. API response: {results}")
-        return []
 
-    # filter playlists to include only those where the title contains the year
-    playlist_ids = [
-        playlist['id']
-        for playlist in results['playlists']['items']
-        if str(year) in playlist['name']
-    ]
+def select_new_playlists(found_by_year, seen_playlist_ids):
+    """
+    Deduplicate discovered playlists across queries and years: a playlist belongs to the first year
+    (in the order of found_by_year) and the first query that found it.
 
-    logging.info(f"Found {len(playlist_ids)} playlists for year {year}")
-    return playlist_ids
+    :param found_by_year: dict of years to the playlists found for them, in query order.
+    :param seen_playlist_ids: set of playlist IDs already taken, e.g. by checkpointed years; updated in place.
+    :return: dict of years to their new playlists.
+    """
+    playlists_by_year = {}
+    for year, playlists in found_by_year.items():
+        playlists_by_year[year] = []
+        for playlist in playlists:
+            if playlist['id'] not in seen_playlist_ids:
+                seen_playlist_ids.add(playlist['id'])
+                playlists_by_year[year].append(playlist)
+
+        if not playlists_by_year[year]:
+            logging.info(f"No playlists found for year {year}")
+        else:
+            logging.info(f"Fetching tracks from {len(playlists_by_year[year])} playlists for year {year}")
+
+    return playlists_by_year
+
+
+def discover_playlists(years, limit_per_year=PLAYLIST_LIMIT, seen_playlist_ids=None, query_templates=None):
+    """
+    Discover the playlists of several years before any tracks are fetched: every query template is
+    searched for every year, concurrently, and the results are deduplicated across queries and years.
+
+    :param years: years to discover, in order.
+    :param limit_per_year: number of search results per page.
+    :param seen_playlist_ids: optional set of playlist IDs already taken; updated in place.
+    :param query_templates: search query templates (default: QUERY_TEMPLATES).
+    :return: dict of years to their new playlists (dicts with "id", "name", and "snapshot_id").
+    """
+    searches = [(year, template) for year in years for template in (query_templates or QUERY_TEMPLATES)]
+    with ThreadPoolExecutor(max_workers=SEARCH_CONCURRENCY) as executor:
+        results = list(executor.map(lambda search: search_playlists_by_year(search[0], limit_per_year, search[1]),
+                                    searches))
+
+    found_by_year = {year: [] for year in years}
+    for (year, template), playlists in zip(searches, results):
+        found_by_year[year].extend(playlists)
 
+    return select_new_playlists(found_by_year, set() if seen_playlist_ids is None else seen_playlist_ids)
 
-def fetch_tracks_batch(playlist_id):
+
+def fetch_tracks_batch(playlist_id, parallel_pages=PARALLEL_PAGES):
     """
     Fetch tracks from a playlist in batches.
-    The key reason for batching is to respect Spoitfy's API rate limits.
+    Requests go through the shared rate limiter to respect Spotify's API rate limits.
+    Only the fields in TRACK_FIELDS are requested and kept.
 
     :param playlist_id: Spoitfy playlist ID.
+    :param parallel_pages: maximum number of the remaining pages fetched at the same time,
+        once the first page has told the total (1: follow the "next" links one after another).
     :return: list of tracks from the playlist.
     """
     logging.info(f"Fetching tracks from playlist {playlist_id}")
-    all_tracks = []
-    results = sp.playlist_tracks(playlist_id)
+    results = rate_limiter.call(get_client().playlist_tracks, playlist_id, fields=PLAYLIST_ITEM_FIELDS, limit=PAGE_SIZE)
+    pages = []
+
+    if results and results['next'] and parallel_pages > 1 and results.get('total') and results.get('limit'):
+        # the first page gives the total, so the offsets of all remaining pages are known up front;
+        # executor.map returns the pages in offset order
+        def fetch_page(offset):
+            return rate_limiter.call(get_client().playlist_tracks, playlist_id, fields=PLAYLIST_ITEM_FIELDS,
+                                     limit=results['limit'], offset=offset)
+
+        offsets = range(results['limit'], results['total'], results['limit'])
+        with ThreadPoolExecutor(max_workers=min(parallel_pages, len(offsets))) as executor:
+            pages = [results] + list(executor.map(fetch_page, offsets))
+    else:
+        while results:
+            pages.append(results)
+            results = rate_limiter.call(get_client().next, results) if results['next'] else None
 
-    while results:
-        for item in results['items']:
+    all_tracks = []
+    for page in pages:
+        for item in page['items']:
             track = item['track']
             if track and track.get('id'):
-                all_tracks.append(track)
-
-        # pause (if needed) to respect API rate limits of Spotify
-        time.sleep(0.1)
-        results = sp.next(results) if results['next'] else None
+                all_tracks.append(trim_object(track, TRACK_FIELDS))
 
     return all_tracks
 
 
+def known_playlist_tracks(playlist_id, snapshot_id=None, checkpoint=None):
+    """
+    Look up the tracks of a playlist that do not have to be fetched again, in the checkpoint of the current
+    run (if the playlist was completed) or in the playlist index (if the playlist's snapshot_id has not changed
+    since it was indexed). Shared by the sync and async extractors.
+
+    :param playlist_id: Spotify playlist ID.
+    :param snapshot_id: current snapshot_id of the playlist, as returned by the search.
+    :param checkpoint: optional Checkpoint of the run.
+    :return: list of tracks from the playlist, or None if it has to be fetched.
+    """
+    tracks = checkpoint.load_playlist(playlist_id) if checkpoint else None
+    if tracks is not None:
+        logging.info(f"Loaded {len(tracks)} tracks of playlist {playlist_id} from checkpoint")
+        return tracks
+
+    indexed = playlist_index.get(playlist_id) if snapshot_id else None
+    if not indexed or indexed['snapshot_id'] != snapshot_id:
+        return None
+
+    logging.info(f"Playlist {playlist_id} is unchanged, reusing {len(indexed['tracks'])} indexed tracks")
+    if checkpoint:
+        checkpoint.save_playlist(playlist_id, indexed['tracks'])
+    return indexed['tracks']
+
+
+def save_fetched_playlist_tracks(playlist_id, tracks, snapshot_id=None, checkpoint=None):
+    """
+    Index and checkpoint the tracks of a playlist that was just fetched. Shared by the sync and async extractors.
+
+    :param playlist_id: Spotify playlist ID.
+    :param tracks: list of tracks from the playlist.
+    :param snapshot_id: current snapshot_id of the playlist, as returned by the search.
+    :param checkpoint: optional Checkpoint of the run.
+    """
+    if snapshot_id:
+        playlist_index.set(playlist_id, {"snapshot_id": snapshot_id, "tracks": tracks})
+    if checkpoint:
+        checkpoint.save_playlist(playlist_id, tracks)
+
+
+def fetch_playlist_tracks(playlist_id, snapshot_id=None, checkpoint=None):
+    """
+    Fetch the tracks of a playlist, unless they are already known (see known_playlist_tracks).
+
+    :param playlist_id: Spotify playlist ID.
+    :param snapshot_id: current snapshot_id of the playlist, as returned by the search.
+    :param checkpoint: optional Checkpoint of the run.
+    :return: list of tracks from the playlist.
+    """
+    tracks = known_playlist_tracks(playlist_id, snapshot_id, checkpoint)
+    if tracks is None:
+        with metrics.stage("extract.playlists"):
+            tracks = fetch_tracks_batch(playlist_id)
+        save_fetched_playlist_tracks(playlist_id, tracks, snapshot_id, checkpoint)
+    return tracks
+
+
+def split_cached(cache, ids, name):
+    """
+    Split IDs into those already in a cache and those to request. Shared by the sync and async extractors.
+    IDs the API knew nothing about are cached as None, so they are not requested again either.
+
+    :param cache: SQLiteCache keyed by ID.
+    :param ids: list of IDs; empty IDs are skipped.
+    :param name: name of the cache in the log.
+    :return: tuple of the dict of cached values (without the None entries) and the list of missing IDs.
+    """
+    ids = [item_id for item_id in ids if item_id]
+    cached = cache.get_many(ids)
+    found = {item_id: value for item_id, value in cached.items() if value}
+    missing_ids = [item_id for item_id in ids if item_id not in cached]
+    logging.info(f"{name} cache: {len(cached)} hits, {len(missing_ids)} misses")
+    return found, missing_ids
+
+
+def id_batches(ids, batch_size):
+    """
+    :return: list of consecutive batches of at most batch_size IDs.
+    """
+    return [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+
+
+def store_batch(cache, batch_ids, fetched, found):
+    """
+    Cache the values fetched for a batch of IDs and add them to the values found so far.
+    IDs of the batch without a value are cached as None.
+
+    :param cache: SQLiteCache keyed by ID.
+    :param batch_ids: IDs of the batch that was requested.
+    :param fetched: dict of IDs to the values returned for them.
+    :param found: dict the fetched values are added to.
+    """
+    entries = dict.fromkeys(batch_ids)
+    entries.update(fetched)
+    cache.set_many(entries)
+    found.update(fetched)
+
+
+def audio_features_by_id(features):
+    """
+    :param features: "audio_features" list of an audio features response (with None for unknown tracks).
+    :return: dict of audio features with track IDs as keys.
+    """
+    return {feature['id']: feature for feature in features if feature}
+
+
+def artist_details_by_id(artists):
+    """
+    :param artists: "artists" list of a several-artists response (with None for unknown artists).
+    :return: dict of artist details ("genres" and "popularity") with artist IDs as keys.
+    """
+    return {artist['id']: {"genres": artist.get('genres', []), "popularity": artist.get('popularity')}
+            for artist in artists if artist}
+
+
 def fetch_audio_features_batch(track_ids):
     """
     Fetch audio features for a list of track IDs in batches.
     Spotify API allows up to 100 IDs per request so we can set the batch size up to 100.
+    Features found in the local cache are not requested again.
 
     :param track_ids: list of track IDs that contain audio features.
     :return: dict of audio features with track IDs as keys.
     """
     logging.info(f"Fetching audio features for {len(track_ids)} tracks")
 
-    # filter out any None values from track_ids
-    track_ids = [track_id for track_id in track_ids if track_id]
+    # tracks without features are cached as None, so they are not requested again either
+    audio_features, missing_ids = split_cached(audio_features_cache, track_ids, "Audio features")
 
-    audio_features = {}
-    batch_size = 100
+    for batch_ids in id_batches(missing_ids, AUDIO_FEATURES_BATCH_SIZE):
+        features = rate_limiter.call(get_client().audio_features, batch_ids)
+        store_batch(audio_features_cache, batch_ids, audio_features_by_id(features), audio_features)
 
-    for i in range(0, len(track_ids), batch_size):
-        batch_ids = track_ids[i:i + batch_size]
-        features = sp.audio_features(batch_ids)
-        time.sleep(0.2)
+    return audio_features
 
-        for feature in features:
-            if feature:
-                audio_features[feature['id']] = feature
 
-    return audio_features
+def attach_audio_features(tracks):
+    """
+    Attach audio features and artist names to a list of tracks, in place.
 
+    :param tracks: list of TrackRecords.
+    :return: the same list of tracks.
+    """
+    # deduplicate track IDs to only contain unique track IDs
+    track_ids = list({track.id for track in tracks})
 
-def fetch_tracks_from_playlists(playlist_ids):
+    # fetch audio features in batches
+    with metrics.stage("extract.audio_features"):
+        audio_features = fetch_audio_features_batch(track_ids)
+
+    return merge_audio_features(tracks, audio_features)
+
+
+def merge_audio_features(tracks, audio_features):
     """
-    Fetch tracks, audio features, and artist names from a list of playlist IDs.
+    Attach already fetched audio features and artist names to a list of tracks, in place.
 
-    :param playlist_ids: list of Spoitfy playlist IDs.
-    :return: list of tracks with audio features and artist names.
+    :param tracks: list of TrackRecords.
+    :param audio_features: dict of audio features with track IDs as keys.
+    :return: the same list of tracks.
     """
-    all_tracks = []
-    seen_track_ids = set()
-    audio_features = {}
+    # attach audio features to tracks; their artist names are written out from their artists
+    for track in tracks:
+        if track.id:
+            track.set_audio_features(audio_features.get(track.id))
 
-    for playlist_id in playlist_ids:
-        tracks = fetch_tracks_batch(playlist_id)
-        all_tracks.extend(tracks)
+    return tracks
 
-    # deduplicate track IDs to only contain unique track IDs
-    track_ids = list({track['id'] for track in all_tracks if track['id'] not in seen_track_ids})
-    seen_track_ids.update(track_ids)
 
-    # fetch audio features in batches
-    audio_features = fetch_audio_features_batch(track_ids)
+def fetch_artists_batch(artist_ids):
+    """
+    Fetch the details of a list of artist IDs in batches.
+    Spotify API allows up to 50 IDs per request to the several-artists endpoint.
+    Artists found in the local cache are not requested again.
 
-    # attach audio features and artist names to tracks
-    for track in all_tracks:
-        track_id = track['id']
-        if track_id:
-            track["audio_features"] = audio_features.get(track_id, {})
-            track["artist_names"] = [artist['name'] for artist in track['artists']]
+    :param artist_ids: list of artist IDs.
+    :return: dict of artist details ("genres" and "popularity") with artist IDs as keys.
+    """
+    logging.info(f"Fetching details for {len(artist_ids)} artists")
 
-    return all_tracks
+    # unknown artists are cached as None, so they are not requested again either
+    artists, missing_ids = split_cached(artists_cache, artist_ids, "Artists")
+
+    for batch_ids in id_batches(missing_ids, ARTISTS_BATCH_SIZE):
+        results = rate_limiter.call(get_client().artists, batch_ids)
+        store_batch(artists_cache, batch_ids, artist_details_by_id(results['artists']), artists)
+
+    return artists
+
+
+def attach_artist_details(tracks):
+    """
+    Attach the genres and popularity of their artists to a list of tracks, in place.
+
+    :param tracks: list of TrackRecords.
+    :return: the same list of tracks.
+    """
+    # collect unique artist IDs over all tracks
+    artist_ids = list({artist.id for track in tracks for artist in track.artists if artist.id})
+
+    with metrics.stage("extract.artists"):
+        artists = fetch_artists_batch(artist_ids)
+
+    return merge_artist_details(tracks, artists)
+
+
+def merge_artist_details(tracks, artists):
+    """
+    Attach already fetched artist details to the artists of a list of tracks, in place.
+
+    :param tracks: list of TrackRecords.
+    :param artists: dict of artist details with artist IDs as keys.
+    :return: the same list of tracks.
+    """
+    for track in tracks:
+        for artist in track.artists:
+            details = artists.get(artist.id, {})
+            artist.genres = details.get("genres", [])
+            artist.popularity = details.get("popularity")
+
+    return tracks
+
+
+def enrich_tracks(tracks):
+    """
+    Attach audio features and artist names to a list of tracks, and artist details if ENRICH_ARTISTS is set.
+
+    :param tracks: list of TrackRecords.
+    :return: the same list of tracks.
+    """
+    attach_audio_features(tracks)
+    if ENRICH_ARTISTS:
+        attach_artist_details(tracks)
+    return tracks
+
+
+def fetch_tracks_from_playlists(playlist_ids, checkpoint=None, snapshot_ids=None, year=None, registry=None):
+    """
+    Fetch tracks, audio features, and artist names from a list of playlist IDs.
+    Every track is returned and enriched only once, at its first occurrence.
+
+    :param playlist_ids: list of Spoitfy playlist IDs.
+    :param checkpoint: optional Checkpoint; completed playlists are loaded from it instead of fetched.
+    :param snapshot_ids: optional dict of playlist IDs to their current snapshot_id;
+        playlists with an unchanged snapshot_id are loaded from the playlist index.
+    :param year: year the playlists were searched for, recorded in the registry.
+    :param registry: optional TrackRegistry of the run; tracks it already holds are only recorded
+        as members of the playlists, not returned again.
+    :return: list of TrackRecords of the new tracks, with audio features and artist names.
+    """
+    new_tracks = []
+    snapshot_ids = snapshot_ids or {}
+    registry = TrackRegistry() if registry is None else registry
+
+    for playlist_id in playlist_ids:
+        tracks = fetch_playlist_tracks(playlist_id, snapshot_ids.get(playlist_id), checkpoint)
+        new_tracks.extend(filter(None, (registry.add(track, playlist_id, year) for track in tracks)))
 
+    return enrich_tracks(new_tracks)
 
-def fetch_tracks_from_playlists_by_year(year_range, limit_per_year=PLAYLIST_LIMIT):
+
+def fetch_tracks_from_playlists_by_year(year_range, limit_per_year=PLAYLIST_LIMIT, checkpoint=None):
     """
     Fetch tracks, audio features, and artist details dynamically based on a range of years.
 
     :param year_range: range of years to search for playlists.
     :param limit_per_year: number of playlists to fetch per year.
-    :return: list of tracks with audio features and artist names.
+    :param checkpoint: optional Checkpoint; completed years and playlists are skipped on resume.
+    :return: list of TrackRecords of the unique tracks, with audio features, artist names, and the
+        "playlist_ids" and "years" they were found in. Their to_dict() gives the raw output of a track.
     """
-    all_tracks = []
-    seen_playlist_ids = set()
+    registry = TrackRegistry()
+    completed = {year: checkpoint.load_year(year) for year in year_range} if checkpoint else {}
 
-    for year in year_range:
-        # looking for the playlists "Top Hits of [the year]"
-        # you can adjust if needed
-        query_template = "Top Hits of {year}"
-        playlist_ids = fetch_playlists_by_year(year, limit=limit_per_year, query_template=query_template)
+    # years complete in order, so the playlists of completed years were taken before any pending year
+    seen_playlist_ids = {playlist_id for year in completed.values() if year for playlist_id in year['playlist_ids']}
+    playlists_by_year = discover_playlists([year for year in year_range if completed.get(year) is None],
+                                           limit_per_year, seen_playlist_ids)
 
-        # note: if not using query_template, un-comment the next line and comment out the previouse lines
-        # playlist_ids = fetch_playlists_by_year(year, limit=limit_per_year)
+    for year in year_range:
+        if completed.get(year) is not None:
+            logging.info(f"Loaded {len(completed[year]['tracks'])} tracks for year {year} from checkpoint")
+            registry.restore(completed[year]['tracks'], completed[year].get('memberships', {}), year)
+            continue
 
-        # deduplicate playlist IDs
-        unique_playlist_ids = [pid for pid in playlist_ids if pid not in seen_playlist_ids]
-        seen_playlist_ids.update(unique_playlist_ids)
+        playlists = playlists_by_year[year]
+        unique_playlist_ids = [playlist['id'] for playlist in playlists]
+        snapshot_ids = {playlist['id']: playlist['snapshot_id'] for playlist in playlists}
 
         if not unique_playlist_ids:
-            logging.info(f"No playlists found for year {year}")
+            if checkpoint:
+                checkpoint.save_year(year, [], [])
             continue  # Skip this year if no playlists are found
 
         # fetch tracks and artist details from playlists
-        logging.info(f"Fetching tracks from {len(unique_playlist_ids)} playlists for year {year}")
-        all_tracks.extend(fetch_tracks_from_playlists(unique_playlist_ids))
+        tracks = fetch_tracks_from_playlists(unique_playlist_ids, checkpoint=checkpoint, snapshot_ids=snapshot_ids,
+                                             year=year, registry=registry)
 
-    return all_tracks
+        if checkpoint:
+            checkpoint.save_year(year, unique_playlist_ids, tracks,
+                                 memberships=registry.memberships_for(year, unique_playlist_ids))
+
+    logging.info(f"Found {len(registry)} unique tracks")
+    return registry.records()
+
+
+def iter_new_tracks(playlists, year, registry):
+    """
+    Fetch playlists one at a time and yield the tracks not seen before in the run, enriched,
+    as soon as each playlist is finished.
+
+    :param playlists: playlists of the year (dicts with "id" and "snapshot_id").
+    :param year: year the playlists were discovered for.
+    :param registry: TrackRegistry of the run.
+    :return: generator of TrackRecords with audio features and artist names.
+    """
+    for playlist in playlists:
+        tracks = fetch_playlist_tracks(playlist['id'], playlist['snapshot_id'])
+        yield from enrich_tracks(list(filter(None, (registry.add(track, playlist['id'], year) for track in tracks))))
+
+
+def iter_tracks_from_playlists_by_year(year_range, limit_per_year=PLAYLIST_LIMIT, registry=None):
+    """
+    Fetch tracks like fetch_tracks_from_playlists_by_year, but yield the new tracks of each playlist
+    as soon as the playlist is finished, so that they can be written out without being kept in memory.
+    Audio features are fetched per playlist; features seen before are served by the cache.
+
+    :param year_range: range of years to search for playlists.
+    :param limit_per_year: number of playlists to fetch per year.
+    :param registry: optional TrackRegistry; after the run it lists the playlists and years of every track.
+    :return: generator of TrackRecords of the unique tracks, with audio features and artist names.
+    """
+    registry = TrackRegistry(keep_records=False) if registry is None else registry
+    playlists_by_year = discover_playlists(year_range, limit_per_year)
+
+    for year in year_range:
+        yield from iter_new_tracks(playlists_by_year[year], year, registry)
+
+
+def build_output_filename(year_start, year_end, format="json", compression=None):
+    """
+    Create a timestamped filename for the raw output of a run.
+
+    :param year_start: first year of the run.
+    :param year_end: last year of the run.
+    :param format: format of the output file (json or ndjson).
+    :param compression: compression of NDJSON output (None, gzip or zstd).
+    :return: filename.
+    """
+    return ("spotify_dataset_by_year_"
+            + str(year_start)
+            + "-"
+            + str(year_end)
+            + "_"
+            + datetime.now().strftime("%Y%m%d_%H%M%S")
+            + "."
+            + format
+            + (COMPRESSION_EXTENSIONS[compression] if format == "ndjson" else ""))
 
 
 def save_data_to_file(data, output_dir, filename, format="json"):
     """
     Save data to a specified file in JSON or other formats.
 
-    :param data: data to save.
+    :param data: data to save, e.g. a list of TrackRecords. For ndjson this can be any iterable of records,
+        e.g. a generator, which is written as it is consumed.
     :param output_dir: directory to save the data to.
-    :param filename: name of the output file.
-    :param format: format of the output file. (default: json).
+    :param filename: name of the output file. For ndjson a ".gz" or ".zst" extension compresses the file.
+    :param format: format of the output file: json or ndjson (default: json).
     :return: path to the saved file.
     """
     os.makedirs(output_dir, exist_ok=True)
     file_path = os.path.join(output_dir, filename)
 
-    if format == "json":
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-    else:
-        raise ValueError(f"Unsupported format: {format}")
+    # when data is a generator, this stage also includes the time spent producing it
+    with metrics.stage("extract.write"):
+        if format == "json":
+            with open(file_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=4, default=to_json)
+        elif format == "ndjson":
+            with NDJSONWriter(file_path) as writer:
+                writer.write_many(data)
+            logging.info(f"Wrote {writer.count} records")
+        else:
+            raise ValueError(f"Unsupported format: {format}")
 
     logging.info(f"Data successfully saved to {file_path}")
     return file_path
 
-def main():
-    # start timing the main function
-    start_time = time.time()
+def save_partitions(tracks, output_dir, year_range, compression=PARTITION_COMPRESSION):
+    """
+    Save the tracks of a run into year partitions, each track in the partition of the first year it was found in.
+    Every year of the run gets a partition, also when it has no tracks, so that it replaces older data of the year.
+
+    :param tracks: list of TrackRecords with their "years", as returned by fetch_tracks_from_playlists_by_year.
+    :param output_dir: root directory of the partitions.
+    :param year_range: range of years of the run.
+    :param compression: compression of the part files: None, "gzip" or "zstd".
+    :return: dict of years to the number of tracks written.
+    """
+    by_year = {year: [] for year in year_range}
+    for track in tracks:
+        by_year.setdefault(track.years[0], []).append(track)
 
-    # define year range
-    year_range = range(YEAR_START, YEAR_END + 1)
+    with metrics.stage("extract.write"), \
+            PartitionWriter(output_dir, compression, run=f"{year_range[0]}-{year_range[-1]}") as writer:
+        counts = {year: writer.write_partition(year, year_tracks) for year, year_tracks in by_year.items()}
+        writer.commit()
 
-    # fetch tracks dynamically by year
-    spotify_data = fetch_tracks_from_playlists_by_year(year_range)
+    logging.info(f"Saved {sum(counts.values())} tracks to {len(counts)} year partitions in {output_dir}")
+    return counts
+
+
+def record_run_metrics():
+    """Add the rate limiter and cache counters of the run to the metrics."""
+    metrics.record_cache("audio_features", audio_features_cache.stats())
+    metrics.record_cache("playlist_index", playlist_index.stats())
+    metrics.record_cache("searches", search_cache.stats())
+    if http_cache is not None:
+        metrics.record_cache("http", http_cache.cache.stats())
+        metrics.count("http_not_modified", http_cache.not_modified)
+    if ENRICH_ARTISTS:
+        metrics.record_cache("artists", artists_cache.stats())
+
+
+def run(year_start=None, year_end=None, format=None, output_dir=None, before_commit=None):
+    """
+    Extract the tracks of a range of years and save them. Arguments left out default to the module settings.
+
+    :param year_start: first year to extract (default: YEAR_START).
+    :param year_end: last year to extract (default: YEAR_END).
+    :param format: output format: json, ndjson, or partitioned (default: OUTPUT_FORMAT).
+    :param output_dir: directory of the raw output (default: OUTPUT_DIR).
+    :param before_commit: optional function called before partitions are committed to the index;
+        if it raises, the partitions written are removed and the index is left unchanged.
+    :return: path of the raw file written, or the root directory of the partitions.
+    """
+    year_start = YEAR_START if year_start is None else year_start
+    year_end = YEAR_END if year_end is None else year_end
+    format = format or OUTPUT_FORMAT
+    output_dir = output_dir or OUTPUT_DIR
+
+    # define year range
+    year_range = range(year_start, year_end + 1)
 
     # create a timestamped filename
-    filename = ("spotify_dataset_by_year_"
-                + str(YEAR_START)
-                + "-"
-                + str(YEAR_END)
-                + "_"
-                + datetime.now().strftime("%Y%m%d_%H%M%S")
-                + ".json")
-    output_dir = "./raw_data"
+    filename = build_output_filename(year_start, year_end, format, OUTPUT_COMPRESSION)
+
+    if format == "ndjson":
+        # stream tracks to the file as each playlist finishes; an interrupted streaming run is
+        # cheap to repeat because unchanged playlists and known audio features come from the local caches
+        registry = TrackRegistry(keep_records=False)
+        file_path = save_data_to_file(iter_tracks_from_playlists_by_year(year_range, registry=registry),
+                                      output_dir, filename, format="ndjson")
+
+        # the playlists and years of a track are only complete at the end of the run, so they are
+        # written next to the tracks; the "_" prefix keeps the transform from reading them as tracks
+        save_data_to_file(registry.iter_memberships(), output_dir, "_memberships_" + filename, format="ndjson")
+        return file_path
+
+    if format == "partitioned":
+        # stream the tracks of each year into its own partition; tracks and playlists are still
+        # deduplicated across the whole run, so each track lands in the first year it was found in
+        registry = TrackRegistry(keep_records=False)
+        playlists_by_year = discover_playlists(year_range)
+        with metrics.stage("extract.write"), \
+                PartitionWriter(output_dir, PARTITION_COMPRESSION, run=f"{year_start}-{year_end}") as writer:
+            for year in year_range:
+                tracks = iter_new_tracks(playlists_by_year[year], year, registry)
+                logging.info(f"Wrote {writer.write_partition(year, tracks)} tracks for year {year}")
+            if before_commit:
+                before_commit()
+            writer.commit(registry.iter_memberships())
+        logging.info(f"Data successfully saved to {len(year_range)} year partitions in {output_dir}")
+        return output_dir
+
+    # resume from the checkpoints of a previous, interrupted run over the same years
+    checkpoint = Checkpoint(os.path.join(CHECKPOINT_DIR, f"{year_start}-{year_end}"))
+
+    # fetch tracks dynamically by year
+    spotify_data = fetch_tracks_from_playlists_by_year(year_range, checkpoint=checkpoint)
 
     # save data to file
-    save_data_to_file(spotify_data, output_dir, filename)
+    file_path = save_data_to_file(spotify_data, output_dir, filename)
+
+    # the run is complete, so its checkpoints are no longer needed
+    checkpoint.clear()
+    return file_path
+
+
+def log_run_stats():
+    """Log the rate limiter and cache statistics of the run and evict expired cache entries."""
+    logging.info(f"Rate limiter: {rate_limiter.stats()}")
+    logging.info(f"Audio features cache: {audio_features_cache.stats()}, evicted {audio_features_cache.evict()} entries")
+    if ENRICH_ARTISTS:
+        logging.info(f"Artists cache: {artists_cache.stats()}, evicted {artists_cache.evict()} entries")
+    logging.info(f"Playlist index: {playlist_index.stats()}, evicted {playlist_index.evict()} entries")
+    logging.info(f"Search cache: {search_cache.stats()}, evicted {search_cache.evict()} entries")
+    if http_cache is not None:
+        logging.info(f"HTTP cache: {http_cache.stats()}, evicted {http_cache.cache.evict()} entries")
+
+
+def main():
+    # Setup logging
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    # start timing the main function
+    start_time = time.time()
+
+    run()
 
     # end timing the main function
     end_time = time.time()
+    log_run_stats()
     logging.info(f"Total execution time: {end_time - start_time:.2f} seconds")
 
+    record_run_metrics()
+    logging.info(f"Run report saved to {write_run_report('extract')}")
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,467 @@
+# spotify_extract_async.py
+
+"""
+This file provides an asynchronous extraction mode for spotify_extract.py.
+
+Features:
+- Fetches many playlists and audio-feature batches at once over a shared HTTP session.
+- Caps the number of in-flight requests with a configurable concurrency limit.
+- Revalidates repeated requests through the HTTP cache of spotify_extract.py (ETag/Last-Modified).
+- Keeps the same search, deduplication, and enrichment rules as spotify_extract.py;
+  audio features of all new tracks of the run are fetched in one concurrent pass.
+
+Output:
+- The same JSON file (or year partitions) that spotify_extract.py writes, in the same track order.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+
+import aiohttp
+from yarl import URL
+
+from spotify_extract import (
+    YEAR_START,
+    YEAR_END,
+    PLAYLIST_ITEM_FIELDS,
+    AUDIO_FEATURES_BATCH_SIZE,
+    ARTISTS_BATCH_SIZE,
+    PLAYLIST_LIMIT,
+    QUERY_TEMPLATES,
+    SEARCH_PAGES,
+    TRACK_FIELDS,
+    CHECKPOINT_DIR,
+    PAGE_SIZE,
+    PARALLEL_PAGES,
+    ENRICH_ARTISTS,
+    OUTPUT_FORMAT,
+    OUTPUT_COMPRESSION,
+    OUTPUT_DIR,
+    PlaylistSearch,
+    artist_details_by_id,
+    artists_cache,
+    audio_features_by_id,
+    audio_features_cache,
+    build_output_filename,
+    get_client,
+    http_cache,
+    id_batches,
+    known_playlist_tracks,
+    log_run_stats,
+    merge_artist_details,
+    merge_audio_features,
+    rate_limiter,
+    record_run_metrics,
+    save_fetched_playlist_tracks,
+    save_data_to_file,
+    save_partitions,
+    select_new_playlists,
+    split_cached,
+    store_batch,
+    trim_object,
+)
+from spotify_checkpoint import Checkpoint
+from spotify_metrics import endpoint_name, metrics, write_run_report
+from spotify_rate_limiter import parse_retry_after
+from spotify_registry import TrackRegistry
+
+# base URL of the Spotify Web API
+API_BASE_URL = "https://api.spotify.com/v1"
+
+# maximum number of requests that may be in flight at the same time
+CONCURRENCY_LIMIT = 10
+
+
+def get_auth_headers():
+    """
+    Build the authorization headers for the Spotify Web API.
+    The credentials manager caches the token (see TOKEN_CACHE_PATH), so this is cheap to call per request.
+
+    :return: dict of HTTP headers.
+    """
+    token = get_client().auth_manager.get_access_token(as_dict=False)
+    return {"Authorization": f"Bearer {token}"}
+
+
+async def get_json(session, semaphore, url, params=None):
+    """
+    Send a GET request to the Spotify Web API and decode the JSON response.
+    Requests go through the shared rate limiter and are retried when throttled.
+
+    :param session: shared aiohttp client session.
+    :param semaphore: semaphore that caps the number of in-flight requests.
+    :param url: absolute URL or path relative to API_BASE_URL.
+    :param params: query string parameters.
+    :return: decoded JSON response.
+    """
+    if not url.startswith("http"):
+        url = f"{API_BASE_URL}/{url}"
+
+    # the HTTP cache is keyed by the full URL, like in the sync client
+    cache_key = str(URL(url).update_query(params)) if params else url
+    entry, conditional_headers = http_cache.lookup(cache_key) if http_cache is not None else (None, {})
+
+    for attempt in range(rate_limiter.max_retries + 1):
+        async with semaphore:
+            await rate_limiter.acquire_async()
+            start = time.perf_counter()
+            headers = dict(get_auth_headers(), **conditional_headers)
+            async with session.get(url, params=params, headers=headers) as response:
+                body = await response.read()
+                metrics.observe_request(endpoint_name(url), time.perf_counter() - start, response.status, len(body))
+
+                if response.status == 304 and entry is not None:
+                    rate_limiter.record_success()
+                    return json.loads(http_cache.revalidated(entry))
+                if response.status == 429 and attempt < rate_limiter.max_retries:
+                    retry_after = parse_retry_after(response.headers)
+                else:
+                    response.raise_for_status()
+                    rate_limiter.record_success()
+                    if http_cache is not None and response.status == 200:
+                        http_cache.store(cache_key, response.headers, body)
+                    return json.loads(body)
+
+        # back off outside the semaphore so other requests are not blocked
+        rate_limiter.record_throttle(retry_after)
+        rate_limiter.record_retry()
+        delay = rate_limiter.backoff_delay(attempt, retry_after)
+        await asyncio.sleep(delay)
+        rate_limiter.record_sleep("backoff", delay)
+
+
+async def search_playlists_by_year(session, semaphore, year, limit=PLAYLIST_LIMIT, query_template="{year}",
+                                   pages=SEARCH_PAGES):
+    """
+    Search for playlists containing a specific year in their title, with the search rules
+    (and search cache) of spotify_extract.py.
+
+    :param session: shared aiohttp client session.
+    :param semaphore: semaphore that caps the number of in-flight requests.
+    :param year: the year to search for in playlist titles.
+    :param limit: number of search results per page.
+    :param query_template: template for formatting the query string.
+    :param pages: maximum number of result pages to go through.
+    :return: list of dicts with the "id", "name", and "snapshot_id" of each playlist.
+    """
+    search = PlaylistSearch(year, limit, query_template, pages)
+    for offset in search:
+        with metrics.stage("extract.search"):
+            search.receive(await get_json(session, semaphore, "search",
+                                          {"q": search.query, "type": "playlist", "limit": search.limit,
+                                           "offset": offset}))
+    return search.playlists()
+
+
+async def fetch_tracks_batch(session, semaphore, playlist_id):
+    """
+    Fetch all tracks from a playlist. Once the first page has told the total, the remaining pages
+    are requested concurrently (unless PARALLEL_PAGES is 1) and reassembled in order.
+    Only the fields in TRACK_FIELDS are requested and kept.
+
+    :param session: shared aiohttp client session.
+    :param semaphore: semaphore that caps the number of in-flight requests.
+    :param playlist_id: Spotify playlist ID.
+    :return: list of tracks from the playlist.
+    """
+    logging.info(f"Fetching tracks from playlist {playlist_id}")
+    url = f"playlists/{playlist_id}/tracks"
+    params = {"limit": PAGE_SIZE, "offset": 0, "additional_types": "track", "fields": PLAYLIST_ITEM_FIELDS}
+    results = await get_json(session, semaphore, url, params)
+    pages = []
+
+    if results and results['next'] and PARALLEL_PAGES > 1 and results.get('total') and results.get('limit'):
+        # gather keeps the offset order; the semaphore and the rate limiter bound the requests in flight
+        offsets = range(results['limit'], results['total'], results['limit'])
+        pages = [results] + list(await asyncio.gather(*[
+            get_json(session, semaphore, url, dict(params, limit=results['limit'], offset=offset))
+            for offset in offsets
+        ]))
+    else:
+        while results:
+            pages.append(results)
+            results = await get_json(session, semaphore, results['next']) if results['next'] else None
+
+    all_tracks = []
+    for page in pages:
+        for item in page['items']:
+            track = item['track']
+            if track and track.get('id'):
+                all_tracks.append(trim_object(track, TRACK_FIELDS))
+
+    return all_tracks
+
+
+async def fetch_audio_features_batch(session, semaphore, track_ids):
+    """
+    Fetch audio features for a list of track IDs, sending all batches concurrently.
+    Features found in the local cache are not requested again.
+
+    :param session: shared aiohttp client session.
+    :param semaphore: semaphore that caps the number of in-flight requests.
+    :param track_ids: list of track IDs that contain audio features.
+    :return: dict of audio features with track IDs as keys.
+    """
+    logging.info(f"Fetching audio features for {len(track_ids)} tracks")
+
+    audio_features, missing_ids = split_cached(audio_features_cache, track_ids, "Audio features")
+    batches = id_batches(missing_ids, AUDIO_FEATURES_BATCH_SIZE)
+
+    with metrics.stage("extract.audio_features"):
+        responses = await asyncio.gather(*[
+            get_json(session, semaphore, "audio-features", {"ids": ",".join(batch_ids)}) for batch_ids in batches
+        ])
+
+    for batch_ids, response in zip(batches, responses):
+        store_batch(audio_features_cache, batch_ids, audio_features_by_id(response['audio_features']),
+                    audio_features)
+
+    return audio_features
+
+
+async def fetch_artists_batch(session, semaphore, artist_ids):
+    """
+    Fetch the details of a list of artist IDs, sending all batches concurrently.
+    Artists found in the local cache are not requested again.
+
+    :param session: shared aiohttp client session.
+    :param semaphore: semaphore that caps the number of in-flight requests.
+    :param artist_ids: list of artist IDs.
+    :return: dict of artist details ("genres" and "popularity") with artist IDs as keys.
+    """
+    logging.info(f"Fetching details for {len(artist_ids)} artists")
+
+    artists, missing_ids = split_cached(artists_cache, artist_ids, "Artists")
+    batches = id_batches(missing_ids, ARTISTS_BATCH_SIZE)
+
+    with metrics.stage("extract.artists"):
+        responses = await asyncio.gather(*[
+            get_json(session, semaphore, "artists", {"ids": ",".join(batch_ids)}) for batch_ids in batches
+        ])
+
+    for batch_ids, response in zip(batches, responses):
+        store_batch(artists_cache, batch_ids, artist_details_by_id(response['artists']), artists)
+
+    return artists
+
+
+async def enrich_tracks(session, semaphore, tracks):
+    """
+    Attach audio features and artist names to a list of tracks, and artist details if ENRICH_ARTISTS is set.
+
+    :param session: shared aiohttp client session.
+    :param semaphore: semaphore that caps the number of in-flight requests.
+    :param tracks: list of TrackRecords.
+    :return: the same list of tracks.
+    """
+    track_ids = list({track.id for track in tracks})
+    if not ENRICH_ARTISTS:
+        audio_features = await fetch_audio_features_batch(session, semaphore, track_ids)
+        return merge_audio_features(tracks, audio_features)
+
+    artist_ids = list({artist.id for track in tracks for artist in track.artists if artist.id})
+    audio_features, artists = await asyncio.gather(
+        fetch_audio_features_batch(session, semaphore, track_ids),
+        fetch_artists_batch(session, semaphore, artist_ids),
+    )
+    return merge_artist_details(merge_audio_features(tracks, audio_features), artists)
+
+
+async def fetch_playlist_tracks(session, semaphore, playlist_id, snapshot_id=None, checkpoint=None):
+    """
+    Fetch the tracks of a playlist, unless they are already known from the checkpoint of the run
+    or from the playlist index (see known_playlist_tracks in spotify_extract.py).
+
+    :param session: shared aiohttp client session.
+    :param semaphore: semaphore that caps the number of in-flight requests.
+    :param playlist_id: Spotify playlist ID.
+    :param snapshot_id: current snapshot_id of the playlist, as returned by the search.
+    :param checkpoint: optional Checkpoint of the run.
+    :return: list of tracks from the playlist.
+    """
+    tracks = known_playlist_tracks(playlist_id, snapshot_id, checkpoint)
+    if tracks is None:
+        with metrics.stage("extract.playlists"):
+            tracks = await fetch_tracks_batch(session, semaphore, playlist_id)
+        save_fetched_playlist_tracks(playlist_id, tracks, snapshot_id, checkpoint)
+    return tracks
+
+
+async def fetch_tracks_from_playlists(session, semaphore, playlist_ids, checkpoint=None, snapshot_ids=None,
+                                      year=None, registry=None):
+    """
+    Fetch tracks, audio features, and artist names from a list of playlist IDs.
+    Every track is returned and enriched only once, at its first occurrence.
+
+    :param session: shared aiohttp client session.
+    :param semaphore: semaphore that caps the number of in-flight requests.
+    :param playlist_ids: list of Spotify playlist IDs.
+    :param checkpoint: optional Checkpoint; completed playlists are loaded from it instead of fetched.
+    :param snapshot_ids: optional dict of playlist IDs to their current snapshot_id.
+    :param year: year the playlists were searched for, recorded in the registry.
+    :param registry: optional TrackRegistry of the run; tracks it already holds are not returned again.
+    :return: list of TrackRecords of the new tracks, with audio features and artist names.
+    """
+    snapshot_ids = snapshot_ids or {}
+    registry = TrackRegistry() if registry is None else registry
+
+    # gather keeps the playlist order, so the output matches the sequential version
+    playlists = await asyncio.gather(*[
+        fetch_playlist_tracks(session, semaphore, playlist_id, snapshot_ids.get(playlist_id), checkpoint)
+        for playlist_id in playlist_ids
+    ])
+    new_tracks = [
+        record
+        for playlist_id, tracks in zip(playlist_ids, playlists)
+        for record in (registry.add(track, playlist_id, year) for track in tracks)
+        if record
+    ]
+
+    return await enrich_tracks(session, semaphore, new_tracks)
+
+
+async def fetch_tracks_from_playlists_by_year(year_range, limit_per_year=PLAYLIST_LIMIT,
+                                              concurrency=CONCURRENCY_LIMIT, checkpoint=None):
+    """
+    Fetch tracks, audio features, and artist details concurrently for a range of years.
+
+    :param year_range: range of years to search for playlists.
+    :param limit_per_year: number of playlists to fetch per year.
+    :param concurrency: maximum number of requests in flight at the same time.
+    :param checkpoint: optional Checkpoint; completed years and playlists are skipped on resume.
+    :return: list of TrackRecords of the unique tracks, with audio features, artist names, and the
+        "playlist_ids" and "years" they were found in.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    completed = {year: checkpoint.load_year(year) for year in year_range} if checkpoint else {}
+    pending_years = [year for year in year_range if completed.get(year) is None]
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        # every query of every pending year is searched at once
+        searches = [(year, template) for year in pending_years for template in QUERY_TEMPLATES]
+        search_results = await asyncio.gather(*[
+            search_playlists_by_year(session, semaphore, year, limit=limit_per_year, query_template=template)
+            for year, template in searches
+        ])
+        found_by_year = {year: [] for year in pending_years}
+        for (year, template), playlists in zip(searches, search_results):
+            found_by_year[year].extend(playlists)
+
+        for year in year_range:
+            if completed.get(year) is not None:
+                logging.info(f"Loaded {len(completed[year]['tracks'])} tracks for year {year} from checkpoint")
+
+        # deduplicate playlists across queries and years, like the sequential version; years complete
+        # in order, so the playlists of completed years were taken before any pending year
+        seen_playlist_ids = {playlist_id for year in completed.values() if year for playlist_id in year['playlist_ids']}
+        playlists_by_year = {}
+        snapshot_ids = {}
+        for year, playlists in select_new_playlists(found_by_year, seen_playlist_ids).items():
+            if not playlists:
+                if checkpoint:
+                    checkpoint.save_year(year, [], [])
+                continue
+            playlists_by_year[year] = [playlist['id'] for playlist in playlists]
+            snapshot_ids.update((playlist['id'], playlist['snapshot_id']) for playlist in playlists)
+
+        # fetch the playlists of all years at once; playlist IDs are unique across years
+        playlist_ids = [playlist_id for playlist_ids in playlists_by_year.values() for playlist_id in playlist_ids]
+        playlists = await asyncio.gather(*[
+            fetch_playlist_tracks(session, semaphore, playlist_id, snapshot_ids.get(playlist_id), checkpoint)
+            for playlist_id in playlist_ids
+        ])
+        tracks_by_playlist = dict(zip(playlist_ids, playlists))
+
+        # register tracks in year and playlist order, so the first occurrence of every track
+        # (and with it the output order) is the same as in the sequential version
+        registry = TrackRegistry()
+        new_tracks_by_year = {}
+        for year in year_range:
+            if completed.get(year) is not None:
+                registry.restore(completed[year]['tracks'], completed[year].get('memberships', {}), year)
+            elif year in playlists_by_year:
+                new_tracks_by_year[year] = [
+                    record
+                    for playlist_id in playlists_by_year[year]
+                    for record in (registry.add(track, playlist_id, year) for track in tracks_by_playlist[playlist_id])
+                    if record
+                ]
+
+        # every new track of the run is enriched in one go
+        new_tracks = [track for tracks in new_tracks_by_year.values() for track in tracks]
+        await enrich_tracks(session, semaphore, new_tracks)
+
+    if checkpoint:
+        for year, tracks in new_tracks_by_year.items():
+            checkpoint.save_year(year, playlists_by_year[year], tracks,
+                                 memberships=registry.memberships_for(year, playlists_by_year[year]))
+
+    logging.info(f"Found {len(registry)} unique tracks")
+    return registry.records()
+
+
+def run(year_start=None, year_end=None, format=None, output_dir=None):
+    """
+    Extract the tracks of a range of years concurrently and save them, like spotify_extract.run().
+    Arguments left out default to the settings of spotify_extract.py.
+
+    :param year_start: first year to extract (default: YEAR_START).
+    :param year_end: last year to extract (default: YEAR_END).
+    :param format: output format: json, ndjson, or partitioned (default: OUTPUT_FORMAT).
+    :param output_dir: directory of the raw output (default: OUTPUT_DIR).
+    :return: path of the raw file written, or the root directory of the partitions.
+    """
+    year_start = YEAR_START if year_start is None else year_start
+    year_end = YEAR_END if year_end is None else year_end
+    format = format or OUTPUT_FORMAT
+    output_dir = output_dir or OUTPUT_DIR
+
+    # define year range
+    year_range = range(year_start, year_end + 1)
+
+    # resume from the checkpoints of a previous, interrupted run over the same years
+    checkpoint = Checkpoint(os.path.join(CHECKPOINT_DIR, f"{year_start}-{year_end}"))
+
+    # fetch tracks concurrently by year
+    spotify_data = asyncio.run(fetch_tracks_from_playlists_by_year(year_range, checkpoint=checkpoint))
+
+    if format == "partitioned":
+        save_partitions(spotify_data, output_dir, year_range)
+        path = output_dir
+    else:
+        # create a timestamped filename
+        filename = build_output_filename(year_start, year_end, format, OUTPUT_COMPRESSION)
+
+        # save data to file
+        path = save_data_to_file(spotify_data, output_dir, filename, format=format)
+
+    # the run is complete, so its checkpoints are no longer needed
+    checkpoint.clear()
+    return path
+
+
+def main():
+    # Setup logging
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    # start timing the main function
+    start_time = time.time()
+
+    run()
+
+    # end timing the main function
+    end_time = time.time()
+    log_run_stats()
+    logging.info(f"Total execution time: {end_time - start_time:.2f} seconds")
+
+    record_run_metrics()
+    logging.info(f"Run report saved to {write_run_report('extract_async')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# spotify_http_cache.py
+
+"""
+This file provides a conditional-request HTTP cache for the Spotify Web API.
+
+Features:
+- Stores the body of GET responses that carry an ETag or Last-Modified validator, keyed by URL.
+- Sends If-None-Match / If-Modified-Since on the next request for the same URL, so an unchanged
+  resource is answered with 304 Not Modified and no body is transferred.
+- Serves 304 responses from the stored body, so callers (spotipy, the async extractor) see a normal 200.
+- Plugs into requests as a pooled HTTPAdapter (keep-alive connections, pool sized for concurrent fetching).
+"""
+
+from requests.adapters import HTTPAdapter
+
+
+class HTTPCache:
+    """
+    Validators and bodies of cacheable API responses, stored in a SQLiteCache.
+
+    :param cache: SQLiteCache holding one entry per URL.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.not_modified = 0
+
+    def lookup(self, url):
+        """
+        :param url: absolute request URL, including the query string.
+        :return: tuple of the cached entry (or None) and the conditional request headers to send.
+        """
+        entry = self.cache.get(url)
+        if entry is None:
+            return None, {}
+
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return entry, headers
+
+    def store(self, url, headers, body):
+        """
+        Store a 200 response if it can be revalidated later.
+
+        :param url: absolute request URL, including the query string.
+        :param headers: response headers (case-insensitive mapping).
+        :param body: response body as bytes.
+        """
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        if not etag and not last_modified:
+            return
+
+        self.cache.set(url, {
+            "etag": etag,
+            "last_modified": last_modified,
+            "content_type": headers.get("Content-Type"),
+            "body": body.decode("utf-8"),
+        })
+
+    def revalidated(self, entry):
+        """
+        Count a 304 response and return the body it confirmed.
+
+        :param entry: cached entry returned by lookup().
+        :return: cached body as bytes.
+        """
+        self.not_modified += 1
+        return entry["body"].encode("utf-8")
+
+    def stats(self):
+        """
+        :return: dict with the cache hits and misses of the lookups and the number of 304 responses.
+        """
+        return dict(self.cache.stats(), not_modified=self.not_modified)
+
+
+class ConditionalCacheAdapter(HTTPAdapter):
+    """
+    requests transport adapter that revalidates GET requests against an HTTPCache.
+    Responses served from the cache keep status 200 for the caller and have a "revalidated" attribute set to True.
+
+    :param http_cache: HTTPCache, or None to only pool connections.
+    :param kwargs: arguments of HTTPAdapter, e.g. pool_maxsize and max_retries.
+    """
+
+    def __init__(self, http_cache=None, **kwargs):
+        self.http_cache = http_cache
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if self.http_cache is None or request.method != "GET":
+            return super().send(request, **kwargs)
+
+        entry, headers = self.http_cache.lookup(request.url)
+        request.headers.update(headers)
+        response = super().send(request, **kwargs)
+
+        if response.status_code == 304 and entry is not None:
+            response.status_code = 200
+            response.reason = "OK"
+            response._content = self.http_cache.revalidated(entry)
+            response.encoding = "utf-8"
+            if entry.get("content_type"):
+                response.headers["Content-Type"] = entry["content_type"]
+            response.revalidated = True
+        elif response.status_code == 200:
+            self.http_cache.store(request.url, response.headers, response.content)
+
+        return response
@@ -0,0 +1,116 @@
+# spotify_io.py
+
+"""
+This file provides file helpers shared by the pipeline stages, mainly for newline-delimited JSON (NDJSON).
+
+Features:
+- Opens plain, gzip (.gz), and zstandard (.zst) files based on their extension.
+- Writes records one line at a time, so callers never need the whole dataset in memory.
+- Reads records back one at a time.
+- Fingerprints files (size, modification time, content hash) to detect new or changed inputs.
+
+Note:
+- zstandard compression needs the optional `zstandard` package (pip install zstandard).
+"""
+
+import gzip
+import hashlib
+import json
+import os
+
+from spotify_records import to_json
+
+# file extension of each supported compression
+COMPRESSION_EXTENSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def open_text_file(file_path, mode='r'):
+    """
+    Open a text file, transparently (de)compressing it based on its extension.
+
+    :param file_path: path of the file; ".gz" and ".zst" files are compressed.
+    :param mode: 'r' to read, 'w' to write, 'a' to append.
+    :return: file object in text mode.
+    """
+    if file_path.endswith(".gz"):
+        return gzip.open(file_path, mode + 't', encoding='utf-8')
+
+    if file_path.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstandard is required for .zst files: pip install zstandard") from None
+        return zstandard.open(file_path, mode + 't', encoding='utf-8')
+
+    return open(file_path, mode, encoding='utf-8')
+
+
+class NDJSONWriter:
+    """
+    Write records to an NDJSON file, one JSON document per line.
+
+    :param file_path: path of the output file; its extension selects the compression.
+    :param append: append to an existing file instead of replacing it.
+    """
+
+    def __init__(self, file_path, append=False):
+        self.file_path = file_path
+        self.count = 0
+        self._file = open_text_file(file_path, 'a' if append else 'w')
+
+    def write(self, record):
+        """
+        :param record: JSON-serializable record, or a TrackRecord.
+        """
+        self._file.write(json.dumps(record, ensure_ascii=False, default=to_json))
+        self._file.write("\n")
+        self.count += 1
+
+    def write_many(self, records):
+        """
+        :param records: iterable of JSON-serializable records.
+        """
+        for record in records:
+            self.write(record)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def iter_ndjson(file_path):
+    """
+    Read the records of an NDJSON file one at a time.
+
+    :param file_path: path of the input file; its extension selects the compression.
+    :return: generator of records.
+    """
+    with open_text_file(file_path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def file_fingerprint(file_path, previous=None):
+    """
+    Describe an input file by its size, modification time, and content hash.
+    The hash is reused from the previous fingerprint when size and modification time are unchanged.
+
+    :param file_path: path of the file.
+    :param previous: fingerprint of the file from the manifest, if any.
+    :return: dict with "size", "mtime", and "sha256".
+    """
+    stat = os.stat(file_path)
+    if previous and previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime:
+        return previous
+
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": sha256.hexdigest()}
@@ -4,46 +4,433 @@
 This script merges multiple CSV files from different periods into a single CSV file.
 
 Input:
-- Directory containing CSV files with names like 'spotify_dataset_by_year_XXXX-XXXX_YYYYMMDD_HHMMSS.csv'
+- Directory containing CSV (or Parquet) files with names like 'spotify_dataset_by_year_XXXX-XXXX_YYYYMMDD_HHMMSS.csv'
+- And its year partitions, 'year=YYYY/spotify_dataset_YYYY.csv'; with YEARS set, only the partitions of those years.
 
 Output:
 - A single CSV file named 'spotify_merged_dataset_XXXX-XXXX_YYYYMMDD_HHMMSS.csv'
+- Or, with OUTPUT_FORMAT = "parquet", a typed and compressed Parquet file with the same columns.
+
+Incremental mode (INCREMENTAL = True):
+- Maintains one merged dataset ('spotify_merged_dataset.csv', or a 'spotify_merged_dataset.parquet'
+  directory with one part per input file) plus a manifest of the inputs already merged (name, size, hash).
+- Each run only reads new or changed input files and appends them. For CSV output a changed or
+  removed input triggers a rebuild of the merged file; for Parquet output only its part is rewritten.
+- With YEARS set, only the partitions of those years are merged or updated; the other inputs already in the
+  dataset stay in it as they are (unless their file was deleted).
+- spotify_pipeline.py appends its runs straight to the same dataset (MergedDatasetWriter) and records them in
+  the manifest. Runs without a transformed file are kept as they are; a CSV rebuild cannot restore their
+  rows, so it stops with an error instead of dropping them.
 """
 
+import json
 import os
 from datetime import datetime
 import pandas as pd
 
+from spotify_io import file_fingerprint
+from spotify_metrics import metrics, write_run_report
+from spotify_parquet import open_parquet_writer, to_arrow_table, tracks_schema, write_parquet
+from spotify_partitions import partition_year
+
 # input directory where all CSV files are located
-input_dir = "./transformed_data"
-
-# output directory and file
-output_dir = "./merged_data"
-os.makedirs(output_dir, exist_ok=True)
-filename = ("spotify_merged_dataset_" + datetime.now().strftime("%Y%m%d_%H%M%S") + ".csv")
-output_file = os.path.join(output_dir, filename)
-
-# list all CSV files in the input directory
-csv_files = [f for f in os.listdir(input_dir) if f.endswith('.csv')]
-
-# check if there are CSV files to process
-if not csv_files:
-    print("No CSV files found in the directory.")
-    exit()
-
-# initialize an empty list to store DataFrames
-dataframes = []
-
-# load and append each CSV file into the list of DataFrames
-for csv_file in csv_files:
-    file_path = os.path.join(input_dir, csv_file)
-    print(f"Reading file: {file_path}")
-    df = pd.read_csv(file_path)
-    dataframes.append(df)
-
-# concatenate all DataFrames into one
-merged_df = pd.concat(dataframes, ignore_index=True)
-
-# save the merged DataFrame to a single CSV file
-merged_df.to_csv(output_file, index=False, encoding='utf-8')
-print(f"Merged dataset saved to: {output_file}")
+INPUT_DIR = "./transformed_data"
+
+# output directory
+OUTPUT_DIR = "./merged_data"
+
+# format of the transformed files to merge: "csv" or "parquet"
+INPUT_FORMAT = "csv"
+
+# output format: "csv" or "parquet" (typed columns, needs pyarrow)
+OUTPUT_FORMAT = "csv"
+
+# merge only the year partitions of these years (None: all transformed files and partitions)
+YEARS = None
+
+# maintain one merged dataset and only merge new or changed files into it
+INCREMENTAL = True
+
+# name of the merged dataset in incremental mode; its manifest is stored next to it
+MERGED_NAME = "spotify_merged_dataset"
+
+# rows read at a time when columns are added to a merged CSV file
+CHUNK_SIZE = 100_000
+
+
+def read_transformed_file(file_path):
+    """
+    :param file_path: path of a CSV or Parquet file written by spotify_transform.py.
+    :return: DataFrame.
+    """
+    with metrics.stage("merge.read"):
+        if file_path.endswith(".parquet"):
+            return pd.read_parquet(file_path)
+        return pd.read_csv(file_path)
+
+
+def list_input_files(input_dir=INPUT_DIR, format="csv", years=None):
+    """
+    :param input_dir: directory holding the transformed files and year partitions.
+    :param format: format of the transformed files: csv or parquet (default: csv).
+    :param years: years of the partitions to list (None: all files and partitions).
+    :return: sorted list of paths of the transformed files.
+    """
+    input_files = []
+    for name in sorted(os.listdir(input_dir)):
+        path = os.path.join(input_dir, name)
+        year = partition_year(name)
+
+        if year is not None and os.path.isdir(path):
+            if years is None or year in years:
+                input_files.extend(os.path.join(path, f) for f in sorted(os.listdir(path)) if f.endswith("." + format))
+        elif years is None and name.endswith("." + format):
+            input_files.append(path)
+    return input_files
+
+
+def merge_files(input_files, output_file, format="csv"):
+    """
+    Merge transformed files into a single file.
+
+    :param input_files: list of paths of CSV or Parquet files.
+    :param output_file: path of the merged output file.
+    :param format: format of the output file: csv or parquet (default: csv).
+    :return: number of rows written.
+    """
+    if format == "parquet":
+        # write every input as its own row group, so only one input is in memory at a time
+        rows = 0
+        with open_parquet_writer(output_file) as writer:
+            for file_path in input_files:
+                print(f"Reading file: {file_path}")
+                df = read_transformed_file(file_path)
+                with metrics.stage("merge.write"):
+                    writer.write_table(to_arrow_table(df.reindex(columns=writer.schema.names)))
+                rows += len(df)
+        return rows
+
+    if format != "csv":
+        raise ValueError(f"Unsupported format: {format}")
+
+    # initialize an empty list to store DataFrames
+    dataframes = []
+
+    # load and append each CSV file into the list of DataFrames
+    for file_path in input_files:
+        print(f"Reading file: {file_path}")
+        df = read_transformed_file(file_path)
+        dataframes.append(df)
+
+    # concatenate all DataFrames into one
+    merged_df = pd.concat(dataframes, ignore_index=True)
+
+    # save the merged DataFrame to a single CSV file
+    with metrics.stage("merge.write"):
+        merged_df.to_csv(output_file, index=False, encoding='utf-8')
+    return len(merged_df)
+
+
+def load_manifest(manifest_path):
+    """
+    :param manifest_path: path of the manifest file.
+    :return: manifest dict, or an empty manifest if the file does not exist.
+    """
+    if not os.path.exists(manifest_path):
+        return {"format": None, "files": {}}
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, manifest_path):
+    """
+    Write the manifest atomically.
+
+    :param manifest: manifest dict.
+    :param manifest_path: path of the manifest file.
+    """
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp_path, manifest_path)
+
+
+def has_input_file(entry):
+    """
+    :param entry: entry of the manifest.
+    :return: whether the entry is the fingerprint of an input file, and not a pipeline run appended without one.
+    """
+    return "sha256" in entry
+
+
+def widen_csv(merged_path, columns, chunk_size=CHUNK_SIZE):
+    """
+    Add columns to a merged CSV file; its rows get empty values in them and are otherwise copied unchanged.
+    The file is rewritten in chunks, so memory does not depend on its size.
+
+    :param merged_path: path of the merged CSV file.
+    :param columns: all columns of the widened file, in order.
+    :param chunk_size: number of rows per chunk.
+    """
+    tmp_path = merged_path + ".tmp"
+    header = True
+    # read every value as text, so the copied rows keep their exact formatting
+    for chunk_df in pd.read_csv(merged_path, dtype=str, keep_default_na=False, chunksize=chunk_size):
+        chunk_df.reindex(columns=columns).to_csv(tmp_path, index=False, encoding='utf-8',
+                                                 mode='w' if header else 'a', header=header)
+        header = False
+    if header:
+        pd.DataFrame(columns=columns).to_csv(tmp_path, index=False, encoding='utf-8')
+    os.replace(tmp_path, merged_path)
+
+
+def parquet_part_path(merged_path, input_file):
+    """
+    :param merged_path: directory of the merged Parquet dataset.
+    :param input_file: path of the input file.
+    :return: path of the part holding the rows of the input file.
+    """
+    return os.path.join(merged_path, "part-" + os.path.splitext(os.path.basename(input_file))[0] + ".parquet")
+
+
+def merge_incremental(input_files, output_dir, format="csv", selected_files=None):
+    """
+    Merge only new or changed input files into the maintained merged dataset.
+
+    :param input_files: list of paths of all current CSV or Parquet input files.
+    :param output_dir: directory holding the merged dataset and its manifest.
+    :param format: format of the merged dataset: csv or parquet (default: csv).
+    :param selected_files: paths of the input files to merge or update (default: all input files);
+        the other input files already merged are kept as they are, the others are left out.
+    :return: path of the merged dataset.
+    """
+    if format not in ("csv", "parquet"):
+        raise ValueError(f"Unsupported format: {format}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    merged_path = os.path.join(output_dir, f"{MERGED_NAME}.{format}")
+    manifest_path = merged_path + ".manifest.json"
+    manifest = load_manifest(manifest_path)
+
+    # a manifest is only valid for the dataset it describes
+    if manifest["format"] != format or not os.path.exists(merged_path):
+        manifest = {"format": format, "files": {}}
+
+    merged = manifest["files"]
+    selected = {os.path.basename(f) for f in (input_files if selected_files is None else selected_files)}
+
+    # inputs outside the selection keep their manifest entry, so they are neither re-read nor counted as removed
+    current = {os.path.basename(f): f for f in input_files
+               if os.path.basename(f) in selected or os.path.basename(f) in merged}
+    fingerprints = {name: merged[name] if name not in selected
+                    else file_fingerprint(path, merged[name] if has_input_file(merged.get(name, {})) else None)
+                    for name, path in current.items()}
+
+    # pipeline runs appended without a transformed file have nothing to compare with, so they stay as they are
+    pipeline_runs = [name for name in merged if name not in current and not has_input_file(merged[name])]
+
+    new = [name for name in current if name not in merged]
+    changed = [name for name in current
+               if name in merged and fingerprints[name].get("sha256") != merged[name].get("sha256")]
+    removed = [name for name in merged if name not in current and name not in pipeline_runs]
+    print(f"{len(new)} new, {len(changed)} changed, {len(removed)} removed, "
+          f"{len(current) - len(new) - len(changed)} unchanged input files")
+
+    if format == "parquet":
+        # every input has its own part, so changed and removed inputs only touch their own part
+        os.makedirs(merged_path, exist_ok=True)
+        for name in removed:
+            part_path = parquet_part_path(merged_path, name)
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            del merged[name]
+        for name in sorted(new + changed):
+            print(f"Reading file: {current[name]}")
+            df = read_transformed_file(current[name])
+            with metrics.stage("merge.write"):
+                write_parquet(df.reindex(columns=tracks_schema().names), parquet_part_path(merged_path, name))
+            merged[name] = fingerprints[name]
+
+    elif changed or removed:
+        # rows of a changed or removed input cannot be taken out of a CSV file, so rebuild it
+        if pipeline_runs:
+            raise ValueError(f"Cannot rebuild {merged_path}: the rows of the pipeline runs {pipeline_runs} have "
+                             f"no transformed file (run spotify_pipeline.py with KEEP_TRANSFORMED = True)")
+        print("Rebuilding the merged dataset")
+        merge_files([current[name] for name in sorted(current)], merged_path)
+        merged = dict(fingerprints)
+
+    else:
+        header = not os.path.exists(merged_path)
+        columns = None if header else pd.read_csv(merged_path, nrows=0).columns
+        for name in sorted(new):
+            print(f"Reading file: {current[name]}")
+            df = read_transformed_file(current[name])
+            if columns is not None and not set(df.columns) <= set(columns):
+                # appending would drop the columns the merged file lacks, so add them to it first
+                print(f"Adding the columns of {name} to the merged dataset")
+                columns = list(columns) + [column for column in df.columns if column not in set(columns)]
+                widen_csv(merged_path, columns)
+            if columns is not None:
+                df = df.reindex(columns=columns)
+            with metrics.stage("merge.write"):
+                df.to_csv(merged_path, index=False, encoding='utf-8', mode='w' if header else 'a', header=header)
+            columns = df.columns
+            header = False
+            merged[name] = fingerprints[name]
+
+    # refresh the fingerprints of unchanged inputs too, so their hash is not recomputed next time
+    files = {name: fingerprints[name] for name in current if name in merged}
+    files.update((name, merged[name]) for name in pipeline_runs)
+    manifest["files"] = dict(sorted(files.items()))
+    save_manifest(manifest, manifest_path)
+    return merged_path
+
+
+class MergedDatasetWriter:
+    """
+    Append chunks of flattened tracks straight to the maintained merged dataset, without reading them back from
+    a transformed file (used by spotify_pipeline.py). The run is recorded in the manifest on commit(), so the
+    incremental merge treats its rows like those of any other input; a run that is not committed is rolled back.
+
+    CSV chunks are appended in the column order of the merged file (columns it lacks are added to it first);
+    Parquet chunks are written to the run's own part, which is hidden from readers until the commit.
+
+    :param name: name of the run in the manifest, e.g. the name of its transformed file.
+    :param output_dir: directory holding the merged dataset and its manifest (default: OUTPUT_DIR).
+    :param format: format of the merged dataset: csv or parquet (default: csv).
+    """
+
+    def __init__(self, name, output_dir=None, format="csv"):
+        if format not in ("csv", "parquet"):
+            raise ValueError(f"Unsupported format: {format}")
+
+        output_dir = output_dir or OUTPUT_DIR
+        os.makedirs(output_dir, exist_ok=True)
+        self.name = name
+        self.format = format
+        self.merged_path = os.path.join(output_dir, f"{MERGED_NAME}.{format}")
+        self.manifest_path = self.merged_path + ".manifest.json"
+        self.rows = 0
+        self._new_dataset = not os.path.exists(self.merged_path)
+        self._committed = False
+        self._parquet_writer = None
+
+        if format == "parquet":
+            os.makedirs(self.merged_path, exist_ok=True)
+            self.part_path = parquet_part_path(self.merged_path, name)
+            # Parquet readers skip files starting with "_", so the part stays invisible until it is complete
+            self._tmp_part_path = os.path.join(self.merged_path, "_" + os.path.basename(self.part_path))
+            self._parquet_writer = open_parquet_writer(self._tmp_part_path)
+        else:
+            self._columns = None if self._new_dataset else list(pd.read_csv(self.merged_path, nrows=0).columns)
+            # the rows of this run start at this offset, so a rollback truncates the file back to it
+            self._start = None if self._new_dataset else os.path.getsize(self.merged_path)
+
+    def write_frame(self, chunk_df):
+        """
+        :param chunk_df: DataFrame of flattened tracks.
+        """
+        with metrics.stage("merge.write"):
+            if self._parquet_writer:
+                self._parquet_writer.write_table(to_arrow_table(chunk_df.reindex(columns=tracks_schema().names)))
+            elif self._columns is None:
+                chunk_df.to_csv(self.merged_path, index=False, encoding='utf-8')
+                self._columns = list(chunk_df.columns)
+            else:
+                if not set(chunk_df.columns) <= set(self._columns):
+                    if self.rows:
+                        raise ValueError(f"A chunk of {self.name} has columns its earlier chunks did not have")
+                    # appending would drop the columns the merged file lacks, so add them to it first
+                    print(f"Adding the columns of {self.name} to the merged dataset")
+                    self._columns += [column for column in chunk_df.columns if column not in set(self._columns)]
+                    widen_csv(self.merged_path, self._columns)
+                    self._start = os.path.getsize(self.merged_path)
+                chunk_df.reindex(columns=self._columns).to_csv(self.merged_path, index=False, encoding='utf-8',
+                                                               mode='a', header=False)
+        self.rows += len(chunk_df)
+
+    def commit(self, entry=None):
+        """
+        Make the rows of the run part of the dataset and record the run in the manifest.
+
+        :param entry: manifest entry of the run, e.g. the fingerprint of its transformed file
+            (default: the number of rows, for a run without a transformed file).
+        """
+        if self._parquet_writer:
+            self._parquet_writer.close()
+            os.replace(self._tmp_part_path, self.part_path)
+
+        manifest = load_manifest(self.manifest_path)
+        # a manifest is only valid for the dataset it describes
+        if manifest["format"] != self.format or self._new_dataset:
+            manifest = {"format": self.format, "files": {}}
+        manifest["files"][self.name] = entry or {"rows": self.rows}
+        save_manifest(manifest, self.manifest_path)
+        self._committed = True
+        print(f"{self.rows} rows of {self.name} merged into {self.merged_path}")
+
+    def abort(self):
+        """Take the rows written so far out of the dataset again; the manifest is left unchanged."""
+        if self._parquet_writer:
+            self._parquet_writer.close()
+            if os.path.exists(self._tmp_part_path):
+                os.remove(self._tmp_part_path)
+        elif self._start is None:
+            if os.path.exists(self.merged_path):
+                os.remove(self.merged_path)
+        else:
+            with open(self.merged_path, 'r+b') as f:
+                f.truncate(self._start)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self._committed:
+            self.abort()
+
+
+def run(input_dir=None, output_dir=None, years=None):
+    """
+    Merge the transformed files. Arguments left out default to the module settings.
+
+    :param input_dir: directory holding the transformed files and partitions (default: INPUT_DIR).
+    :param output_dir: directory of the merged dataset (default: OUTPUT_DIR).
+    :param years: merge only the partitions of these years (default: YEARS).
+    :return: path of the merged dataset, or None if there was nothing to merge.
+    """
+    input_dir = input_dir or INPUT_DIR
+    output_dir = output_dir or OUTPUT_DIR
+    years = YEARS if years is None else years
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    # list the transformed files (and partitions) in the input directory
+    input_files = list_input_files(input_dir, INPUT_FORMAT, years)
+
+    # check if there are files to process
+    if not input_files:
+        print(f"No {INPUT_FORMAT.upper()} files found in the directory.")
+        return None
+
+    if INCREMENTAL:
+        # the maintained dataset also holds the inputs outside the selected years, so pass all of them
+        all_input_files = input_files if years is None else list_input_files(input_dir, INPUT_FORMAT)
+        output_file = merge_incremental(all_input_files, output_dir, format=OUTPUT_FORMAT, selected_files=input_files)
+    else:
+        filename = ("spotify_merged_dataset_" + datetime.now().strftime("%Y%m%d_%H%M%S") + "." + OUTPUT_FORMAT)
+        output_file = os.path.join(output_dir, filename)
+        merge_files(input_files, output_file, format=OUTPUT_FORMAT)
+
+    print(f"Merged dataset saved to: {output_file}")
+    return output_file
+
+
+def main():
+    run()
+    print(f"Run report saved to {write_run_report('merge')}")
+
+
+if __name__ == "__main__":
+    main()
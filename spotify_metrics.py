@@ -0,0 +1,269 @@
+# spotify_metrics.py
+
+"""
+This file provides the instrumentation shared by the pipeline stages.
+
+Features:
+- Counts Spotify API requests per endpoint and status, with latency histograms and response bytes.
+- Accumulates time spent sleeping (rate limiting and backoff) and in each pipeline stage.
+- Records counters such as retries, throttles, and cache hits and misses.
+- Writes a machine-readable JSON run report and, optionally, a Prometheus textfile
+  (for the node_exporter textfile collector).
+
+Output:
+- ./reports/{run}_YYYYMMDD_HHMMSS.json
+- {PROMETHEUS_TEXTFILE_DIR}/spotify_{run}.prom, if PROMETHEUS_TEXTFILE_DIR is set.
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import urlparse
+
+# directory of the JSON run reports
+REPORT_DIR = "./reports"
+
+# directory of the Prometheus textfile collector (None: no textfile is written)
+PROMETHEUS_TEXTFILE_DIR = None
+
+# upper bounds of the request latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def endpoint_name(url):
+    """
+    Name the Spotify API endpoint of a request URL, e.g. "search" or "playlist_tracks".
+
+    :param url: absolute request URL.
+    :return: endpoint name.
+    """
+    path = urlparse(url).path
+    if path.endswith("/api/token"):
+        return "token"
+
+    parts = [part for part in path.split("/") if part][1:]
+    if parts[:1] == ["playlists"] and len(parts) >= 3:
+        return "playlist_tracks"
+    return parts[0].replace("-", "_") if parts else "unknown"
+
+
+class Metrics:
+    """
+    Thread-safe collection of the measurements of one pipeline run.
+
+    :param buckets: upper bounds of the latency histogram buckets, in seconds.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.started_at = time.time()
+        self.requests = {}
+        self.counters = {}
+        self.sleep_seconds = {}
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def observe_request(self, endpoint, seconds, status, size=0):
+        """
+        Record one API request.
+
+        :param endpoint: endpoint name, see endpoint_name().
+        :param seconds: latency of the request.
+        :param status: HTTP status code of the response.
+        :param size: size of the response body in bytes.
+        """
+        with self._lock:
+            entry = self.requests.get(endpoint)
+            if entry is None:
+                entry = self.requests[endpoint] = {
+                    "count": 0, "by_status": {}, "bytes": 0, "seconds": 0.0, "max_seconds": 0.0,
+                    "buckets": [0] * (len(self.buckets) + 1),
+                }
+            entry["count"] += 1
+            entry["by_status"][str(status)] = entry["by_status"].get(str(status), 0) + 1
+            entry["bytes"] += size
+            entry["seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+            entry["buckets"][bisect.bisect_left(self.buckets, seconds)] += 1
+
+    def count(self, name, value=1, **labels):
+        """
+        Add to a counter, e.g. count("cache_hits", 10, cache="audio_features").
+
+        :param name: counter name.
+        :param value: amount to add.
+        :param labels: labels distinguishing series of the counter.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def add_sleep(self, reason, seconds):
+        """
+        Record time spent sleeping.
+
+        :param reason: why the caller slept, e.g. "rate_limit" or "backoff".
+        :param seconds: time slept.
+        """
+        with self._lock:
+            self.sleep_seconds[reason] = self.sleep_seconds.get(reason, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a pipeline stage. Time spent by concurrent calls of the same stage is summed.
+
+        :param name: stage name, e.g. "extract.search" or "transform.flatten".
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def add_stage(self, name, seconds, count=1):
+        """
+        Add time spent in a stage, e.g. measured in another process.
+
+        :param name: stage name.
+        :param seconds: time spent in the stage.
+        :param count: number of times the stage ran.
+        """
+        with self._lock:
+            entry = self.stages.setdefault(name, {"count": 0, "seconds": 0.0})
+            entry["count"] += count
+            entry["seconds"] += seconds
+
+    def record_cache(self, cache, stats):
+        """
+        :param cache: cache name.
+        :param stats: dict with "hits" and "misses", as returned by SQLiteCache.stats().
+        """
+        self.count("cache_hits", stats["hits"], cache=cache)
+        self.count("cache_misses", stats["misses"], cache=cache)
+
+    def report(self, run):
+        """
+        :param run: name of the run, e.g. "extract".
+        :return: JSON-serializable dict with all measurements.
+        """
+        with self._lock:
+            requests = {}
+            for endpoint, entry in sorted(self.requests.items()):
+                cumulative = 0
+                histogram = {}
+                for bound, count in zip([str(bound) for bound in self.buckets] + ["+Inf"], entry["buckets"]):
+                    cumulative += count
+                    histogram[bound] = cumulative
+                requests[endpoint] = {
+                    "count": entry["count"],
+                    "by_status": dict(entry["by_status"]),
+                    "bytes": entry["bytes"],
+                    "latency_seconds": {
+                        "sum": round(entry["seconds"], 6),
+                        "mean": round(entry["seconds"] / entry["count"], 6),
+                        "max": round(entry["max_seconds"], 6),
+                        "histogram": histogram,
+                    },
+                }
+
+            counters = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                counters.setdefault(name, []).append({"labels": dict(labels), "value": value})
+
+            return {
+                "run": run,
+                "started_at": datetime.fromtimestamp(self.started_at).isoformat(timespec="seconds"),
+                "duration_seconds": round(time.time() - self.started_at, 3),
+                "requests": requests,
+                "counters": counters,
+                "sleep_seconds": {reason: round(seconds, 6) for reason, seconds in sorted(self.sleep_seconds.items())},
+                "stages": {name: {"count": entry["count"], "seconds": round(entry["seconds"], 6)}
+                           for name, entry in sorted(self.stages.items())},
+            }
+
+    def prometheus_text(self, run):
+        """
+        :param run: name of the run, added as the "run" label of every series.
+        :return: measurements in the Prometheus text exposition format.
+        """
+        report = self.report(run)
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                labels = dict({"run": run}, **labels)
+                label_text = ",".join(f'{key}="{value}"' for key, value in labels.items())
+                lines.append(f"{name}{suffix}{{{label_text}}} {value}")
+
+        metric("spotify_api_requests_total", "counter", "Spotify API requests by endpoint and status.", [
+            ("", {"endpoint": endpoint, "status": status}, count)
+            for endpoint, entry in report["requests"].items() for status, count in entry["by_status"].items()
+        ])
+        metric("spotify_api_response_bytes_total", "counter", "Bytes received from the Spotify API.", [
+            ("", {"endpoint": endpoint}, entry["bytes"]) for endpoint, entry in report["requests"].items()
+        ])
+
+        samples = []
+        for endpoint, entry in report["requests"].items():
+            latency = entry["latency_seconds"]
+            samples.extend(("_bucket", {"endpoint": endpoint, "le": bound}, count)
+                           for bound, count in latency["histogram"].items())
+            samples.append(("_sum", {"endpoint": endpoint}, latency["sum"]))
+            samples.append(("_count", {"endpoint": endpoint}, entry["count"]))
+        metric("spotify_api_request_duration_seconds", "histogram", "Latency of Spotify API requests.", samples)
+
+        for name, series in report["counters"].items():
+            metric(f"spotify_{name}_total", "counter", f"Number of {name.replace('_', ' ')}.", [
+                ("", item["labels"], item["value"]) for item in series
+            ])
+
+        metric("spotify_sleep_seconds_total", "counter", "Time spent sleeping, by reason.", [
+            ("", {"reason": reason}, seconds) for reason, seconds in report["sleep_seconds"].items()
+        ])
+        metric("spotify_stage_seconds_total", "counter", "Time spent in each pipeline stage.", [
+            ("", {"stage": name}, entry["seconds"]) for name, entry in report["stages"].items()
+        ])
+        metric("spotify_run_duration_seconds", "gauge", "Wall time of the run.", [
+            ("", {}, report["duration_seconds"])
+        ])
+        return "\n".join(lines) + "\n"
+
+
+# measurements of the current process, shared by all modules of the pipeline
+metrics = Metrics()
+
+
+def _write_atomic(path, text):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def write_run_report(run, report_dir=None, prometheus_dir=None):
+    """
+    Write the run report of the shared metrics, and the Prometheus textfile if configured.
+
+    :param run: name of the run, e.g. "extract", "transform", or "merge".
+    :param report_dir: directory of the JSON run reports (default: REPORT_DIR).
+    :param prometheus_dir: directory of the Prometheus textfile collector (default: PROMETHEUS_TEXTFILE_DIR).
+    :return: path of the JSON report.
+    """
+    report_dir = report_dir or REPORT_DIR
+    prometheus_dir = prometheus_dir or PROMETHEUS_TEXTFILE_DIR
+    os.makedirs(report_dir, exist_ok=True)
+    report_path = os.path.join(report_dir, f"{run}_" + datetime.now().strftime("%Y%m%d_%H%M%S") + ".json")
+    _write_atomic(report_path, json.dumps(metrics.report(run), indent=4))
+
+    if prometheus_dir:
+        os.makedirs(prometheus_dir, exist_ok=True)
+        _write_atomic(os.path.join(prometheus_dir, f"spotify_{run}.prom"), metrics.prometheus_text(run))
+
+    return report_path
@@ -0,0 +1,111 @@
+# spotify_parquet.py
+
+"""
+This file provides the typed columnar (Parquet) output of the transform and merge stages.
+
+Features:
+- Explicit Arrow schema for the flattened track table.
+- Compact types: int8 key/mode/time_signature/popularity, float32 audio features,
+  and dictionary-encoded album and artist strings.
+- Compressed Parquet files, so downstream PySpark/pandas jobs can read only the columns they need.
+
+Note:
+- Needs the optional `pyarrow` package (pip install pyarrow).
+"""
+
+import pandas as pd
+
+# compression codec of the Parquet files
+PARQUET_COMPRESSION = "zstd"
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("pyarrow is required for Parquet output: pip install pyarrow") from None
+    return pyarrow
+
+
+def tracks_schema():
+    """
+    :return: Arrow schema of the flattened track table, in the same column order as the CSV output.
+    """
+    pa = _import_pyarrow()
+    dictionary_string = pa.dictionary(pa.int32(), pa.string())
+
+    return pa.schema([
+        ("track_id", pa.string()),
+        ("track_name", pa.string()),
+        ("artist_names", dictionary_string),
+        ("popularity", pa.int8()),
+        ("duration_ms", pa.int32()),
+        ("explicit", pa.bool_()),
+        ("album_name", dictionary_string),
+        ("year", pa.int16()),
+        ("album_type", dictionary_string),
+        ("danceability", pa.float32()),
+        ("energy", pa.float32()),
+        ("key", pa.int8()),
+        ("loudness", pa.float32()),
+        ("mode", pa.int8()),
+        ("speechiness", pa.float32()),
+        ("acousticness", pa.float32()),
+        ("instrumentalness", pa.float32()),
+        ("liveness", pa.float32()),
+        ("valence", pa.float32()),
+        ("tempo", pa.float32()),
+        ("time_signature", pa.int8()),
+    ])
+
+
+def to_arrow_table(df):
+    """
+    Convert a flattened track DataFrame (from the transform or read back from CSV) to the track schema.
+
+    :param df: DataFrame with the columns of the track table.
+    :return: pyarrow Table.
+    """
+    pa = _import_pyarrow()
+    schema = tracks_schema()
+    arrays = []
+
+    for field in schema:
+        series = df[field.name]
+
+        if pa.types.is_dictionary(field.type):
+            array = pa.array(series.astype("string"), type=pa.string()).dictionary_encode()
+        elif pa.types.is_string(field.type):
+            array = pa.array(series.astype("string"), type=pa.string())
+        elif pa.types.is_boolean(field.type):
+            array = pa.array(series.astype("boolean"), type=field.type)
+        else:
+            # numbers may arrive as strings (the release year) or as floats with NaN for missing values
+            array = pa.array(pd.to_numeric(series, errors="coerce"), type=field.type, from_pandas=True)
+
+        arrays.append(array)
+
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def open_parquet_writer(file_path):
+    """
+    Open a Parquet file for writing the track table one chunk (row group) at a time.
+
+    :param file_path: path of the Parquet file.
+    :return: pyarrow.parquet.ParquetWriter; write chunks with writer.write_table(to_arrow_table(df)).
+    """
+    pa = _import_pyarrow()
+    return pa.parquet.ParquetWriter(file_path, tracks_schema(), compression=PARQUET_COMPRESSION)
+
+
+def write_parquet(df, file_path):
+    """
+    Write a flattened track DataFrame to a Parquet file.
+
+    :param df: DataFrame with the columns of the track table.
+    :param file_path: path of the Parquet file.
+    """
+    with open_parquet_writer(file_path) as writer:
+        writer.write_table(to_arrow_table(df))
@@ -0,0 +1,249 @@
+# spotify_partitions.py
+
+"""
+This file provides the year-partitioned layout of the raw data.
+
+Features:
+- Writes the tracks of every year to their own compressed NDJSON partition, so a single year can be
+  reprocessed without loading the whole extract.
+- Replaces the partitions of the years a run covers, so overlapping runs do not duplicate data on disk.
+- Keeps a small index of the partitions (current part file, record count, run, write time).
+- Commits a run's partitions atomically through the index: an interrupted run leaves the previous
+  partitions in place. A commit removes the files it superseded, and files of crashed runs once they
+  are older than ORPHAN_STALE_SECONDS; the files of other writers of the same year are never touched.
+- Serializes index updates with a lock file, so several worker processes on one host can commit partitions
+  of the same root.
+
+Layout:
+- {root}/_partitions.json
+- {root}/year=YYYY/part-YYYYMMDD_HHMMSS_XXXXXXXX.ndjson.zst (the suffix makes the names of concurrent runs unique)
+- {root}/year=YYYY/_memberships_part-YYYYMMDD_HHMMSS_XXXXXXXX.ndjson.zst (playlists and years of the partition's
+  tracks)
+
+Note:
+- A track is stored in the partition of the first year of the run it was found in, so a track can appear
+  in more than one partition only when the years were extracted by different runs.
+"""
+
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+from spotify_io import COMPRESSION_EXTENSIONS, NDJSONWriter
+
+# name of the partition index in the root directory
+INDEX_FILENAME = "_partitions.json"
+
+# directory name prefix of a partition
+PARTITION_PREFIX = "year="
+
+# lock file guarding updates of the index; a lock older than LOCK_STALE_SECONDS is left over from a crash
+LOCK_FILENAME = "_partitions.lock"
+LOCK_STALE_SECONDS = 60
+
+# unreferenced files of a partition older than this are left over from a crashed run and removed on commit;
+# a run commits all its years at the end, so this must be longer than the longest run
+ORPHAN_STALE_SECONDS = 7 * 24 * 3600
+
+
+def partition_name(year):
+    """
+    :param year: year of the partition.
+    :return: directory name of the partition, e.g. "year=1915".
+    """
+    return f"{PARTITION_PREFIX}{year}"
+
+
+def partition_year(name):
+    """
+    :param name: directory name.
+    :return: year of the partition, or None if the name is not a partition.
+    """
+    if not name.startswith(PARTITION_PREFIX) or not name[len(PARTITION_PREFIX):].isdigit():
+        return None
+    return int(name[len(PARTITION_PREFIX):])
+
+
+def load_partition_index(root):
+    """
+    :param root: root directory of the partitioned data.
+    :return: dict of years (as strings) to their index entry, empty if there is no index yet.
+    """
+    index_path = os.path.join(root, INDEX_FILENAME)
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_partition_index(index, root):
+    """
+    Write the index atomically.
+
+    :param index: dict of years (as strings) to their index entry.
+    :param root: root directory of the partitioned data.
+    """
+    index_path = os.path.join(root, INDEX_FILENAME)
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(dict(sorted(index.items())), f, indent=4)
+    os.replace(tmp_path, index_path)
+
+
+@contextmanager
+def index_lock(root, timeout=LOCK_STALE_SECONDS * 2):
+    """
+    Hold the lock of the index while updating it. Works across processes on any platform,
+    as creating the lock file with O_EXCL is atomic on a local file system (but not reliably on NFS or SMB).
+
+    :param root: root directory of the partitioned data.
+    :param timeout: seconds to wait for the lock before giving up.
+    """
+    lock_path = os.path.join(root, LOCK_FILENAME)
+    deadline = time.time() + timeout
+    while True:
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > LOCK_STALE_SECONDS:
+                    os.remove(lock_path)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.time() > deadline:
+                raise TimeoutError(f"Could not lock the partition index in {root}")
+            time.sleep(0.05)
+
+    try:
+        yield
+    finally:
+        os.remove(lock_path)
+
+
+def select_partitions(root, years=None):
+    """
+    :param root: root directory of the partitioned data.
+    :param years: iterable of the years to select (None: all partitions).
+    :return: list of (year, index entry) tuples in year order, for the selected years that have a partition.
+    """
+    index = load_partition_index(root)
+    wanted = None if years is None else {str(year) for year in years}
+    return [(int(year), entry) for year, entry in sorted(index.items(), key=lambda item: int(item[0]))
+            if wanted is None or year in wanted]
+
+
+class PartitionWriter:
+    """
+    Write the tracks of a run into year partitions. Partitions become visible in the index on commit().
+
+    :param root: root directory of the partitioned data.
+    :param compression: compression of the part files: None, "gzip" or "zstd".
+    :param run: description of the run recorded in the index, e.g. "1910-1919".
+    """
+
+    def __init__(self, root, compression="zstd", run=None):
+        self.root = root
+        self.compression = compression
+        self.run = run
+        # unique per writer, so two runs of the same year never write to the same file
+        self.stamp = datetime.now().strftime("%Y%m%d_%H%M%S") + "_" + uuid.uuid4().hex[:8]
+        self._written = {}
+        self._committed = False
+
+    def _path(self, year, filename):
+        return os.path.join(self.root, partition_name(year), filename)
+
+    def write_partition(self, year, tracks):
+        """
+        Write the part file of a year.
+
+        :param year: year of the partition.
+        :param tracks: iterable of tracks, e.g. a generator, which is written as it is consumed.
+        :return: number of tracks written.
+        """
+        part = f"part-{self.stamp}.ndjson{COMPRESSION_EXTENSIONS[self.compression]}"
+        os.makedirs(os.path.join(self.root, partition_name(year)), exist_ok=True)
+        self._written[year] = entry = {"part": part, "records": 0}
+        with NDJSONWriter(self._path(year, part)) as writer:
+            writer.write_many(tracks)
+        entry["records"] = writer.count
+        return writer.count
+
+    def commit(self, memberships=None):
+        """
+        Add the written partitions to the index, replacing the previous partitions of their years.
+
+        :param memberships: optional iterable of dicts with the "track_id", "playlist_ids", and "years"
+            of the run's tracks (see TrackRegistry.iter_memberships). Each is stored with the partition of
+            its first year, next to the part file.
+        """
+        if memberships is not None:
+            by_year = {}
+            for membership in memberships:
+                if membership["years"] and membership["years"][0] in self._written:
+                    by_year.setdefault(membership["years"][0], []).append(membership)
+
+            for year, entry in self._written.items():
+                entry["memberships"] = "_memberships_" + entry["part"]
+                with NDJSONWriter(self._path(year, entry["memberships"])) as writer:
+                    writer.write_many(by_year.get(year, []))
+
+        os.makedirs(self.root, exist_ok=True)
+        written_at = datetime.now().isoformat(timespec="seconds")
+        with index_lock(self.root):
+            index = load_partition_index(self.root)
+            previous = {}
+            for year, entry in self._written.items():
+                previous[year] = index.get(str(year))
+                index[str(year)] = dict(entry, path=partition_name(year), run=self.run, written_at=written_at)
+            save_partition_index(index, self.root)
+            self._committed = True
+
+            # the index no longer references the files these entries replaced
+            for year in self._written:
+                self._remove_superseded(year, previous[year], index[str(year)])
+
+    def _remove_superseded(self, year, previous, current):
+        """
+        Remove the files of the index entry a commit replaced, and the orphaned files of crashed runs.
+        Called with the index lock held, so no other commit of the year runs at the same time; the files
+        of writers that have not committed yet are younger than ORPHAN_STALE_SECONDS, so they are left alone.
+
+        :param year: year of the partition.
+        :param previous: index entry that was replaced, or None.
+        :param current: index entry that replaced it.
+        """
+        kept = {current["part"], current.get("memberships")}
+        superseded = {previous["part"], previous.get("memberships")} - kept if previous else set()
+        for filename in os.listdir(os.path.join(self.root, partition_name(year))):
+            path = self._path(year, filename)
+            if filename in kept:
+                continue
+            try:
+                if filename in superseded or time.time() - os.path.getmtime(path) > ORPHAN_STALE_SECONDS:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def abort(self):
+        """
+        Remove the files this writer created; the index, the previous partitions,
+        and the files of other writers are left unchanged.
+        """
+        for year, entry in self._written.items():
+            for filename in (entry["part"], entry.get("memberships")):
+                if filename and os.path.exists(self._path(year, filename)):
+                    os.remove(self._path(year, filename))
+        self._written = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self._committed:
+            self.abort()
@@ -0,0 +1,273 @@
+# spotify_pipeline.py
+
+"""
+This script runs extraction, transformation, and merging as one streaming pipeline, without going
+through the intermediate files of the separate scripts.
+
+Features:
+- Tracks flow from the extractor (spotify_extract.py) through flattening (spotify_transform.py) into the
+  merged dataset maintained by spotify_merge.py in chunks, over bounded queues between the stages.
+- Every stage runs in its own thread, so flattening and merging overlap with the API requests of the
+  extractor, and memory depends on CHUNK_SIZE and QUEUE_SIZE instead of the size of the run.
+- Chunks are appended straight to the merged dataset (in the column order of the merged CSV file, or to the
+  run's own part of the Parquet dataset), and the run is recorded in the dataset's manifest when it completes.
+- Tracks are deduplicated across the whole run, as in the extractor.
+- With KEEP_RAW = True, the raw NDJSON extract and its memberships file are written too, and with
+  KEEP_TRANSFORMED = True the transformed file, so the run can still be transformed or merged again later
+  with the separate scripts.
+- If a stage fails, the other stages stop and the error is raised; the rows of the run are taken out of the
+  merged dataset again and no partial files are left behind.
+
+Output:
+- ./merged_data/spotify_merged_dataset.csv (or .parquet), the incremental dataset of spotify_merge.py,
+  and its manifest.
+- With KEEP_TRANSFORMED = True, ./transformed_data/spotify_dataset_by_year_XXXX-XXXX_YYYYMMDD_HHMMSS.csv
+  (or .parquet), as written by spotify_transform.py.
+- With KEEP_RAW = True, ./raw_data/spotify_dataset_by_year_XXXX-XXXX_YYYYMMDD_HHMMSS.ndjson
+  and its _memberships_ file, as written by spotify_extract.py with OUTPUT_FORMAT = "ndjson".
+"""
+
+import contextlib
+import logging
+import os
+import queue
+import threading
+import time
+
+import spotify_extract
+import spotify_merge
+import spotify_transform
+from spotify_io import NDJSONWriter, file_fingerprint
+from spotify_merge import MergedDatasetWriter
+from spotify_metrics import metrics, write_run_report
+from spotify_registry import TrackRegistry
+from spotify_transform import TransformedFileWriter, flatten_tracks, with_csv_types
+
+# output directory of the merged dataset
+OUTPUT_DIR = spotify_merge.OUTPUT_DIR
+
+# output format of the merged dataset (and the transformed file): "csv" or "parquet" (typed columns, needs pyarrow)
+OUTPUT_FORMAT = "csv"
+
+# also write the transformed file of the run to TRANSFORMED_DIR; it is recorded in the manifest
+# in place of the run, so later merges can rebuild the CSV dataset from it
+KEEP_TRANSFORMED = False
+TRANSFORMED_DIR = spotify_transform.OUTPUT_DIR
+
+# number of tracks passed between the stages at a time
+CHUNK_SIZE = 1_000
+
+# maximum number of chunks waiting between two stages; a full queue pauses the stage before it
+QUEUE_SIZE = 4
+
+# also write the raw NDJSON extract to spotify_extract.OUTPUT_DIR
+KEEP_RAW = False
+
+# seconds a stage waits on a queue before checking whether another stage failed
+POLL_SECONDS = 0.1
+
+# marks the end of the chunks of a queue
+_END = object()
+
+
+class PipelineAborted(Exception):
+    """Raised in a stage when another stage of the pipeline failed."""
+
+
+def _put(chunks, item, failed):
+    """
+    Put an item on a bounded queue, giving up when another stage failed.
+
+    :param chunks: queue.Queue.
+    :param item: item to put.
+    :param failed: threading.Event set when a stage failed.
+    """
+    while not failed.is_set():
+        try:
+            chunks.put(item, timeout=POLL_SECONDS)
+            return
+        except queue.Full:
+            continue
+    raise PipelineAborted()
+
+
+def _iter_chunks(chunks, failed):
+    """
+    :param chunks: queue.Queue filled by the stage before.
+    :param failed: threading.Event set when a stage failed.
+    :return: generator of the items of the queue, until its end marker.
+    """
+    while True:
+        try:
+            item = chunks.get(timeout=POLL_SECONDS)
+        except queue.Empty:
+            if failed.is_set():
+                raise PipelineAborted()
+            continue
+        if item is _END:
+            return
+        yield item
+
+
+def extract_stage(year_range, registry, outbox, failed, chunk_size=CHUNK_SIZE, raw_writer=None):
+    """
+    Extract the tracks of a range of years and pass them on in chunks.
+
+    :param year_range: range of years to extract.
+    :param registry: TrackRegistry of the run.
+    :param outbox: queue of the chunks of TrackRecords.
+    :param failed: threading.Event set when a stage failed.
+    :param chunk_size: number of tracks per chunk.
+    :param raw_writer: optional NDJSONWriter of the raw extract.
+    """
+    chunk = []
+    for track in spotify_extract.iter_tracks_from_playlists_by_year(year_range, registry=registry):
+        if raw_writer:
+            raw_writer.write(track)
+        chunk.append(track)
+        if len(chunk) >= chunk_size:
+            _put(outbox, chunk, failed)
+            chunk = []
+
+    if chunk:
+        _put(outbox, chunk, failed)
+    _put(outbox, _END, failed)
+
+
+def transform_stage(inbox, outbox, failed):
+    """
+    Flatten chunks of tracks into DataFrames.
+
+    :param inbox: queue of the chunks of TrackRecords.
+    :param outbox: queue of the flattened chunks.
+    :param failed: threading.Event set when a stage failed.
+    """
+    for chunk in _iter_chunks(inbox, failed):
+        with metrics.stage("transform.flatten"):
+            chunk_df = flatten_tracks([track.to_dict() for track in chunk])
+        _put(outbox, chunk_df, failed)
+    _put(outbox, _END, failed)
+
+
+def _run_stage(target, failed, errors, *args):
+    """Run a stage in a thread; an error stops the other stages and is kept for the main thread."""
+    try:
+        target(*args)
+    except PipelineAborted:
+        pass
+    except BaseException as e:
+        errors.append(e)
+        failed.set()
+
+
+def run(year_start=None, year_end=None, output_dir=None, format=None, keep_raw=None, keep_transformed=None,
+        transformed_dir=None):
+    """
+    Extract, transform, and merge a range of years in one pass. Arguments left out default to the module settings.
+
+    :param year_start: first year to extract (default: spotify_extract.YEAR_START).
+    :param year_end: last year to extract (default: spotify_extract.YEAR_END).
+    :param output_dir: directory of the merged dataset (default: OUTPUT_DIR).
+    :param format: format of the merged dataset and the transformed file: csv or parquet (default: OUTPUT_FORMAT).
+    :param keep_raw: also write the raw NDJSON extract (default: KEEP_RAW).
+    :param keep_transformed: also write the transformed file (default: KEEP_TRANSFORMED).
+    :param transformed_dir: directory of the transformed file (default: TRANSFORMED_DIR).
+    :return: path of the merged dataset.
+    """
+    year_start = spotify_extract.YEAR_START if year_start is None else year_start
+    year_end = spotify_extract.YEAR_END if year_end is None else year_end
+    output_dir = output_dir or OUTPUT_DIR
+    format = format or OUTPUT_FORMAT
+    keep_raw = KEEP_RAW if keep_raw is None else keep_raw
+    keep_transformed = KEEP_TRANSFORMED if keep_transformed is None else keep_transformed
+    transformed_dir = transformed_dir or TRANSFORMED_DIR
+
+    year_range = range(year_start, year_end + 1)
+
+    # the run is named after its transformed file, as spotify_transform.py would name it from the raw file
+    raw_filename = spotify_extract.build_output_filename(year_start, year_end, "ndjson",
+                                                         spotify_extract.OUTPUT_COMPRESSION)
+    run_name = spotify_transform.output_filename(raw_filename, format)
+    transformed_file = os.path.join(transformed_dir, run_name) if keep_transformed else None
+
+    raw_writer = None
+    if keep_raw:
+        os.makedirs(spotify_extract.OUTPUT_DIR, exist_ok=True)
+        raw_writer = NDJSONWriter(os.path.join(spotify_extract.OUTPUT_DIR, raw_filename))
+    if keep_transformed:
+        os.makedirs(transformed_dir, exist_ok=True)
+
+    registry = TrackRegistry(keep_records=False)
+    tracks, frames = queue.Queue(QUEUE_SIZE), queue.Queue(QUEUE_SIZE)
+    failed = threading.Event()
+    errors = []
+    stages = [
+        threading.Thread(target=_run_stage, name="extract",
+                         args=(extract_stage, failed, errors, year_range, registry, tracks, failed, CHUNK_SIZE,
+                               raw_writer)),
+        threading.Thread(target=_run_stage, name="transform",
+                         args=(transform_stage, failed, errors, tracks, frames, failed)),
+    ]
+    for stage in stages:
+        stage.start()
+
+    # the chunks are merged by this thread, while the other stages keep going; the dataset writer
+    # takes the rows of the run out of the dataset again unless it is committed
+    try:
+        with MergedDatasetWriter(run_name, output_dir, format) as dataset, contextlib.ExitStack() as files:
+            transformed_writer = None
+            if keep_transformed:
+                transformed_writer = files.enter_context(TransformedFileWriter(transformed_file, format))
+
+            for chunk_df in _iter_chunks(frames, failed):
+                if format == "csv":
+                    with_csv_types(chunk_df)
+                dataset.write_frame(chunk_df)
+                if transformed_writer:
+                    transformed_writer.write_frame(chunk_df)
+
+            # all stages are done once the chunks end, so the run is complete
+            files.close()
+            dataset.commit(file_fingerprint(transformed_file) if keep_transformed else None)
+    except PipelineAborted:
+        pass
+    except BaseException as e:
+        errors.append(e)
+        failed.set()
+    finally:
+        for stage in stages:
+            stage.join()
+        if raw_writer:
+            raw_writer.close()
+
+    if errors:
+        for path in (transformed_file, raw_writer and raw_writer.file_path):
+            if path and os.path.exists(path):
+                os.remove(path)
+        raise errors[0]
+
+    if raw_writer:
+        spotify_extract.save_data_to_file(registry.iter_memberships(), spotify_extract.OUTPUT_DIR,
+                                          "_memberships_" + raw_filename, format="ndjson")
+        logging.info(f"Raw extract saved to {raw_writer.file_path}")
+    if transformed_file:
+        logging.info(f"Transformed file saved to {transformed_file}")
+
+    logging.info(f"{dataset.rows} tracks merged into {dataset.merged_path}")
+    return dataset.merged_path
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    start_time = time.time()
+
+    run()
+
+    spotify_extract.record_run_metrics()
+    spotify_extract.log_run_stats()
+    logging.info(f"Run report saved to {write_run_report('pipeline')}")
+    logging.info(f"Total execution time: {time.time() - start_time:.2f} seconds")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+# spotify_queue.py
+
+"""
+This file splits extraction into work units that several worker processes on one machine
+process in parallel, coordinated through a lease-based work queue in SQLite.
+
+Features:
+- The coordinator enqueues one work unit per year of a range; enqueuing again never duplicates
+  or resets units, so a range can be extended later.
+- Workers claim units with a time-limited lease and renew it while they work. A unit whose worker
+  died is claimed again once its lease expires; a unit that keeps failing is marked failed.
+- A worker checks its lease before committing its partitions and drops its work if it lost the lease,
+  so only the worker holding the unit writes its year.
+- Each unit is extracted with spotify_extract.run() into the year-partitioned raw layout,
+  which spotify_transform.py (PARTITIONED = True) and spotify_merge.py pick up.
+
+Usage:
+- python spotify_queue.py enqueue --start 1900 --end 2024
+- python spotify_queue.py work [--processes 4] [--lease 600]
+- python spotify_queue.py status
+- python spotify_queue.py retry   (re-queue the failed units)
+
+Note:
+- RATE_LIMIT in spotify_extract.py applies to every worker process, so divide it by the number of workers.
+- The queue is for workers on a single host only: SQLite's WAL mode needs shared memory between the processes
+  and does not work on network file systems (NFS, SMB), and neither does the lock file of the partition index.
+- Tracks are deduplicated within a unit, so a track found in several years is stored in each of their partitions.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import spotify_extract
+from spotify_metrics import write_run_report
+from spotify_partitions import partition_name
+
+# path of the queue database
+QUEUE_PATH = "./cache/work_queue.db"
+
+# seconds a claimed unit stays leased without renewal; leases are renewed every third of this
+LEASE_SECONDS = 600
+
+# number of failed or expired attempts after which a unit is marked failed
+MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS work_units (
+    unit_id TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_token TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS work_units_status ON work_units (status, lease_expires);
+"""
+
+
+class LeaseLost(Exception):
+    """Raised in a worker when the lease of its unit expired and another worker may have claimed it."""
+
+
+class WorkQueue:
+    """
+    Lease-based work queue stored in a SQLite database, shared by any number of processes.
+
+    :param path: path of the SQLite database file.
+    :param max_attempts: number of failed or expired attempts after which a unit is marked failed.
+    """
+
+    def __init__(self, path=QUEUE_PATH, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # other processes hold the write lock only briefly, so wait for it instead of failing
+            self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            # WAL needs shared memory between the processes, so the database must be on a local disk of this host
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def enqueue(self, units):
+        """
+        Add work units. Units that are already queued (in any state) are left unchanged.
+
+        :param units: dict of unit IDs to JSON-serializable payloads.
+        :return: number of units added.
+        """
+        now = time.time()
+        rows = [(unit_id, json.dumps(payload), now) for unit_id, payload in units.items()]
+
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                before = connection.total_changes
+                connection.executemany(
+                    "INSERT OR IGNORE INTO work_units (unit_id, payload, updated_at) VALUES (?, ?, ?)", rows
+                )
+                return connection.total_changes - before
+
+    def claim(self, worker, lease_seconds=LEASE_SECONDS):
+        """
+        Lease the next pending unit, or a leased unit whose lease expired.
+
+        :param worker: ID of the claiming worker.
+        :param lease_seconds: duration of the lease.
+        :return: dict with "unit_id", "payload", and "lease_token", or None if no unit is available.
+        """
+        now = time.time()
+        token = uuid.uuid4().hex
+
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                # units whose workers keep dying are not handed out forever
+                connection.execute(
+                    "UPDATE work_units SET status = 'failed', error = 'lease expired', updated_at = ? "
+                    "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                    (now, now, self.max_attempts),
+                )
+                # a single statement, so two workers can never lease the same unit
+                connection.execute(
+                    "UPDATE work_units SET status = 'leased', worker = ?, lease_token = ?, lease_expires = ?, "
+                    "attempts = attempts + 1, updated_at = ? "
+                    "WHERE unit_id = (SELECT unit_id FROM work_units "
+                    "WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?) ORDER BY rowid LIMIT 1)",
+                    (worker, token, now + lease_seconds, now, now),
+                )
+                row = connection.execute(
+                    "SELECT unit_id, payload FROM work_units WHERE lease_token = ?", (token,)
+                ).fetchone()
+
+        if row is None:
+            return None
+        return {"unit_id": row[0], "payload": json.loads(row[1]), "lease_token": token}
+
+    def _update_leased(self, unit, assignments, params):
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                cursor = connection.execute(
+                    f"UPDATE work_units SET {assignments}, updated_at = ? "
+                    "WHERE unit_id = ? AND lease_token = ? AND status = 'leased'",
+                    params + (time.time(), unit["unit_id"], unit["lease_token"]),
+                )
+                return cursor.rowcount == 1
+
+    def renew(self, unit, lease_seconds=LEASE_SECONDS):
+        """
+        Extend the lease of a claimed unit.
+
+        :param unit: unit returned by claim().
+        :param lease_seconds: new duration of the lease, from now.
+        :return: False if the lease was lost, e.g. because it expired and another worker claimed the unit.
+        """
+        return self._update_leased(unit, "lease_expires = ?", (time.time() + lease_seconds,))
+
+    def complete(self, unit):
+        """
+        Mark a claimed unit as done.
+
+        :param unit: unit returned by claim().
+        :return: False if the lease was lost.
+        """
+        return self._update_leased(unit, "status = 'done', lease_token = NULL, error = NULL", ())
+
+    def fail(self, unit, error):
+        """
+        Release a claimed unit after an error. It is queued again unless it used up its attempts.
+
+        :param unit: unit returned by claim().
+        :param error: description of the error.
+        :return: False if the lease was lost.
+        """
+        return self._update_leased(
+            unit, "status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, lease_token = NULL, error = ?",
+            (self.max_attempts, error),
+        )
+
+    def retry_failed(self):
+        """
+        Queue the failed units again, with fresh attempts.
+
+        :return: number of units queued again.
+        """
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                return connection.execute(
+                    "UPDATE work_units SET status = 'pending', attempts = 0, updated_at = ? WHERE status = 'failed'",
+                    (time.time(),),
+                ).rowcount
+
+    def stats(self):
+        """
+        :return: dict of unit states ("pending", "leased", "done", "failed") to their number of units.
+        """
+        with self._lock:
+            connection = self._connect()
+            counts = dict(connection.execute("SELECT status, COUNT(*) FROM work_units GROUP BY status"))
+        return {status: counts.get(status, 0) for status in ("pending", "leased", "done", "failed")}
+
+    def failures(self):
+        """
+        :return: list of (unit ID, error) tuples of the failed units.
+        """
+        with self._lock:
+            connection = self._connect()
+            return connection.execute(
+                "SELECT unit_id, error FROM work_units WHERE status = 'failed' ORDER BY rowid"
+            ).fetchall()
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def year_units(year_start, year_end):
+    """
+    :param year_start: first year of the range.
+    :param year_end: last year of the range.
+    :return: dict of unit IDs (e.g. "year=1915") to payloads, one unit per year.
+    """
+    return {partition_name(year): {"year": year} for year in range(year_start, year_end + 1)}
+
+
+@contextmanager
+def keep_leased(queue, unit, lease_seconds=LEASE_SECONDS):
+    """
+    Renew the lease of a unit in a background thread while the block runs.
+
+    :param queue: WorkQueue.
+    :param unit: unit returned by claim().
+    :param lease_seconds: duration of the lease.
+    :return: function that raises LeaseLost unless the unit is still leased (renewing the lease once more),
+        to be called right before the results of the unit are committed.
+    """
+    stop = threading.Event()
+    lost = threading.Event()
+
+    def renew():
+        while not stop.wait(lease_seconds / 3):
+            if not queue.renew(unit, lease_seconds):
+                logging.warning(f"Lost the lease of {unit['unit_id']}")
+                lost.set()
+                return
+
+    def check_lease():
+        if lost.is_set() or not queue.renew(unit, lease_seconds):
+            lost.set()
+            raise LeaseLost(f"Lost the lease of {unit['unit_id']}")
+
+    thread = threading.Thread(target=renew, daemon=True)
+    thread.start()
+    try:
+        yield check_lease
+    finally:
+        stop.set()
+        thread.join()
+
+
+def work(queue, worker=None, lease_seconds=LEASE_SECONDS, output_dir=None):
+    """
+    Claim and extract units until the queue has no more available units.
+
+    :param queue: WorkQueue.
+    :param worker: ID of this worker (default: host name and process ID).
+    :param lease_seconds: duration of the leases.
+    :param output_dir: root directory of the raw partitions (default: spotify_extract.OUTPUT_DIR).
+    :return: number of units completed by this worker.
+    """
+    worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+    completed = 0
+
+    while True:
+        unit = queue.claim(worker, lease_seconds)
+        if unit is None:
+            break
+
+        year = unit["payload"]["year"]
+        logging.info(f"Worker {worker} claimed {unit['unit_id']}")
+        try:
+            with keep_leased(queue, unit, lease_seconds) as check_lease:
+                spotify_extract.run(year, year, format="partitioned", output_dir=output_dir,
+                                    before_commit=check_lease)
+        except LeaseLost:
+            # another worker may have claimed the unit, so this worker's partition was dropped, not committed
+            logging.warning(f"Worker {worker} dropped {unit['unit_id']} after losing its lease")
+            continue
+        except Exception as e:
+            logging.exception(f"Worker {worker} failed on {unit['unit_id']}")
+            queue.fail(unit, f"{type(e).__name__}: {e}")
+            continue
+
+        if queue.complete(unit):
+            completed += 1
+        else:
+            # the lease expired between the commit and now; the partition is committed all the same
+            logging.warning(f"Worker {worker} finished {unit['unit_id']} after losing its lease")
+
+    logging.info(f"Worker {worker} completed {completed} units")
+    return completed
+
+
+def _worker_process(queue_path, lease_seconds, output_dir):
+    """Entry point of a worker process started by main()."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    worker = f"{socket.gethostname()}-{os.getpid()}"
+    work(WorkQueue(queue_path), worker, lease_seconds, output_dir)
+    spotify_extract.record_run_metrics()
+    logging.info(f"Run report saved to {write_run_report('extract_' + worker)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract a range of years with several workers.")
+    parser.add_argument("--queue", default=QUEUE_PATH, help="path of the queue database")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    enqueue = commands.add_parser("enqueue", help="queue one work unit per year")
+    enqueue.add_argument("--start", type=int, default=spotify_extract.YEAR_START)
+    enqueue.add_argument("--end", type=int, default=spotify_extract.YEAR_END)
+
+    worker = commands.add_parser("work", help="process queued units until none are left")
+    worker.add_argument("--processes", type=int, default=1, help="number of worker processes on this machine")
+    worker.add_argument("--lease", type=float, default=LEASE_SECONDS, help="lease duration in seconds")
+    worker.add_argument("--output-dir", default=spotify_extract.OUTPUT_DIR, help="root of the raw partitions")
+
+    commands.add_parser("status", help="show the number of units per state")
+    commands.add_parser("retry", help="queue the failed units again")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    queue = WorkQueue(args.queue)
+
+    if args.command == "enqueue":
+        added = queue.enqueue(year_units(args.start, args.end))
+        logging.info(f"Queued {added} new units for {args.start}-{args.end}")
+    elif args.command == "work":
+        processes = [multiprocessing.Process(target=_worker_process, args=(args.queue, args.lease, args.output_dir))
+                     for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    elif args.command == "retry":
+        logging.info(f"Queued {queue.retry_failed()} failed units again")
+
+    logging.info(f"Queue: {queue.stats()}")
+    for unit_id, error in queue.failures():
+        logging.info(f"Failed: {unit_id}: {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+# spotify_rate_limiter.py
+
+"""
+This file provides the rate limiter that every Spotify API call goes through.
+
+Features:
+- Token bucket that spaces requests out at the current rate, with a small burst allowance.
+- Honors the Retry-After header of 429 responses and blocks all callers until it expires.
+- Retries throttled calls with jittered exponential backoff.
+- Halves the rate once per throttle window (the 429s of the requests in flight count once) and slowly
+  raises it again while responses are healthy.
+- Works for both threaded code (acquire/call) and asyncio code (acquire_async).
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    Adaptive token-bucket rate limiter shared by all Spotify API calls.
+
+    :param rate: initial number of requests per second.
+    :param burst: number of requests that may be sent back to back (default: one second worth).
+    :param min_rate: lowest rate the limiter backs off to.
+    :param max_rate: highest rate the limiter recovers to.
+    :param increase_step: requests per second added after a run of healthy responses.
+    :param increase_after: number of healthy responses needed before the rate is raised.
+    :param max_retries: number of times a throttled call is retried before giving up.
+    :param base_backoff: backoff in seconds for the first retry when no Retry-After is given.
+    :param max_backoff: upper bound for the backoff in seconds.
+    :param decrease_interval: seconds after a decrease in which further 429s do not lower the rate again.
+    :param metrics: optional Metrics that records time spent waiting, throttles, and retries.
+    """
+
+    def __init__(self, rate=10.0, burst=None, min_rate=1.0, max_rate=30.0, increase_step=0.5,
+                 increase_after=20, max_retries=5, base_backoff=1.0, max_backoff=60.0, decrease_interval=1.0,
+                 metrics=None):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase_step = increase_step
+        self.increase_after = increase_after
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.decrease_interval = decrease_interval
+        self.metrics = metrics
+
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.decreased_at = None
+        self.healthy_responses = 0
+        self.throttle_events = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    @property
+    def current_rate(self):
+        """Current number of requests per second."""
+        return self.rate
+
+    def _reserve(self):
+        """
+        Take a token if one is available.
+
+        :return: 0 if a token was taken, otherwise the number of seconds to wait before trying again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """Block the calling thread until a request may be sent."""
+        wait = self._reserve()
+        while wait:
+            time.sleep(wait)
+            self.record_sleep("rate_limit", wait)
+            wait = self._reserve()
+
+    async def acquire_async(self):
+        """Wait without blocking the event loop until a request may be sent."""
+        wait = self._reserve()
+        while wait:
+            await asyncio.sleep(wait)
+            self.record_sleep("rate_limit", wait)
+            wait = self._reserve()
+
+    def record_sleep(self, reason, seconds):
+        """
+        Report time spent waiting to the metrics, if any.
+
+        :param reason: "rate_limit" or "backoff".
+        :param seconds: time waited.
+        """
+        if self.metrics:
+            self.metrics.add_sleep(reason, seconds)
+
+    def record_retry(self):
+        """Register that a throttled call is retried."""
+        with self._lock:
+            self.retries += 1
+        if self.metrics:
+            self.metrics.count("retries")
+
+    def record_success(self):
+        """Register a healthy response and raise the rate after enough of them."""
+        with self._lock:
+            self.healthy_responses += 1
+            if self.healthy_responses >= self.increase_after and self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.increase_step)
+                self.healthy_responses = 0
+
+    def record_throttle(self, retry_after=None):
+        """
+        Register a 429 response: halve the rate and block every caller until Retry-After expires.
+        The requests in flight when Spotify starts throttling all get a 429; they belong to the same throttle
+        window, so only the first of them lowers the rate.
+
+        :param retry_after: value of the Retry-After header in seconds, if the response had one.
+        """
+        if self.metrics:
+            self.metrics.count("throttles")
+
+        with self._lock:
+            now = time.monotonic()
+            self.throttle_events += 1
+            self.healthy_responses = 0
+            decrease = now >= self.blocked_until and (
+                self.decreased_at is None or now - self.decreased_at >= self.decrease_interval)
+            if decrease:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.decreased_at = now
+            self.tokens = 0
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+
+        if decrease:
+            logging.warning(f"Throttled by Spotify (retry after {retry_after}s), "
+                            f"rate lowered to {self.rate:.2f} req/s")
+        else:
+            logging.debug(f"Throttled by Spotify (retry after {retry_after}s) in the same throttle window")
+
+    def backoff_delay(self, attempt, retry_after=None):
+        """
+        Compute how long to wait before retrying a throttled call.
+        Jitter keeps concurrent callers from retrying at the same moment.
+
+        :param attempt: number of the failed attempt, starting at 0.
+        :param retry_after: value of the Retry-After header in seconds, if any.
+        :return: delay in seconds.
+        """
+        if retry_after:
+            return retry_after + random.uniform(0, 1)
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call a Spotify API function through the limiter, retrying when it is throttled.
+
+        :param func: function that sends one request, e.g. sp.search.
+        :return: the return value of func.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as error:
+                if getattr(error, "http_status", None) != 429 or attempt == self.max_retries:
+                    raise
+                retry_after = parse_retry_after(getattr(error, "headers", None))
+                self.record_throttle(retry_after)
+                self.record_retry()
+                delay = self.backoff_delay(attempt, retry_after)
+                time.sleep(delay)
+                self.record_sleep("backoff", delay)
+            else:
+                self.record_success()
+                return result
+
+    def stats(self):
+        """
+        :return: dict with the current rate, throttle events, and retries.
+        """
+        return {
+            "current_rate": round(self.rate, 2),
+            "throttle_events": self.throttle_events,
+            "retries": self.retries,
+        }
+
+
+def parse_retry_after(headers):
+    """
+    Read the Retry-After header of a response.
+
+    :param headers: response headers (any mapping), may be None.
+    :return: number of seconds to wait, or None if the header is missing or invalid.
+    """
+    if not headers:
+        return None
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
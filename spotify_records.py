@@ -0,0 +1,175 @@
+# spotify_records.py
+
+"""
+This file provides the compact in-memory records that hold the tracks of an extraction run.
+
+Features:
+- Keeps only the track fields spotify_transform.py reads (TRACK_FIELDS in spotify_extract.py) in slotted
+  objects, instead of the nested dicts of the API responses.
+- Stores the audio features of a track in one array of doubles instead of a dict per track.
+- Serializes back to the track dicts of the raw output, so the raw files and the transformed data keep
+  their shape. Only "audio_features" is smaller: it lists the features the transform reads and drops the
+  metadata of the API object (type, id, uri, track_href, analysis_url, duration_ms).
+
+Note:
+- Records are created by TrackRegistry.add when a track is first seen in a run.
+- json.dump and NDJSONWriter (spotify_io.py) serialize them through to_json below, one record at a time.
+"""
+
+import math
+import sys
+from array import array
+
+# audio features kept per track, in output order (the feature columns of spotify_transform.py)
+AUDIO_FEATURES = (
+    "danceability", "energy", "key", "loudness", "mode", "speechiness", "acousticness",
+    "instrumentalness", "liveness", "valence", "tempo", "time_signature",
+)
+
+# value stored for a missing audio feature
+MISSING = math.nan
+
+
+class ArtistRecord:
+    """
+    Artist of a track. "genres" and "popularity" are only set once artist details are attached.
+    """
+
+    __slots__ = ("id", "name", "genres", "popularity")
+
+    def __init__(self, id, name, genres=None, popularity=None):
+        self.id = id
+        self.name = name
+        self.genres = genres
+        self.popularity = popularity
+
+    @classmethod
+    def from_dict(cls, artist):
+        """
+        :param artist: artist object of a track, from the API or from a raw file.
+        :return: ArtistRecord.
+        """
+        return cls(artist.get('id'), artist.get('name'), artist.get('genres'), artist.get('popularity'))
+
+    def to_dict(self):
+        """
+        :return: artist dict as written to the raw output.
+        """
+        artist = {"id": self.id, "name": self.name}
+        if self.genres is not None:
+            artist["genres"] = self.genres
+            artist["popularity"] = self.popularity
+        return artist
+
+
+class TrackRecord:
+    """
+    Track of an extraction run, holding only the fields used downstream.
+    "audio_features" is None until features are attached; "playlist_ids" and "years" are set by the registry.
+    """
+
+    __slots__ = ("id", "name", "popularity", "duration_ms", "explicit", "artists",
+                 "album_name", "album_release_date", "album_type",
+                 "audio_features", "integer_features", "playlist_ids", "years")
+
+    def __init__(self, id, name=None, popularity=None, duration_ms=None, explicit=None, artists=(),
+                 album_name=None, album_release_date=None, album_type=None):
+        self.id = id
+        self.name = name
+        self.popularity = popularity
+        self.duration_ms = duration_ms
+        self.explicit = explicit
+        self.artists = artists
+        self.album_name = album_name
+        self.album_release_date = album_release_date
+        # a handful of distinct values shared by all tracks
+        self.album_type = sys.intern(album_type) if isinstance(album_type, str) else album_type
+        self.audio_features = None
+        self.integer_features = 0
+        self.playlist_ids = None
+        self.years = None
+
+    @classmethod
+    def from_dict(cls, track):
+        """
+        :param track: track object trimmed to TRACK_FIELDS, or an enriched track from a checkpoint or raw file.
+        :return: TrackRecord.
+        """
+        album = track.get('album') or {}
+        record = cls(
+            track['id'], track.get('name'), track.get('popularity'), track.get('duration_ms'), track.get('explicit'),
+            tuple(ArtistRecord.from_dict(artist) for artist in track.get('artists') or ()),
+            album.get('name'), album.get('release_date'), album.get('album_type'),
+        )
+        if 'audio_features' in track:
+            record.set_audio_features(track['audio_features'])
+        record.playlist_ids = track.get('playlist_ids')
+        record.years = track.get('years')
+        return record
+
+    def set_audio_features(self, features):
+        """
+        Attach audio features. Features that are whole numbers in the API response (e.g. "key")
+        are flagged, so they are written back as integers.
+
+        :param features: audio features object from the API, or None/empty if the track has none.
+        """
+        if not features:
+            self.audio_features = array('d')
+            self.integer_features = 0
+            return
+
+        values = array('d')
+        integer_features = 0
+        for i, name in enumerate(AUDIO_FEATURES):
+            value = features.get(name)
+            if value is None:
+                values.append(MISSING)
+                continue
+            values.append(value)
+            if isinstance(value, int):
+                integer_features |= 1 << i
+        self.audio_features = values
+        self.integer_features = integer_features
+
+    def audio_features_dict(self):
+        """
+        :return: dict of audio features (None for missing values), empty if the track has none.
+        """
+        return {
+            name: None if math.isnan(value) else int(value) if self.integer_features >> i & 1 else value
+            for i, (name, value) in enumerate(zip(AUDIO_FEATURES, self.audio_features))
+        }
+
+    def to_dict(self):
+        """
+        :return: track dict as written to the raw output by spotify_extract.py.
+        """
+        track = {
+            "id": self.id,
+            "name": self.name,
+            "popularity": self.popularity,
+            "duration_ms": self.duration_ms,
+            "explicit": self.explicit,
+            "artists": [artist.to_dict() for artist in self.artists],
+            "album": {"name": self.album_name, "release_date": self.album_release_date, "album_type": self.album_type},
+        }
+        if self.audio_features is not None:
+            track["audio_features"] = self.audio_features_dict()
+            track["artist_names"] = [artist.name for artist in self.artists]
+        if self.playlist_ids is not None:
+            track["playlist_ids"] = self.playlist_ids
+            track["years"] = self.years
+        return track
+
+
+def to_json(obj):
+    """
+    "default" hook of json.dump: serializes records as their dicts.
+
+    :param obj: object the json module cannot serialize itself.
+    :return: dict of the record.
+    """
+    if isinstance(obj, (TrackRecord, ArtistRecord)):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
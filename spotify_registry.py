@@ -0,0 +1,111 @@
+# spotify_registry.py
+
+"""
+This file provides the registry that deduplicates tracks across a whole extraction run.
+
+Features:
+- Keeps a single canonical record per track ID, no matter how many playlists and years reference it.
+- Records which playlists and years referenced each track.
+- Can keep only the membership information (for streaming runs that write tracks out immediately).
+- Converts every new track into a compact TrackRecord on ingestion, so a run never holds API dicts for long.
+"""
+
+from spotify_records import TrackRecord
+
+
+class TrackRegistry:
+    """
+    Canonical track records and playlist/year membership of one extraction run.
+
+    :param keep_records: keep the track records themselves (False: only track IDs and membership).
+    """
+
+    def __init__(self, keep_records=True):
+        self.keep_records = keep_records
+        self._records = {}
+        self._memberships = {}
+
+    def __len__(self):
+        return len(self._memberships)
+
+    def __contains__(self, track_id):
+        return track_id in self._memberships
+
+    def add(self, track, playlist_id, year):
+        """
+        Register an occurrence of a track in a playlist.
+
+        :param track: track object trimmed to TRACK_FIELDS.
+        :param playlist_id: ID of the playlist the track was found in.
+        :param year: year the playlist was searched for.
+        :return: new TrackRecord of the track if this is its first occurrence in the run, else None.
+        """
+        track_id = track['id']
+        record = None
+        if track_id not in self._memberships:
+            record = TrackRecord.from_dict(track)
+            if self.keep_records:
+                self._records[track_id] = record
+        self.add_membership(track_id, playlist_id, year)
+        return record
+
+    def add_membership(self, track_id, playlist_id, year):
+        """
+        Record that a track was found in a playlist searched for a year.
+
+        :param track_id: Spotify track ID.
+        :param playlist_id: Spotify playlist ID.
+        :param year: year the playlist was searched for.
+        """
+        playlist_ids, years = self._memberships.setdefault(track_id, ([], []))
+        if playlist_id not in playlist_ids:
+            playlist_ids.append(playlist_id)
+        if year not in years:
+            years.append(year)
+
+    def restore(self, tracks, memberships, year):
+        """
+        Restore the state of a completed year, e.g. from a checkpoint.
+
+        :param tracks: tracks first seen in the year, as dicts.
+        :param memberships: dict of track IDs to the IDs of the year's playlists that contained them.
+        :param year: the completed year.
+        """
+        for track in tracks:
+            if track['id'] not in self._memberships and self.keep_records:
+                self._records[track['id']] = TrackRecord.from_dict(track)
+            self._memberships.setdefault(track['id'], ([], []))
+        for track_id, playlist_ids in memberships.items():
+            for playlist_id in playlist_ids:
+                self.add_membership(track_id, playlist_id, year)
+
+    def memberships_for(self, year, playlist_ids):
+        """
+        :param year: year of the search.
+        :param playlist_ids: IDs of the playlists of the year.
+        :return: dict of track IDs to the given playlists that contained them, for the tracks seen in the year.
+        """
+        playlist_ids = set(playlist_ids)
+        return {
+            track_id: [playlist_id for playlist_id in track_playlists if playlist_id in playlist_ids]
+            for track_id, (track_playlists, years) in self._memberships.items()
+            if year in years
+        }
+
+    def records(self):
+        """
+        :return: list of canonical TrackRecords in order of first occurrence, each with
+            "playlist_ids" and "years" listing where it was found.
+        """
+        tracks = []
+        for track_id, track in self._records.items():
+            track.playlist_ids, track.years = self._memberships[track_id]
+            tracks.append(track)
+        return tracks
+
+    def iter_memberships(self):
+        """
+        :return: generator of dicts with the "track_id", "playlist_ids", and "years" of every track.
+        """
+        for track_id, (playlist_ids, years) in self._memberships.items():
+            yield {"track_id": track_id, "playlist_ids": playlist_ids, "years": years}
@@ -0,0 +1,286 @@
+# spotify_store.py
+
+"""
+This file provides a normalized relational store of the extracted tracks, backed by SQLite.
+
+Features:
+- Separate tables for tracks, artists, the artists of each track (in credit order), playlists,
+  and the tracks of each playlist, so artist names are never joined into (and split from) one string.
+- Upserts keyed by Spotify ID, so loading the same or an overlapping extract again updates rows in place.
+- Indexes on artist, release year, and playlist, so lookups by any of them are indexed queries.
+
+Tables:
+- tracks (track_id, track_name, popularity, duration_ms, explicit, album_name, year, album_type, audio features)
+- artists (artist_id, artist_name, genres, popularity)
+- track_artists (track_id, artist_id, position)
+- playlists (playlist_id)
+- playlist_tracks (playlist_id, track_id)
+"""
+
+import json
+import os
+import sqlite3
+import threading
+
+# audio feature columns of the tracks table
+FEATURE_COLUMNS = [
+    "danceability", "energy", "key", "loudness", "mode", "speechiness",
+    "acousticness", "instrumentalness", "liveness", "valence", "tempo", "time_signature",
+]
+
+TRACK_COLUMNS = [
+    "track_id", "track_name", "popularity", "duration_ms", "explicit", "album_name", "year", "album_type",
+] + FEATURE_COLUMNS
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS tracks (
+    track_id TEXT PRIMARY KEY,
+    track_name TEXT,
+    popularity INTEGER,
+    duration_ms INTEGER,
+    explicit INTEGER,
+    album_name TEXT,
+    year INTEGER,
+    album_type TEXT,
+    danceability REAL,
+    energy REAL,
+    key INTEGER,
+    loudness REAL,
+    mode INTEGER,
+    speechiness REAL,
+    acousticness REAL,
+    instrumentalness REAL,
+    liveness REAL,
+    valence REAL,
+    tempo REAL,
+    time_signature INTEGER
+);
+CREATE INDEX IF NOT EXISTS tracks_year ON tracks (year);
+
+CREATE TABLE IF NOT EXISTS artists (
+    artist_id TEXT PRIMARY KEY,
+    artist_name TEXT,
+    genres TEXT,
+    popularity INTEGER
+);
+CREATE INDEX IF NOT EXISTS artists_name ON artists (artist_name);
+
+CREATE TABLE IF NOT EXISTS track_artists (
+    track_id TEXT NOT NULL REFERENCES tracks (track_id),
+    artist_id TEXT NOT NULL REFERENCES artists (artist_id),
+    position INTEGER NOT NULL,
+    PRIMARY KEY (track_id, position)
+);
+CREATE INDEX IF NOT EXISTS track_artists_artist ON track_artists (artist_id);
+
+CREATE TABLE IF NOT EXISTS playlists (
+    playlist_id TEXT PRIMARY KEY
+);
+
+CREATE TABLE IF NOT EXISTS playlist_tracks (
+    playlist_id TEXT NOT NULL REFERENCES playlists (playlist_id),
+    track_id TEXT NOT NULL REFERENCES tracks (track_id),
+    PRIMARY KEY (playlist_id, track_id)
+);
+CREATE INDEX IF NOT EXISTS playlist_tracks_track ON playlist_tracks (track_id);
+"""
+
+_UPSERT_TRACK = (
+    f"INSERT INTO tracks ({', '.join(TRACK_COLUMNS)}) VALUES ({', '.join('?' * len(TRACK_COLUMNS))}) "
+    f"ON CONFLICT (track_id) DO UPDATE SET "
+    + ", ".join(f"{column} = excluded.{column}" for column in TRACK_COLUMNS[1:])
+)
+
+# genres and popularity are only known when the extract enriched its artists, so missing values
+# never overwrite known ones
+_UPSERT_ARTIST = (
+    "INSERT INTO artists (artist_id, artist_name, genres, popularity) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT (artist_id) DO UPDATE SET artist_name = excluded.artist_name, "
+    "genres = COALESCE(excluded.genres, artists.genres), "
+    "popularity = COALESCE(excluded.popularity, artists.popularity)"
+)
+
+
+def track_row(track):
+    """
+    :param track: track as written by spotify_extract.py.
+    :return: tuple with one value per column of the tracks table.
+    """
+    audio_features = track.get("audio_features") or {}
+    album = track["album"]
+
+    # extract the year from the release date
+    release_date = album.get("release_date")
+    year = int(release_date.split("-", 1)[0]) if release_date else None
+
+    return (
+        track["id"],
+        track["name"],
+        track.get("popularity"),
+        track.get("duration_ms"),
+        track.get("explicit"),
+        album.get("name"),
+        year,
+        album.get("album_type"),
+    ) + tuple(audio_features.get(column) for column in FEATURE_COLUMNS)
+
+
+class TrackStore:
+    """
+    Normalized SQLite store of tracks, artists, and playlists.
+
+    :param path: path of the SQLite database file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def upsert_tracks(self, tracks):
+        """
+        Insert or update a batch of raw tracks with their artists and, if the tracks carry
+        "playlist_ids", their playlists. Everything is written in one transaction.
+
+        :param tracks: list of tracks as written by spotify_extract.py.
+        :return: number of tracks written.
+        """
+        track_rows = []
+        artists = {}
+        credits = []
+        memberships = []
+
+        for track in tracks:
+            track_id = track["id"]
+            track_rows.append(track_row(track))
+
+            for position, artist in enumerate(track["artists"]):
+                artist_id = artist.get("id")
+                if not artist_id:
+                    continue
+                genres = artist.get("genres")
+                artists[artist_id] = (artist_id, artist.get("name"),
+                                      None if genres is None else json.dumps(genres, ensure_ascii=False),
+                                      artist.get("popularity"))
+                credits.append((track_id, artist_id, position))
+
+            memberships.extend((playlist_id, track_id) for playlist_id in track.get("playlist_ids", []))
+
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany(_UPSERT_TRACK, track_rows)
+                connection.executemany(_UPSERT_ARTIST, list(artists.values()))
+
+                # the credits of a track are replaced as a whole, so removed artists do not linger
+                connection.executemany("DELETE FROM track_artists WHERE track_id = ?",
+                                       [(row[0],) for row in track_rows])
+                connection.executemany(
+                    "INSERT OR REPLACE INTO track_artists (track_id, artist_id, position) VALUES (?, ?, ?)", credits
+                )
+                self._insert_memberships(connection, memberships)
+
+        return len(track_rows)
+
+    def upsert_memberships(self, memberships):
+        """
+        Record the playlists of tracks, e.g. from the _memberships_ file of a streamed extract.
+
+        :param memberships: iterable of dicts with a "track_id" and its "playlist_ids".
+        :return: number of (playlist, track) pairs written.
+        """
+        pairs = [(playlist_id, membership["track_id"])
+                 for membership in memberships for playlist_id in membership["playlist_ids"]]
+
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                self._insert_memberships(connection, pairs)
+
+        return len(pairs)
+
+    @staticmethod
+    def _insert_memberships(connection, pairs):
+        connection.executemany("INSERT OR IGNORE INTO playlists (playlist_id) VALUES (?)",
+                               [(playlist_id,) for playlist_id in dict.fromkeys(pid for pid, _ in pairs)])
+        connection.executemany("INSERT OR IGNORE INTO playlist_tracks (playlist_id, track_id) VALUES (?, ?)", pairs)
+
+    def _query_tracks(self, join, where, params):
+        with self._lock:
+            connection = self._connect()
+            cursor = connection.execute(
+                f"SELECT {', '.join('t.' + column for column in TRACK_COLUMNS)} FROM tracks t {join} "
+                f"WHERE {where} ORDER BY t.track_id", params
+            )
+            return [dict(zip(TRACK_COLUMNS, row)) for row in cursor]
+
+    def tracks_by_artist(self, artist_id):
+        """
+        :param artist_id: Spotify artist ID.
+        :return: list of track rows (dicts) credited to the artist.
+        """
+        return self._query_tracks("JOIN track_artists ta ON ta.track_id = t.track_id",
+                                  "ta.artist_id = ?", (artist_id,))
+
+    def tracks_by_year(self, year):
+        """
+        :param year: release year.
+        :return: list of track rows (dicts) released in the year.
+        """
+        return self._query_tracks("", "t.year = ?", (year,))
+
+    def tracks_by_playlist(self, playlist_id):
+        """
+        :param playlist_id: Spotify playlist ID.
+        :return: list of track rows (dicts) found in the playlist.
+        """
+        return self._query_tracks("JOIN playlist_tracks pt ON pt.track_id = t.track_id",
+                                  "pt.playlist_id = ?", (playlist_id,))
+
+    def artists_of_track(self, track_id):
+        """
+        :param track_id: Spotify track ID.
+        :return: list of dicts with the "artist_id", "artist_name", "genres", and "popularity"
+            of the track's artists, in credit order.
+        """
+        with self._lock:
+            connection = self._connect()
+            rows = connection.execute(
+                "SELECT a.artist_id, a.artist_name, a.genres, a.popularity FROM track_artists ta "
+                "JOIN artists a ON a.artist_id = ta.artist_id WHERE ta.track_id = ? ORDER BY ta.position",
+                (track_id,),
+            ).fetchall()
+
+        return [
+            {"artist_id": artist_id, "artist_name": name,
+             "genres": None if genres is None else json.loads(genres), "popularity": popularity}
+            for artist_id, name, genres, popularity in rows
+        ]
+
+    def counts(self):
+        """
+        :return: dict with the number of rows of every table.
+        """
+        with self._lock:
+            connection = self._connect()
+            return {
+                table: connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("tracks", "artists", "track_artists", "playlists", "playlist_tracks")
+            }
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
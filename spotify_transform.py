@@ -1,43 +1,103 @@
 # spotify_transform.py
 
 """
-This file aims to transform JSON data extracted from Spotify into a tabular CSV format.
+This file aims to transform JSON data extracted from Spotify into a tabular CSV (or Parquet) format.
 
 Purpose:
 - Flatten nested JSON data into a tabular format.
 - Save the flattened data as a CSV file for easier processing with PySpark.
+- Optionally stream large extracts in fixed-size chunks, so memory depends on the chunk size
+  instead of the dataset size.
+
+Input:
+- The most recent JSON or NDJSON (optionally .gz/.zst compressed) file in ./raw_data.
+- Or, with TRANSFORM_ALL = True, every raw file not transformed yet according to the ledger
+  (input hash and modification time), transformed in parallel on all CPU cores.
+- Or, with PARTITIONED = True, the year partitions of ./raw_data listed in its _partitions.json
+  (optionally only the YEARS a job needs), transformed like TRANSFORM_ALL into one file per year.
 
 Output:
 - A timestamped CSV file containing track metadata, audio features, and artist names.
+- With PARTITIONED = True, ./transformed_data/year=YYYY/spotify_dataset_YYYY.csv per partition.
+- Or, with OUTPUT_FORMAT = "parquet", a typed and compressed Parquet file with the same columns.
+- With LOAD_STORE = True, the tracks are also upserted into a normalized SQLite store
+  (tracks, artists, track_artists, playlists, playlist_tracks) with indexed lookups by artist, year, and playlist.
 """
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import contextlib
 import json
+from operator import itemgetter
+import numpy as np
 import pandas as pd
 import os
-from datetime import datetime
+
+from spotify_io import file_fingerprint, iter_ndjson, open_text_file
+from spotify_metrics import metrics, write_run_report
+from spotify_parquet import open_parquet_writer, to_arrow_table, write_parquet
+from spotify_partitions import select_partitions
+from spotify_store import TrackStore
 
 # set input and output directories
-input_dir = "./raw_data"
-output_dir = "./transformed_data"
-os.makedirs(output_dir, exist_ok=True)
+INPUT_DIR = "./raw_data"
+OUTPUT_DIR = "./transformed_data"
+
+# output format: "csv" or "parquet" (typed columns, needs pyarrow)
+OUTPUT_FORMAT = "csv"
+
+# stream the input in chunks instead of loading it at once (recommended for large extracts)
+STREAMING = False
+
+# number of tracks flattened and written per chunk in streaming mode
+CHUNK_SIZE = 10_000
+
+# transform every raw file that has not been transformed yet, instead of only the most recent one
+TRANSFORM_ALL = False
+
+# transform the year partitions of the input directory (extracted with OUTPUT_FORMAT = "partitioned")
+# instead of single raw files, and only the YEARS listed (None: all partitions)
+PARTITIONED = False
+YEARS = None
+
+# number of worker processes when transforming several files (None: one per CPU core)
+MAX_WORKERS = None
 
-# list all JSON files in the directory
-json_files = [f for f in os.listdir(input_dir) if f.endswith('.json')]
+# also load the tracks into the normalized SQLite store (upserts, so files can be loaded again)
+LOAD_STORE = False
+STORE_PATH = "./transformed_data/spotify_tracks.db"
 
-# sort files by modification time (most recent first)
-json_files = sorted(json_files, key=lambda x: os.path.getmtime(os.path.join(input_dir, x)), reverse=True)
+# ledger of transformed raw files, kept in the output directory
+LEDGER_FILENAME = "transform_ledger.json"
 
-# select the most recent file
-input_file = os.path.join(input_dir, json_files[0])
-print(f"Using input file: {input_file}")
+# number of characters read at a time when parsing a JSON array incrementally
+READ_SIZE = 1 << 16
 
-# load the JSON data
-with open(input_file, 'r', encoding='utf-8') as f:
-    data = json.load(f)
+# extensions of the raw files produced by spotify_extract.py
+RAW_EXTENSIONS = (".json", ".ndjson", ".ndjson.gz", ".ndjson.zst")
 
-# extract relevant data and flatten into a tabular format
-tracks = []
-for track in data:
+# columns of the output CSV, in order
+COLUMNS = [
+    "track_id", "track_name", "artist_names", "popularity", "duration_ms", "explicit",
+    "album_name", "year", "album_type", "danceability", "energy", "key", "loudness", "mode",
+    "speechiness", "acousticness", "instrumentalness", "liveness", "valence", "tempo", "time_signature",
+]
+
+# audio feature columns, which are missing for some tracks
+FEATURE_COLUMNS = COLUMNS[COLUMNS.index("danceability"):]
+
+# audio features holding whole numbers; they stay integers unless a value is missing
+INTEGER_FEATURE_COLUMNS = ["key", "mode", "time_signature"]
+
+_get_features = itemgetter(*FEATURE_COLUMNS)
+
+
+def flatten_track(track):
+    """
+    Flatten one raw track into a row of the output table.
+
+    :param track: track as written by spotify_extract.py.
+    :return: dict with one value per output column.
+    """
     audio_features = track.get("audio_features", {})
 
     # extract the year from the release date
@@ -45,7 +105,7 @@ for track in data:
     release_year = album_release_date.split("-")[0] if album_release_date else None
 
     # append all details from JSON
-    tracks.append({
+    return {
         "track_id": track["id"],
         "track_name": track["name"],
         "artist_names": ", ".join([name for name in track.get("artist_names", []) if name]),
@@ -67,19 +127,532 @@ for track in data:
         "valence": audio_features.get("valence", None),
         "tempo": audio_features.get("tempo", None),
         "time_signature": audio_features.get("time_signature", None),
+    }
+
+
+def flatten_tracks(tracks):
+    """
+    Flatten a list of raw tracks into a DataFrame, building each column directly.
+    Produces the same table as pd.DataFrame([flatten_track(track) for track in tracks]), but instead of
+    building one dict per row, every column is gathered in a single pass (with C-level map/itemgetter
+    where possible) and the year and artist columns are computed for the whole batch at once.
+
+    :param tracks: list of tracks as written by spotify_extract.py.
+    :return: DataFrame with the output columns.
+    """
+    if not tracks:
+        return pd.DataFrame(columns=COLUMNS)
+
+    albums = list(map(itemgetter("album"), tracks))
+    features = [track.get("audio_features", {}) for track in tracks]
+
+    # extract the year from the release date; missing or empty dates give None
+    # (a plain comprehension is several times faster here than pandas' .str.split)
+    release_dates = map(itemgetter("release_date"), albums)
+    years = [date.split("-", 1)[0] if date else None for date in release_dates]
+
+    # join the non-empty artist names of every track
+    artist_names = [", ".join(filter(None, track.get("artist_names", []))) for track in tracks]
+
+    tracks_df = pd.DataFrame({
+        "track_id": list(map(itemgetter("id"), tracks)),
+        "track_name": list(map(itemgetter("name"), tracks)),
+        "artist_names": artist_names,
+        "popularity": list(map(itemgetter("popularity"), tracks)),
+        "duration_ms": list(map(itemgetter("duration_ms"), tracks)),
+        "explicit": list(map(itemgetter("explicit"), tracks)),
+        "album_name": list(map(itemgetter("name"), albums)),
+        "year": years,
+        "album_type": list(map(itemgetter("album_type"), albums)),
     })
 
-# convert the extracted data into a DataFrame
-tracks_df = pd.DataFrame(tracks)
+    # gather all audio features into one float matrix (missing values become NaN)
+    features_df = pd.DataFrame(np.array([_feature_row(f) for f in features], dtype=float),
+                               columns=FEATURE_COLUMNS)
+
+    # match the types pandas infers for the per-track rows: whole-number features stay integers
+    # as long as none of them is missing
+    for column in INTEGER_FEATURE_COLUMNS:
+        if not features_df[column].isna().any():
+            features_df[column] = features_df[column].astype(np.int64)
+
+    return pd.concat([tracks_df, features_df], axis=1)
+
+
+def _feature_row(audio_features):
+    """
+    :param audio_features: audio features of a track (possibly empty or incomplete).
+    :return: tuple with one value per audio feature column, None for missing values.
+    """
+    try:
+        return _get_features(audio_features)
+    except KeyError:
+        return tuple(audio_features.get(column) for column in FEATURE_COLUMNS)
+
+
+def iter_json_array(f, read_size=READ_SIZE):
+    """
+    Parse the items of a top-level JSON array one at a time, reading the file in small pieces.
+
+    :param f: file object opened in text mode.
+    :param read_size: number of characters read at a time.
+    :return: generator of array items.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    started = False
+
+    while True:
+        # skip whitespace and the separators between items
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+
+        if pos == len(buffer):
+            chunk = f.read(read_size)
+            if not chunk:
+                raise ValueError("Unexpected end of file while reading a JSON array")
+            buffer, pos = chunk, 0
+            continue
+
+        if not started:
+            if buffer[pos] != "[":
+                raise ValueError("Expected a JSON array")
+            started = True
+            pos += 1
+            continue
+
+        if buffer[pos] == "]":
+            return
+
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # the item continues beyond the buffer, so read more of it
+            chunk = f.read(read_size)
+            if not chunk:
+                raise
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+
+        yield item
+        pos = end
+
+
+def iter_raw_tracks(input_file):
+    """
+    Read the tracks of a raw file one at a time.
+
+    :param input_file: path of a JSON or NDJSON file written by spotify_extract.py.
+    :return: generator of tracks.
+    """
+    if ".ndjson" in os.path.basename(input_file):
+        yield from iter_ndjson(input_file)
+    else:
+        with open_text_file(input_file) as f:
+            yield from iter_json_array(f)
+
+
+def load_raw_tracks(input_file):
+    """
+    Load all tracks of a raw file at once.
+
+    :param input_file: path of a JSON or NDJSON file written by spotify_extract.py.
+    :return: list of tracks.
+    """
+    if ".ndjson" in os.path.basename(input_file):
+        return list(iter_ndjson(input_file))
+
+    with open(input_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def transform_file(input_file, output_file, format="csv"):
+    """
+    Flatten a raw file into a CSV or Parquet file, loading the whole file into memory.
+
+    :param input_file: path of the raw input file.
+    :param output_file: path of the output file.
+    :param format: format of the output file: csv or parquet (default: csv).
+    :return: number of rows written.
+    """
+    # load the JSON data
+    with metrics.stage("transform.read"):
+        data = load_raw_tracks(input_file)
+
+    # extract relevant data and flatten into a tabular format
+    with metrics.stage("transform.flatten"):
+        tracks_df = flatten_tracks(data)
+
+    # save the DataFrame to a CSV or Parquet file
+    with metrics.stage("transform.write"):
+        if format == "csv":
+            tracks_df.to_csv(output_file, index=False, encoding='utf-8')
+        elif format == "parquet":
+            write_parquet(tracks_df.reindex(columns=COLUMNS), output_file)
+        else:
+            raise ValueError(f"Unsupported format: {format}")
+    return len(tracks_df)
+
+
+def with_csv_types(chunk_df):
+    """
+    Give the feature columns of a flattened chunk the types its CSV rows are written with.
+    The type of a column must not depend on which chunk a row ended up in: whole-number
+    features stay integers (missing values are left empty) and the others are floats.
+
+    :param chunk_df: DataFrame returned by flatten_tracks; its columns are converted in place.
+    :return: chunk_df.
+    """
+    chunk_df[FEATURE_COLUMNS] = chunk_df[FEATURE_COLUMNS].astype(float)
+    chunk_df[INTEGER_FEATURE_COLUMNS] = chunk_df[INTEGER_FEATURE_COLUMNS].astype("Int64")
+    return chunk_df
+
+
+class TransformedFileWriter:
+    """
+    Append flattened chunks of tracks to a CSV or Parquet file (one row group per chunk for Parquet).
+
+    :param output_file: path of the output file.
+    :param format: format of the output file: csv or parquet (default: csv).
+    """
+
+    def __init__(self, output_file, format="csv"):
+        if format not in ("csv", "parquet"):
+            raise ValueError(f"Unsupported format: {format}")
+
+        self.output_file = output_file
+        self.rows = 0
+        self._header = True
+        self._parquet_writer = open_parquet_writer(output_file) if format == "parquet" else None
+
+    def write_frame(self, chunk_df):
+        """
+        :param chunk_df: DataFrame returned by flatten_tracks.
+        """
+        with metrics.stage("transform.write"):
+            if self._parquet_writer:
+                self._parquet_writer.write_table(to_arrow_table(chunk_df))
+            else:
+                chunk_df = with_csv_types(chunk_df)
+                chunk_df.to_csv(self.output_file, index=False, encoding='utf-8',
+                                mode='w' if self._header else 'a', header=self._header)
+        self.rows += len(chunk_df)
+        self._header = False
+
+    def write(self, tracks):
+        """
+        :param tracks: list of raw tracks.
+        """
+        with metrics.stage("transform.flatten"):
+            chunk_df = flatten_tracks(tracks)
+        self.write_frame(chunk_df)
+
+    def close(self):
+        """Finish the file; a file without any chunk still gets its header."""
+        if self._header:
+            self.write([])
+        if self._parquet_writer:
+            self._parquet_writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._parquet_writer:
+            self._parquet_writer.close()
+
+
+def transform_file_streaming(input_file, output_file, chunk_size=CHUNK_SIZE, format="csv"):
+    """
+    Flatten a raw file into a CSV or Parquet file chunk by chunk.
+    Tracks are parsed incrementally and every chunk_size rows are appended to the output
+    (as a Parquet row group for Parquet), so memory depends on the chunk size and not on the size of the input.
+
+    :param input_file: path of the raw input file.
+    :param output_file: path of the output file.
+    :param chunk_size: number of rows per chunk.
+    :param format: format of the output file: csv or parquet (default: csv).
+    :return: number of rows written.
+    """
+    rows = []
+
+    with TransformedFileWriter(output_file, format) as writer:
+        for track in iter_raw_tracks(input_file):
+            rows.append(track)
+            if len(rows) >= chunk_size:
+                writer.write(rows)
+                rows = []
+
+        if rows:
+            writer.write(rows)
+
+    return writer.rows
+
+
+def load_into_store(input_file, store_path=STORE_PATH, chunk_size=CHUNK_SIZE):
+    """
+    Upsert the tracks of a raw file into the normalized SQLite store, chunk by chunk.
+    The playlists of a streamed NDJSON extract are read from its "_memberships_" file, if present.
+
+    :param input_file: path of the raw input file.
+    :param store_path: path of the SQLite database.
+    :param chunk_size: number of tracks written per transaction.
+    :return: number of tracks written.
+    """
+    store = TrackStore(store_path)
+    rows = []
+    total = 0
+
+    with metrics.stage("transform.store"), contextlib.closing(store):
+        for track in iter_raw_tracks(input_file):
+            rows.append(track)
+            if len(rows) >= chunk_size:
+                total += store.upsert_tracks(rows)
+                rows = []
+        if rows:
+            total += store.upsert_tracks(rows)
+
+        memberships_file = os.path.join(os.path.dirname(input_file), "_memberships_" + os.path.basename(input_file))
+        if os.path.exists(memberships_file):
+            store.upsert_memberships(iter_ndjson(memberships_file))
+
+    return total
+
+
+def list_raw_files(input_dir=INPUT_DIR):
+    """
+    :param input_dir: directory holding the raw files.
+    :return: sorted list of the names of all raw files.
+    """
+    # files starting with "_" hold metadata, not tracks
+    return sorted(f for f in os.listdir(input_dir) if f.endswith(RAW_EXTENSIONS) and not f.startswith("_"))
+
+
+def find_latest_raw_file(input_dir=INPUT_DIR):
+    """
+    :param input_dir: directory holding the raw files.
+    :return: name of the most recently modified raw file.
+    """
+    # list all raw files in the directory
+    raw_files = list_raw_files(input_dir)
+
+    # sort files by modification time (most recent first)
+    raw_files = sorted(raw_files, key=lambda x: os.path.getmtime(os.path.join(input_dir, x)), reverse=True)
+
+    # select the most recent file
+    return raw_files[0]
+
+
+def output_filename(raw_filename, format="csv"):
+    """
+    Create the output filename based on the input filename, changing .json/.ndjson to .csv (or .parquet).
+
+    :param raw_filename: name of the raw input file.
+    :param format: format of the output file: csv or parquet (default: csv).
+    :return: name of the output file.
+    """
+    for extension in sorted(RAW_EXTENSIONS, key=len, reverse=True):
+        if raw_filename.endswith(extension):
+            return raw_filename[:-len(extension)] + "." + format
+    return os.path.splitext(raw_filename)[0] + "." + format
+
+
+def list_raw_inputs(input_dir=INPUT_DIR, format="csv", partitioned=False, years=None):
+    """
+    :param input_dir: directory holding the raw files or partitions.
+    :param format: format of the output files: csv or parquet (default: csv).
+    :param partitioned: list the year partitions of the directory instead of its raw files.
+    :param years: years of the partitions to list (None: all partitions).
+    :return: dict of ledger keys (raw filenames, or partition names such as "year=1915") to tuples of
+        the path of the raw input and the name of its output file, both relative to their directories.
+        Of several raw files with the same output name (e.g. X.json and X.ndjson.gz), only the most recent is listed.
+    """
+    if not partitioned:
+        inputs, sources = {}, {}
+        # most recent first, so it is the one kept when two raw files would write the same output file
+        raw_files = sorted(list_raw_files(input_dir), key=lambda x: os.path.getmtime(os.path.join(input_dir, x)),
+                           reverse=True)
+        for raw_filename in raw_files:
+            output_name = output_filename(raw_filename, format)
+            if output_name in sources:
+                print(f"Skipping {raw_filename}: the more recent {sources[output_name]} has the same output file "
+                      f"{output_name}")
+                continue
+            sources[output_name] = raw_filename
+            inputs[raw_filename] = (raw_filename, output_name)
+        return dict(sorted(inputs.items()))
+
+    # one output file per partition, so a rewritten partition replaces its previous output
+    return {entry["path"]: (os.path.join(entry["path"], entry["part"]),
+                            os.path.join(entry["path"], f"spotify_dataset_{year}.{format}"))
+            for year, entry in select_partitions(input_dir, years)}
+
+
+def load_ledger(ledger_path):
+    """
+    :param ledger_path: path of the ledger file.
+    :return: dict of raw filenames to their ledger entry, empty if there is no ledger yet.
+    """
+    if not os.path.exists(ledger_path):
+        return {}
+    with open(ledger_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_ledger(ledger, ledger_path):
+    """
+    Write the ledger atomically.
+
+    :param ledger: dict of raw filenames to their ledger entry.
+    :param ledger_path: path of the ledger file.
+    """
+    tmp_path = ledger_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(ledger, f, indent=4)
+    os.replace(tmp_path, ledger_path)
+
+
+def _transform_worker(input_file, output_file, format, streaming):
+    """
+    Transform one file in a worker process.
+
+    :return: tuple of the number of rows written and the stage timings of the file, for the parent's metrics.
+    """
+    # a worker process may be reused for several files, so only this file's stages are reported
+    metrics.stages.clear()
+    if streaming:
+        rows = transform_file_streaming(input_file, output_file, format=format)
+    else:
+        rows = transform_file(input_file, output_file, format=format)
+    return rows, dict(metrics.stages)
+
+
+def transform_pending_files(input_dir=INPUT_DIR, output_dir=OUTPUT_DIR, format="csv", streaming=False,
+                            max_workers=MAX_WORKERS, store_path=None, partitioned=False, years=None):
+    """
+    Transform every raw file that is not in the ledger yet, or whose content, output format,
+    or output file changed since it was transformed. Files are transformed in parallel in a process pool,
+    and the ledger is updated as each file finishes, so an interrupted backfill does not redo finished files.
+
+    :param input_dir: directory holding the raw files.
+    :param output_dir: directory for the transformed files and the ledger.
+    :param format: format of the output files: csv or parquet (default: csv).
+    :param streaming: transform each file in bounded-memory streaming mode.
+    :param max_workers: number of worker processes (None: one per CPU core).
+    :param store_path: optional path of the SQLite store to load the tracks into as well;
+        files not loaded into this store yet are pending too.
+    :param partitioned: transform the year partitions of input_dir instead of its raw files.
+        A partition is pending when its current part file was not transformed yet.
+    :param years: years of the partitions to transform (None: all partitions).
+    :return: list of paths of the files written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    ledger_path = os.path.join(output_dir, LEDGER_FILENAME)
+    ledger = load_ledger(ledger_path)
+    inputs = list_raw_inputs(input_dir, format, partitioned, years)
+
+    pending = {}
+    for key, (raw_path, output_name) in inputs.items():
+        entry = ledger.get(key)
+        fingerprint = file_fingerprint(os.path.join(input_dir, raw_path), entry)
+
+        if (entry is None
+                or entry["sha256"] != fingerprint["sha256"]
+                or entry["format"] != format
+                or (store_path and entry.get("store") != store_path)
+                or not os.path.exists(os.path.join(output_dir, entry["output"]))):
+            pending[key] = fingerprint
+        else:
+            # only the modification time may have changed; keep it so the hash is not recomputed next time
+            entry.update(fingerprint)
+
+    print(f"{len(pending)} raw {'partitions' if partitioned else 'files'} to transform")
+    written = []
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for key in pending:
+            raw_path, output_name = inputs[key]
+            output_file = os.path.join(output_dir, output_name)
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+            future = executor.submit(_transform_worker, os.path.join(input_dir, raw_path),
+                                     output_file, format, streaming)
+            futures[future] = (key, output_file)
+
+        for future in as_completed(futures):
+            key, output_file = futures[future]
+            raw_path, output_name = inputs[key]
+            rows, stages = future.result()
+            print(f"{rows} tracks saved to {output_file}")
+            for name, entry in stages.items():
+                metrics.add_stage(name, entry["seconds"], entry["count"])
+
+            # the store is written from this process only, as SQLite allows one writer at a time
+            if store_path:
+                load_into_store(os.path.join(input_dir, raw_path), store_path)
+
+            ledger[key] = dict(pending[key], output=output_name, format=format, rows=rows, store=store_path)
+            save_ledger(ledger, ledger_path)
+            written.append(output_file)
+
+    save_ledger(ledger, ledger_path)
+    return written
+
+
+def run(input_file=None, input_dir=None, output_dir=None, format=None, partitioned=None, years=None):
+    """
+    Transform raw data. Arguments left out default to the module settings.
+
+    :param input_file: path of the raw file to transform (default: the most recent raw file of input_dir,
+        or every pending file with TRANSFORM_ALL).
+    :param input_dir: directory holding the raw files or partitions (default: INPUT_DIR).
+    :param output_dir: directory for the transformed files (default: OUTPUT_DIR).
+    :param format: format of the output files: csv or parquet (default: OUTPUT_FORMAT).
+    :param partitioned: transform the year partitions of input_dir (default: PARTITIONED).
+    :param years: years of the partitions to transform (default: YEARS).
+    :return: list of paths of the files written.
+    """
+    input_dir = input_dir or INPUT_DIR
+    output_dir = output_dir or OUTPUT_DIR
+    format = format or OUTPUT_FORMAT
+    partitioned = PARTITIONED if partitioned is None else partitioned
+    years = YEARS if years is None else years
+    store_path = STORE_PATH if LOAD_STORE else None
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    if input_file is None and (TRANSFORM_ALL or partitioned):
+        return transform_pending_files(input_dir, output_dir, format=format, streaming=STREAMING,
+                                       store_path=store_path, partitioned=partitioned, years=years)
+
+    if input_file is None:
+        input_file = os.path.join(input_dir, find_latest_raw_file(input_dir))
+    print(f"Using input file: {input_file}")
+
+    tracks_path = os.path.join(output_dir, output_filename(os.path.basename(input_file), format))
+
+    if STREAMING:
+        rows = transform_file_streaming(input_file, tracks_path, format=format)
+    else:
+        rows = transform_file(input_file, tracks_path, format=format)
+
+    # confirm that the file was saved successfully
+    print(f"{rows} tracks saved to {tracks_path}")
+
+    if store_path:
+        rows = load_into_store(input_file, store_path)
+        print(f"{rows} tracks loaded into {store_path}")
+
+    return [tracks_path]
 
-# create the output filename based on the input filename, changing .json to .csv
-base_filename = os.path.splitext(json_files[0])[0]  # Remove the .json extension
-filename = base_filename + ".csv"  # Add the .csv extension
-tracks_csv_path = os.path.join(output_dir, filename)
 
-# save the DataFrame to a CSV file
-tracks_df.to_csv(tracks_csv_path, index=False, encoding='utf-8')
+def main():
+    run()
+    print(f"Run report saved to {write_run_report('transform')}")
 
-# confirm that the file was saved successfully
-print(f"Tracks saved to {tracks_csv_path}")
 
+if __name__ == "__main__":
+    main()